@@ -0,0 +1,219 @@
+"""Offline benchmark suite for the EIS read, ingest and rechunk paths.
+
+    python -m eis.benchmark run --size small --out results.json [--s3]
+    python -m eis.benchmark compare baseline.json results.json --threshold 0.15
+
+Startup benchmarks import each data-access module in a fresh interpreter (time, peak RSS) and time a dask worker start
+plus data-layer import; a data-access module that pulls in a visualization package is reported as a regression.
+Synthetic LIS-like datasets (time, north_south, east_west with DX/DY/SOUTH_WEST_CORNER_* attrs) and USGS-style gage
+files are generated in a temporary directory.  With --s3 the read benchmarks are repeated against a local moto S3 server.
+"""
+import os, sys, time, json, socket, tempfile, argparse, platform, subprocess, numpy as np
+import pandas as pd
+import xarray as xr
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+SIZES = dict( small=dict( nt=365, ny=128, nx=128, ngages=20 ),
+              medium=dict( nt=2*365, ny=512, nx=512, ngages=100 ),
+              large=dict( nt=5*365, ny=1024, nx=1024, ngages=500 ) )
+
+DATA_MODULES = [ 'eis.s3', 'eis.rechunk', 'eis.lis.data.gage', 'eis.lis.data.routing', 'eis.lis.data.combined', 'eis.lis.data.surface' ]
+VIZ_MODULES = [ 'holoviews', 'geoviews', 'panel', 'hvplot', 'geopandas', 'datashader', 'matplotlib', 'bokeh' ]
+
+def synthetic_lis_dataset( nt: int, ny: int, nx: int, **kwargs ) -> xr.Dataset:
+    dx, dy = kwargs.get( 'dx', 0.01 ), kwargs.get( 'dy', 0.01 )
+    (lat0, lon0) = kwargs.get( 'corner', ( 29.0, -94.0 ) )
+    rng = np.random.default_rng( kwargs.get( 'seed', 0 ) )
+    lat = np.broadcast_to( ( lat0 + dy * np.arange( ny, dtype=np.float32 ) )[:,None], (ny,nx) )
+    lon = np.broadcast_to( ( lon0 + dx * np.arange( nx, dtype=np.float32 ) )[None,:], (ny,nx) )
+    dims = ( 'time', 'north_south', 'east_west' )
+    dvars = { vname: ( dims, rng.gamma( 2.0, 50.0, size=(nt,ny,nx) ).astype( np.float32 ) ) for vname in [ 'Streamflow_tavg', 'RiverDepth_tavg' ] }
+    dvars['lat'] = ( ( 'north_south', 'east_west' ), lat.copy(), dict( units='degree_north' ) )
+    dvars['lon'] = ( ( 'north_south', 'east_west' ), lon.copy(), dict( units='degree_east' ) )
+    attrs = dict( DX=dx, DY=dy, SOUTH_WEST_CORNER_LAT=lat0, SOUTH_WEST_CORNER_LON=lon0 )
+    dset = xr.Dataset( dvars, coords=dict( time=pd.date_range( "2000-01-01", periods=nt, freq="D" ) ), attrs=attrs )
+    return dset.chunk( dict( time=1, north_south=ny, east_west=nx ) )
+
+def synthetic_gages( dset: xr.Dataset, ngages: int, gage_dir: str, seed: int = 0 ) -> Tuple[str,List[str]]:
+    rng = np.random.default_rng( seed )
+    os.makedirs( gage_dir, exist_ok=True )
+    (ny, nx) = ( dset.sizes['north_south'], dset.sizes['east_west'] )
+    (dx, dy, lat0, lon0) = [ float( dset.attrs[a] ) for a in [ 'DX', 'DY', 'SOUTH_WEST_CORNER_LAT', 'SOUTH_WEST_CORNER_LON' ] ]
+    header_file, gage_files, header = os.path.join( gage_dir, "header.txt" ), [], []
+    dates = pd.to_datetime( dset.time.values ).strftime( "%Y%m%d" )
+    for ig in range( ngages ):
+        gid = f"{7000000 + ig:08d}"
+        (iy, ix) = ( rng.integers( ny ), rng.integers( nx ) )
+        header.append( f"   {gid}  {ix}  {iy}  {lon0 + ix*dx:.4f}  {lat0 + iy*dy:.4f}" )
+        gage_file = os.path.join( gage_dir, f"{gid}.txt" )
+        with open( gage_file, "w" ) as f:
+            f.write( "\n".join( f"{d}   {v:.3f}" for d, v in zip( dates, rng.gamma( 2.0, 50.0, size=len(dates) ) ) ) + "\n" )
+        gage_files.append( gage_file )
+    with open( header_file, "w" ) as f: f.write( "\n".join( header ) + "\n" )
+    return header_file, gage_files
+
+def timeit( func: Callable, repeat: int = 3 ) -> Dict[str,Any]:
+    times = []
+    for _ in range( repeat ):
+        t0 = time.perf_counter()
+        func()
+        times.append( time.perf_counter() - t0 )
+    return dict( median=float( np.median( times ) ), min=float( np.min( times ) ), runs=times )
+
+def import_profile( module: str ) -> Dict[str,Any]:
+    """Imports module in a fresh interpreter: import time, peak RSS (MB) and the visualization packages it loaded."""
+    code = ( f"import sys, time, json, resource; t0 = time.perf_counter(); import {module}; t1 = time.perf_counter(); "
+             f"print( json.dumps( dict( time=t1-t0, rss_mb=resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024, "
+             f"viz=[ m for m in {VIZ_MODULES} if m in sys.modules ] ) ) )" )
+    output = subprocess.run( [ sys.executable, "-c", code ], capture_output=True, text=True, check=True ).stdout
+    return json.loads( output.strip().splitlines()[-1] )
+
+def _import_data_layer():
+    import eis.lis.data.routing, eis.lis.data.combined
+
+def worker_startup():
+    """Starts a single-process LocalCluster and imports the data-access layer on its worker."""
+    from dask.distributed import Client, LocalCluster
+    with LocalCluster( n_workers=1, threads_per_worker=1, processes=True ) as cluster, Client( cluster ) as client:
+        client.run( _import_data_layer )
+
+class LocalS3:
+    """moto S3 server on a free local port (requires moto[server])."""
+
+    def __init__( self, bucket: str = "eis-benchmark" ):
+        from moto.server import ThreadedMotoServer
+        with socket.socket() as sock:
+            sock.bind( ( "127.0.0.1", 0 ) )
+            self.port = sock.getsockname()[1]
+        for key in [ 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY' ]: os.environ.setdefault( key, 'benchmark' )
+        self.server = ThreadedMotoServer( ip_address="127.0.0.1", port=self.port )
+        self.server.start()
+        self.endpoint_url = f"http://127.0.0.1:{self.port}"
+        self.bucket = bucket
+
+    def __enter__(self) -> "LocalS3":
+        from eis.s3 import s3f, s3m
+        from eis.smce import eis3
+        s3f().configure( endpoint_url=self.endpoint_url )
+        s3m()._fs = None
+        eis3().s3 = s3f().get_fs()
+        s3f().get_fs().mkdir( self.bucket )
+        return self
+
+    def __exit__( self, *args ):
+        self.server.stop()
+
+class BenchmarkSuite:
+
+    def __init__( self, size: str = 'small', **kwargs ):
+        self.size = size
+        self.spec = SIZES[size]
+        self.repeat: int = kwargs.get( 'repeat', 3 )
+        self.npoints: int = kwargs.get( 'npoints', 10 )
+        self.work_dir: str = kwargs.get( 'work_dir', tempfile.mkdtemp( prefix="eis-benchmark-" ) )
+        self.results: Dict[str,Dict] = {}
+
+    def record( self, name: str, func: Callable, repeat: int = None ):
+        self.results[name] = timeit( func, self.repeat if repeat is None else repeat )
+        print( f" {name:40s} median = {self.results[name]['median']:.4f} sec" )
+
+    def run( self, s3: bool = False ) -> Dict[str,Any]:
+        self.run_startup()
+        from eis.rechunk import Rechunker
+        from eis.lis.data.routing import LISRoutingData
+        from eis.lis.data.gage import LISGageDataset
+        from eis.lis.data.combined import LISCombinedDataset
+        dset = synthetic_lis_dataset( **self.spec )
+        source_path = os.path.join( self.work_dir, "source.zarr" )
+        dset.to_zarr( source_path, mode='w', consolidated=True )
+        header_file, gage_files = synthetic_gages( dset, self.spec['ngages'], os.path.join( self.work_dir, "gages" ) )
+
+        rechunker = Rechunker.from_disk( source_path, cache_dir=os.path.join( self.work_dir, "cache" ) )
+        chunk_sizes = dict( time=self.spec['nt'], north_south=32, east_west=32 )
+        target = os.path.join( self.work_dir, "rechunked" )
+        self.record( 'rechunk', lambda: rechunker.rechunk( chunk_sizes, target_store=target, max_memory=200 ), repeat=1 )
+        self.run_reads( 'local', LISRoutingData.from_disk( f"{target}.zarr", consolidated=True ) )
+
+        self.record( 'gage.ingest', lambda: LISGageDataset( header_file, gage_files, cache=False ) )
+        cache_file = os.path.join( self.work_dir, "gages.parquet" )
+        LISGageDataset( header_file, gage_files, cache_file=cache_file )
+        self.record( 'gage.ingest_cached', lambda: LISGageDataset( header_file, gage_files, cache_file=cache_file ) )
+        gages = LISGageDataset( header_file, gage_files, cache_file=cache_file )
+        routing = LISRoutingData.from_disk( f"{target}.zarr", consolidated=True )
+        combined = LISCombinedDataset( gages, routing )
+        def aligned_reads():
+            combined.invalidate()
+            for gage_index in range( min( self.npoints, len( gage_files ) ) ):
+                combined.get_aligned_data( gage_index, 'Streamflow_tavg' )
+        self.record( 'combined.get_aligned_data', aligned_reads )
+
+        if s3:
+            from eis.s3 import s3m
+            with LocalS3() as ls3:
+                s3_path = f"s3://{ls3.bucket}/rechunked"
+                s3m().upload_store( f"{target}.zarr", f"{s3_path}.zarr" )
+                self.run_reads( 's3', LISRoutingData.from_smce( ls3.bucket, "rechunked" ) )
+        return self.report()
+
+    def run_startup(self):
+        for module in DATA_MODULES:
+            profiles = [ import_profile( module ) for _ in range( self.repeat ) ]
+            times = [ p['time'] for p in profiles ]
+            self.results[f'import.{module}'] = dict( median=float( np.median( times ) ), min=float( np.min( times ) ), runs=times,
+                                                     rss_mb=max( p['rss_mb'] for p in profiles ), viz=profiles[0]['viz'] )
+            print( f" {'import.'+module:40s} median = {np.median( times ):.4f} sec, rss = {self.results[f'import.{module}']['rss_mb']:.0f} MB, viz = {profiles[0]['viz']}" )
+        self.record( 'worker.startup', worker_startup, repeat=1 )
+
+    def run_reads( self, tag: str, routing ):
+        rng = np.random.default_rng( 1 )
+        lons = rng.uniform( routing._x0, routing._x1, self.npoints )
+        lats = rng.uniform( routing._y0, routing._y1, self.npoints )
+        vname = 'Streamflow_tavg'
+        self.record( f'{tag}.var_data', lambda: [ routing.var_data( vname, x, y ).values for x,y in zip( lons, lats ) ] )
+        ics = routing.get_site_indices( lons, lats )
+        self.record( f'{tag}.site_data', lambda: [ routing.site_data( vname, routing._lon[ix], routing._lat[iy] ).values for ix,iy in zip( ics['lon'], ics['lat'] ) ] )
+        sites = pd.DataFrame( dict( id=[ str(i) for i in range( self.npoints ) ], lon=lons, lat=lats ) )
+        self.record( f'{tag}.sites_data', lambda: routing.sites_data( vname, sites ).values )
+        self.record( f'{tag}.var_image', lambda: routing.variable( vname ).isel( time=0 ).values )
+
+    def report(self) -> Dict[str,Any]:
+        meta = dict( size=self.size, spec=self.spec, timestamp=time.strftime( "%Y-%m-%dT%H:%M:%S" ), host=socket.gethostname(),
+                     python=platform.python_version(), xarray=xr.__version__ )
+        return dict( meta=meta, results=self.results )
+
+def compare( baseline: Dict, current: Dict, threshold: float = 0.15 ) -> pd.DataFrame:
+    """Median-time ratios (current/baseline) per benchmark; ratios above 1+threshold, and data-access imports that load
+       visualization packages, are flagged as regressions."""
+    rows = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']: continue
+        ratio = result['median'] / baseline['results'][name]['median']
+        rows.append( dict( benchmark=name, baseline=baseline['results'][name]['median'], current=result['median'], ratio=ratio, regression=( ratio > 1 + threshold ) or bool( result.get( 'viz' ) ) ) )
+    return pd.DataFrame( rows ).set_index( 'benchmark' )
+
+def main( argv: List[str] = None ):
+    parser = argparse.ArgumentParser( prog="eis.benchmark" )
+    commands = parser.add_subparsers( dest='command', required=True )
+    run_parser = commands.add_parser( 'run' )
+    run_parser.add_argument( '--size', choices=list( SIZES.keys() ), default='small' )
+    run_parser.add_argument( '--repeat', type=int, default=3 )
+    run_parser.add_argument( '--s3', action='store_true', help="also benchmark reads through a local moto S3 server" )
+    run_parser.add_argument( '--out', default="benchmark.json" )
+    compare_parser = commands.add_parser( 'compare' )
+    compare_parser.add_argument( 'baseline' )
+    compare_parser.add_argument( 'current' )
+    compare_parser.add_argument( '--threshold', type=float, default=0.15 )
+    args = parser.parse_args( argv )
+    if args.command == 'run':
+        results = BenchmarkSuite( args.size, repeat=args.repeat ).run( s3=args.s3 )
+        with open( args.out, "w" ) as f: json.dump( results, f, indent=2 )
+        print( f"Results written to {args.out}" )
+    else:
+        with open( args.baseline ) as f: baseline = json.load( f )
+        with open( args.current ) as f: current = json.load( f )
+        table = compare( baseline, current, args.threshold )
+        print( table.to_string() )
+        if table['regression'].any(): sys.exit( 1 )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os, time, sqlite3, threading, hashlib
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+from collections.abc import MutableMapping
+from fsspec import AbstractFileSystem
+from .cluster import cim
+
+class ChunkCache(MutableMapping):
+    """Persistent read-through cache of zarr store objects on local disk.
+       Entries are keyed by (store path, key), validated against the object ETag (at most once per `ttl` seconds)
+       and evicted least-recently-used when the cache grows beyond `max_size` bytes.  Metadata objects (.zmetadata,
+       .zarray, .zattrs, .zgroup) are revalidated on every read, and a changed .zmetadata ETag drops every cached
+       entry under its group, so chunks of a rewritten or extended store are never served stale."""
+
+    metadata_keys = { '.zmetadata', '.zarray', '.zattrs', '.zgroup' }
+
+    def __init__( self, fs: AbstractFileSystem, path: str, cache_dir: str, **kwargs ):
+        self.fs = fs
+        self.root: str = path.split("://")[-1].rstrip("/")
+        self.cache_dir = os.path.join( cache_dir, "chunks" )
+        self.max_size: int = int( kwargs.get( 'max_size_gb', 10 ) * 1.0e9 )
+        self.ttl: float = kwargs.get( 'ttl', 3600.0 )
+        self.hits, self.misses, self.evictions, self.validations = 0, 0, 0, 0
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection = None
+        os.makedirs( self.cache_dir, exist_ok=True )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_db'], state['_lock'] = None, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update( state )
+        self._lock = threading.Lock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect( os.path.join( self.cache_dir, "index.db" ), timeout=60, check_same_thread=False, isolation_level=None )
+            self._db.execute( "CREATE TABLE IF NOT EXISTS entries ( path TEXT PRIMARY KEY, etag TEXT, size INTEGER, atime REAL, validated REAL )" )
+            self._db.execute( "CREATE INDEX IF NOT EXISTS entries_atime ON entries ( atime )" )
+        return self._db
+
+    def _remote_path( self, key: str ) -> str:
+        return f"{self.root}/{key}"
+
+    def _local_path( self, rpath: str ) -> str:
+        digest = hashlib.sha1( rpath.encode() ).hexdigest()
+        return os.path.join( self.cache_dir, digest[:2], digest )
+
+    def _etag( self, rpath: str ) -> Optional[str]:
+        info = self.fs.info( rpath, refresh=True )
+        return info.get( 'ETag', info.get( 'etag', None ) )
+
+    def _fetch( self, rpath: str ) -> Tuple[bytes,Optional[str]]:
+        """(data, ETag) of a remote object: a single GET on s3 (the ETag comes with the response), cat + info elsewhere."""
+        if not hasattr( self.fs, '_call_s3' ):
+            return self.fs.cat( rpath ), self._etag( rpath )
+        from fsspec.asyn import sync
+        (bucket, key, _) = self.fs.split_path( rpath )
+        async def get_object():
+            response = await self.fs._call_s3( 'get_object', Bucket=bucket, Key=key )
+            try:     return await response['Body'].read(), response.get( 'ETag', None )
+            finally: response['Body'].close()
+        return sync( self.fs.loop, get_object )
+
+    def _count( self, counter: str ):
+        with self._lock:
+            setattr( self, counter, getattr( self, counter ) + 1 )
+
+    def __getitem__( self, key: str ) -> bytes:
+        rpath, now = self._remote_path( key ), time.time()
+        with self._lock:
+            entry = self.db.execute( "SELECT etag, validated FROM entries WHERE path=?", (rpath,) ).fetchone()
+        lpath, name = self._local_path( rpath ), key.rsplit( "/", 1 )[-1]
+        try:
+            if entry is not None:
+                (etag, validated) = entry
+                if ( name in self.metadata_keys ) or ( now - validated > self.ttl ):
+                    self._count( 'validations' )
+                    if self._etag( rpath ) != etag: raise ValueError( "stale" )
+                    validated = now
+                with open( lpath, 'rb' ) as f: data = f.read()
+                with self._lock:
+                    self.db.execute( "UPDATE entries SET atime=?, validated=? WHERE path=?", ( now, validated, rpath ) )
+                self._count( 'hits' )
+                cim().count( 'cache.bytes_hit', len(data) )
+                return data
+        except ( OSError, ValueError ):
+            pass
+        try:
+            (data, etag) = self._fetch( rpath )
+        except FileNotFoundError:
+            raise KeyError( key )
+        self._count( 'misses' )
+        cim().count( 's3.bytes_read', len(data) )
+        if ( name == '.zmetadata' ) and ( ( entry is None ) or ( entry[0] != etag ) ):
+            self.invalidate_group( rpath.rsplit( "/", 1 )[0] )
+        self._insert( rpath, lpath, etag, data, now )
+        return data
+
+    def _insert( self, rpath: str, lpath: str, etag: Optional[str], data: bytes, now: float ):
+        os.makedirs( os.path.dirname( lpath ), exist_ok=True )
+        tmp_path = f"{lpath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open( tmp_path, 'wb' ) as f: f.write( data )
+        os.replace( tmp_path, lpath )
+        with self._lock:
+            self.db.execute( "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?)", ( rpath, etag, len(data), now, now ) )
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = self.db.execute( "SELECT COALESCE(SUM(size),0) FROM entries" ).fetchone()[0]
+            if total <= self.max_size: return
+            for (rpath, size) in self.db.execute( "SELECT path, size FROM entries ORDER BY atime" ).fetchall():
+                if total <= 0.9 * self.max_size: break
+                try:                os.remove( self._local_path( rpath ) )
+                except OSError:     pass
+                self.db.execute( "DELETE FROM entries WHERE path=?", (rpath,) )
+                total -= size
+                self.evictions += 1
+
+    def invalidate( self, key: str ):
+        rpath = self._remote_path( key )
+        with self._lock:
+            self.db.execute( "DELETE FROM entries WHERE path=?", (rpath,) )
+        try:                os.remove( self._local_path( rpath ) )
+        except OSError:     pass
+
+    def invalidate_group( self, group_path: str ):
+        """Drops every cached entry under group_path (a remote path), e.g. when the group's consolidated metadata changed."""
+        prefix = f"{group_path}/"
+        with self._lock:
+            rpaths = [ r[0] for r in self.db.execute( "SELECT path FROM entries WHERE substr(path,1,?)=?", ( len(prefix), prefix ) ).fetchall() ]
+            self.db.execute( "DELETE FROM entries WHERE substr(path,1,?)=?", ( len(prefix), prefix ) )
+        for rpath in rpaths:
+            try:                os.remove( self._local_path( rpath ) )
+            except OSError:     pass
+
+    def __setitem__( self, key: str, value ):
+        self.fs.pipe_file( self._remote_path( key ), bytes( value ) )
+        self.invalidate( key )
+
+    def __delitem__( self, key: str ):
+        self.fs.rm( self._remote_path( key ) )
+        self.invalidate( key )
+
+    def __contains__( self, key ) -> bool:
+        rpath = self._remote_path( key )
+        with self._lock:
+            if self.db.execute( "SELECT 1 FROM entries WHERE path=?", (rpath,) ).fetchone() is not None: return True
+        return self.fs.exists( rpath )
+
+    def __iter__(self):
+        for path in self.fs.find( self.root ):
+            yield path[ len(self.root)+1: ]
+
+    def __len__(self) -> int:
+        return len( self.fs.find( self.root ) )
+
+    @property
+    def stats(self) -> Dict[str,int]:
+        with self._lock:
+            (nentries, size) = self.db.execute( "SELECT COUNT(*), COALESCE(SUM(size),0) FROM entries" ).fetchone()
+        return dict( hits=self.hits, misses=self.misses, validations=self.validations, evictions=self.evictions, entries=nentries, size=size )
+
+    def __repr__(self):
+        return f"ChunkCache(s3://{self.root}, {self.stats})"
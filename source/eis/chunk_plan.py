@@ -0,0 +1,85 @@
+import math, numpy as np
+import xarray as xr
+import pandas as pd
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+# Read patterns supported by the planner: a full-record series at one grid cell, or a full-domain map at one time step.
+ACCESS_PATTERNS = [ 'timeseries', 'map' ]
+
+def parse_access( access: Union[str,Dict[str,float]] ) -> Dict[str,float]:
+    weights = { access: 1.0 } if isinstance( access, str ) else dict( access )
+    for pattern in weights.keys():
+        assert pattern in ACCESS_PATTERNS, f"Unknown access pattern '{pattern}', must be one of {ACCESS_PATTERNS}"
+    total = sum( weights.values() )
+    return { p: w/total for p,w in weights.items() }
+
+class ChunkPlan:
+
+    def __init__( self, access: Dict[str,float], chunks: Dict[str,Dict[str,int]], max_memory: int, report: pd.DataFrame ):
+        self.access = access
+        self.chunks = chunks
+        self.max_memory = max_memory
+        self.report = report
+
+    def __repr__(self):
+        return f"ChunkPlan(access={self.access}, max_memory={self.max_memory} MB)\n{self.report.to_string()}"
+
+class ChunkPlanner:
+    """Chooses per-variable target chunks by minimizing a simple object-store read-cost model:
+       cost = n_objects * latency + bytes_read / bandwidth, weighted over the requested access patterns."""
+
+    def __init__( self, dset: xr.Dataset, **kwargs ):
+        self.dset = dset
+        self.time_dim: str = kwargs.get( 'time_dim', 'time' )
+        self.latency: float = kwargs.get( 'latency', 0.03 )                     # sec per object request
+        self.bandwidth: float = kwargs.get( 'bandwidth', 100.0 ) * 1.0e6        # bytes per sec
+        self.min_chunk_bytes: float = kwargs.get( 'min_chunk_mb', 1 ) * 1.0e6
+        self.max_chunk_bytes: float = kwargs.get( 'max_chunk_mb', 64 ) * 1.0e6
+
+    @staticmethod
+    def _candidates( size: int ) -> List[int]:
+        cands = { min( 2**i, size ) for i in range( int( math.log2( max(size,1) ) ) + 2 ) }
+        return sorted( cands | { size } )
+
+    def access_cost( self, pattern: str, sizes: Dict[str,int], chunks: Dict[str,int], itemsize: int ) -> Tuple[int,float]:
+        """Returns (objects read, estimated read time in sec) for one access of the given pattern."""
+        chunk_bytes = itemsize * np.prod( list( chunks.values() ) )
+        if pattern == 'timeseries':
+            nobj = math.ceil( sizes[self.time_dim] / chunks[self.time_dim] ) if self.time_dim in sizes else 1
+        else:
+            nobj = int( np.prod( [ math.ceil( sizes[d] / chunks[d] ) for d in sizes if d != self.time_dim ] ) )
+        return nobj, nobj * self.latency + nobj * chunk_bytes / self.bandwidth
+
+    def plan_variable( self, v: xr.DataArray, access: Dict[str,float] ) -> Dict[str,int]:
+        sizes: Dict[str,int] = dict( v.sizes )
+        sdims = [ d for d in v.dims if d != self.time_dim ]
+        tcands = self._candidates( sizes[self.time_dim] ) if self.time_dim in sizes else [ None ]
+        scands = self._candidates( max( [ sizes[d] for d in sdims ], default=1 ) )
+        best, best_cost = None, np.inf
+        for ct in tcands:
+            for cs in scands:
+                chunks = { d: ( ct if d == self.time_dim else min( cs, sizes[d] ) ) for d in v.dims }
+                nbytes = v.dtype.itemsize * np.prod( list( chunks.values() ) )
+                if ( nbytes > self.max_chunk_bytes ) or ( ( nbytes < self.min_chunk_bytes ) and ( nbytes < v.nbytes ) ): continue
+                cost = sum( w * self.access_cost( p, sizes, chunks, v.dtype.itemsize )[1] for p,w in access.items() )
+                if cost < best_cost: best, best_cost = chunks, cost
+        if best is None: best = { d: sizes[d] for d in v.dims }
+        return best
+
+    def plan( self, access: Union[str,Dict[str,float]], **kwargs ) -> ChunkPlan:
+        weights = parse_access( access )
+        chunks, rows, max_bytes = {}, [], 0
+        for (vname, v) in self.dset.data_vars.items():
+            vchunks = self.plan_variable( v, weights )
+            chunks[vname] = vchunks
+            chunk_bytes = v.dtype.itemsize * np.prod( list( vchunks.values() ) )
+            src_bytes = v.dtype.itemsize * np.prod( [ c[0] for c in v.chunks ] ) if v.chunks else v.nbytes
+            max_bytes = max( max_bytes, chunk_bytes, src_bytes )
+            row = dict( variable=vname, chunks=vchunks, objects=int( np.prod( [ math.ceil( v.sizes[d] / c ) for d,c in vchunks.items() ] ) ), chunk_mb=chunk_bytes / 1.0e6 )
+            for pattern in ACCESS_PATTERNS:
+                (nobj, cost) = self.access_cost( pattern, dict( v.sizes ), vchunks, v.dtype.itemsize )
+                row[ f"{pattern}_objects" ] = nobj
+                row[ f"{pattern}_sec" ] = cost
+            rows.append( row )
+        max_memory = kwargs.get( 'max_memory', int( math.ceil( 4 * max_bytes / 1.0e6 ) ) )
+        return ChunkPlan( weights, chunks, max_memory, pd.DataFrame( rows ).set_index( 'variable' ) )
@@ -1,26 +1,87 @@
-import logging, numpy as np
+import logging, time, json, threading, functools, numpy as np
+from collections import deque
+from contextlib import contextmanager
 from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
-from dask.distributed import Client, LocalCluster
 from dask.diagnostics import ProgressBar, Profiler, ResourceProfiler, CacheProfiler
 from .base import EISSingleton
+from .s3 import s3f
+
+class ClusterPolicy:
+    """Derives LocalCluster settings from the host (cores, RAM) and the job type:
+         'io'  - S3 reads/writes: few processes, many threads each (threads mostly wait on the network)
+         'cpu' - rechunk/compression/metrics: one single-threaded process per core (avoids GIL contention)
+         'mixed' - in between: processes with two threads each."""
+
+    JOB_TYPES = [ 'io', 'cpu', 'mixed' ]
+
+    def __init__( self, job_type: str = 'mixed', **kwargs ):
+        import psutil
+        assert job_type in self.JOB_TYPES, f"Unknown job type '{job_type}', must be one of {self.JOB_TYPES}"
+        self.job_type = job_type
+        self.cores: int = kwargs.get( 'cores', len( psutil.Process().cpu_affinity() ) if hasattr( psutil.Process, 'cpu_affinity' ) else psutil.cpu_count() )
+        self.memory: int = kwargs.get( 'memory', psutil.virtual_memory().total )
+        self.memory_fraction: float = kwargs.get( 'memory_fraction', 0.85 )
+
+    def cluster_kwargs(self) -> Dict[str,Any]:
+        if self.job_type == 'io':    (nworkers, nthreads) = ( max( 1, self.cores // 4 ), 8 )
+        elif self.job_type == 'cpu': (nworkers, nthreads) = ( self.cores, 1 )
+        else:                        (nworkers, nthreads) = ( max( 1, self.cores // 2 ), 2 )
+        memory_limit = int( self.memory * self.memory_fraction / nworkers )
+        return dict( n_workers=nworkers, threads_per_worker=nthreads, memory_limit=memory_limit, processes=True )
+
+    def adapt_bounds(self) -> Tuple[int,int]:
+        nworkers = self.cluster_kwargs()['n_workers']
+        return ( 1, nworkers )
 
 class DaskClusterManager(EISSingleton):
 
     def __init__(self, *args, **kwargs ):
         super(DaskClusterManager, self).__init__()
-        self._client: Client = None
-        self._cluster: LocalCluster = None
+        self._client: "Client" = None
+        self._cluster: "LocalCluster" = None
+        self._cluster_spec: Dict = None
         self._pbar = ProgressBar(dt=5)
 
-    def init_cluster( self, **kwargs ) -> Client:
+    def init_cluster( self, **kwargs ) -> "Client":
+        """Starts (or reuses) a LocalCluster.  With job_type ('io', 'cpu', 'mixed') the worker count, threads per worker and
+           memory limit are derived from the host by ClusterPolicy; explicit LocalCluster kwargs override them.
+           adaptive=True (default with a job_type) scales between minimum/maximum workers.  A healthy running cluster
+           with the same spec is reused unless restart=True."""
+        job_type = kwargs.pop( 'job_type', None )
+        restart = kwargs.pop( 'restart', False )
+        adaptive = kwargs.pop( 'adaptive', job_type is not None )
+        (minimum, maximum) = ( kwargs.pop( 'minimum', None ), kwargs.pop( 'maximum', None ) )
+        if job_type is not None:
+            policy = ClusterPolicy( job_type )
+            kwargs = dict( policy.cluster_kwargs(), **kwargs )
+            (pmin, pmax) = policy.adapt_bounds()
+            (minimum, maximum) = ( pmin if minimum is None else minimum, pmax if maximum is None else maximum )
+        spec = dict( kwargs, adaptive=adaptive, minimum=minimum, maximum=maximum )
+        if not restart and self.healthy and ( spec == self._cluster_spec ):
+            return self._client
+        from dask.distributed import Client, LocalCluster
         self.shutdown()
         self._cluster = LocalCluster( **kwargs )
+        if adaptive:
+            self._cluster.adapt( minimum=( 1 if minimum is None else minimum ), maximum=( kwargs.get( 'n_workers', 1 ) if maximum is None else maximum ) )
         self._client = Client( self._cluster )
+        self._cluster_spec = spec
+        s3f().configure_workers( self._client )
+        from eis.smce import eis3
+        eis3().forward_worker_logs( self._client )
         self._pbar.register()
         return self._client
 
     @property
-    def client(self) -> Client:
+    def healthy(self) -> bool:
+        if (self._client is None) or (self._cluster is None): return False
+        try:
+            return ( self._client.status == 'running' ) and ( len( self._client.scheduler_info( )['workers'] ) > 0 or self._cluster_spec.get('adaptive',False) )
+        except Exception:
+            return False
+
+    @property
+    def client(self) -> "Client":
         return self._client
 
     def shutdown(self):
@@ -30,22 +91,30 @@ class DaskClusterManager(EISSingleton):
             self._pbar.unregister()
             self._cluster = None
             self._client = None
+            self._cluster_spec = None
 
 def dcm(): return DaskClusterManager.instance()
 
 
 
 class ClusterInformationManager(EISSingleton):
+    """Process-wide parameters and performance metrics: timing histograms (`timer`/`timed`), counters (`count`, e.g.
+       s3 bytes read), and dask task/resource profiles (`profile`).  Metrics export to JSON or Prometheus text format."""
 
     def __init__( self ):
         super(ClusterInformationManager, self).__init__()
         self._parameters = {}
+        self._counters: Dict[str,float] = {}
+        self._profiles: Dict[str,Dict] = {}
+        self._lock = threading.Lock()
+        self.max_samples = 10000
 
     def set( self, pname: str, pval ):
         self._parameters[ pname ] = pval
 
     def add( self, pname: str, pval ):
-        self._parameters.setdefault( pname, [] ).append( pval )
+        with self._lock:
+            self._parameters.setdefault( pname, deque( maxlen=self.max_samples ) ).append( pval )
 
     def get( self, pname, default = None ):
         return self._parameters.get( pname, default )
@@ -53,6 +122,86 @@ class ClusterInformationManager(EISSingleton):
     def ave( self, pname ):
         return np.array( self.get( pname ) ).mean()
 
+    def percentiles( self, pname: str, q: List[float] = ( 50, 90, 99 ) ) -> Dict[float,float]:
+        values = np.array( self.get( pname, [] ), dtype=np.float64 )
+        return { p: float( np.percentile( values, p ) ) if values.size else np.nan for p in q }
+
+    def count( self, cname: str, value: float = 1 ):
+        with self._lock:
+            self._counters[cname] = self._counters.get( cname, 0 ) + value
+
+    def counter( self, cname: str ) -> float:
+        return self._counters.get( cname, 0 )
+
+    @contextmanager
+    def timer( self, pname: str ):
+        """Records the elapsed time (sec) of the block into the histogram pname."""
+        t0 = time.perf_counter()
+        try:     yield
+        finally: self.add( pname, time.perf_counter() - t0 )
+
+    @contextmanager
+    def profile( self, pname: str, dt: float = 0.25 ):
+        """Captures a dask profile of the block: per-task timings and memory/cpu samples for the local scheduler, plus the
+           task stream when a distributed client is active.  The block's wall time is recorded into the histogram pname and
+           its task count into the counter '<pname>.tasks'."""
+        from dask.distributed import get_task_stream
+        client = dcm().client
+        t0 = time.perf_counter()
+        with Profiler() as prof, ResourceProfiler( dt=dt ) as rprof:
+            if client is None:
+                yield
+                stream = []
+            else:
+                with get_task_stream( client ) as ts:
+                    yield
+                stream = ts.data
+        wall_time = time.perf_counter() - t0
+        tasks: Dict[str,float] = {}
+        for r in prof.results:
+            prefix = str( r.key[0] if isinstance( r.key, tuple ) else r.key ).split('-')[0]
+            tasks[prefix] = tasks.get( prefix, 0.0 ) + ( r.end_time - r.start_time )
+        for t in stream:
+            prefix = str( t['key'] ).strip("('").split('-')[0]
+            duration = sum( s['stop'] - s['start'] for s in t['startstops'] if s['action'] == 'compute' )
+            tasks[prefix] = tasks.get( prefix, 0.0 ) + duration
+        ntasks = len( prof.results ) + len( stream )
+        self._profiles[pname] = dict( wall_time=wall_time, ntasks=ntasks, task_time=tasks,
+                                      peak_memory_mb=max( [ r.mem for r in rprof.results ], default=0.0 ),
+                                      mean_cpu=float( np.mean( [ r.cpu for r in rprof.results ] ) ) if rprof.results else 0.0 )
+        self.add( pname, wall_time )
+        self.count( f"{pname}.tasks", ntasks )
+
+    def summary(self) -> Dict[str,Any]:
+        histograms = { pname: dict( count=len(v), mean=float( np.mean(v) ), **{ f"p{q}": pv for q,pv in self.percentiles( pname ).items() } )
+                       for pname, v in self._parameters.items() if isinstance( v, deque ) and len(v) }
+        return dict( histograms=histograms, counters=dict( self._counters ), profiles=dict( self._profiles ) )
+
+    def export( self, path: str ):
+        with open( path, "w" ) as f:
+            json.dump( self.summary(), f, indent=2, default=str )
+
+    def prometheus(self) -> str:
+        """Metrics in Prometheus text exposition format (histograms as summaries with 0.5/0.9/0.99 quantiles, and the
+           latest profile of each name as gauges: peak memory, mean cpu and task seconds per task prefix)."""
+        def metric( name: str ) -> str: return "eis_" + "".join( c if c.isalnum() else "_" for c in name )
+        lines = []
+        for pname, v in self._parameters.items():
+            if not isinstance( v, deque ) or not len(v): continue
+            mname = metric( pname )
+            lines.append( f"# TYPE {mname} summary" )
+            for q, pv in self.percentiles( pname ).items(): lines.append( f'{mname}{{quantile="{q/100}"}} {pv}' )
+            lines += [ f"{mname}_sum {float(np.sum(v))}", f"{mname}_count {len(v)}" ]
+        for cname, value in self._counters.items():
+            lines += [ f"# TYPE {metric(cname)}_total counter", f"{metric(cname)}_total {value}" ]
+        for pname, prof in self._profiles.items():
+            mname = metric( pname )
+            lines += [ f"# TYPE {mname}_peak_memory_mb gauge", f"{mname}_peak_memory_mb {prof['peak_memory_mb']}",
+                       f"# TYPE {mname}_mean_cpu gauge", f"{mname}_mean_cpu {prof['mean_cpu']}",
+                       f"# TYPE {mname}_task_seconds gauge" ]
+            lines += [ f'{mname}_task_seconds{{prefix="{prefix}"}} {seconds}' for prefix, seconds in prof['task_time'].items() ]
+        return "\n".join( lines ) + "\n"
+
     def test_equal( self, pname, pvalue ):
         if pname in self._parameters:
             return  ( pvalue == self._parameters[pname] )
@@ -60,4 +209,14 @@ class ClusterInformationManager(EISSingleton):
             self.set( pname, pvalue )
             return True
 
-def cim(): return ClusterInformationManager.instance()
\ No newline at end of file
+def cim(): return ClusterInformationManager.instance()
+
+def timed( pname: str ):
+    """Decorator recording each call's duration into the cim() histogram pname."""
+    def decorator( func ):
+        @functools.wraps( func )
+        def wrapper( *args, **kwargs ):
+            with cim().timer( pname ):
+                return func( *args, **kwargs )
+        return wrapper
+    return decorator
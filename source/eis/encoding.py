@@ -0,0 +1,129 @@
+import time, numpy as np
+import xarray as xr
+import pandas as pd
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+SHUFFLES = [ 'noshuffle', 'shuffle', 'bitshuffle' ]
+
+class EncodingProfile:
+    """Zarr encoding of a variable: a Blosc compressor (cname, clevel, shuffle), an optional storage dtype, and optional
+       lossy precision for float variables, declared either as keepbits (mantissa bits kept by bit-rounding, i.e. a
+       relative precision of 2**-keepbits) or digits (decimal digits kept by Quantize, i.e. an absolute precision of 10**-digits)."""
+
+    def __init__( self, cname: str = 'zstd', clevel: int = 5, shuffle: str = 'shuffle', **kwargs ):
+        assert shuffle in SHUFFLES, f"Unknown shuffle '{shuffle}', must be one of {SHUFFLES}"
+        self.cname, self.clevel, self.shuffle = cname, clevel, shuffle
+        self.dtype: Optional[str] = kwargs.get( 'dtype', None )
+        self.keepbits: Optional[int] = kwargs.get( 'keepbits', None )
+        self.digits: Optional[int] = kwargs.get( 'digits', None )
+        assert ( self.keepbits is None ) or ( self.digits is None ), "Declare precision with either keepbits or digits, not both"
+
+    @property
+    def lossy(self) -> bool:
+        return ( self.keepbits is not None ) or ( self.digits is not None )
+
+    @property
+    def precision(self) -> Optional[str]:
+        if self.keepbits is not None: return f"bitround keepbits={self.keepbits}"
+        if self.digits is not None:   return f"quantize digits={self.digits}"
+        return None
+
+    def compressor(self):
+        from numcodecs import Blosc
+        return Blosc( cname=self.cname, clevel=self.clevel, shuffle=SHUFFLES.index( self.shuffle ) )
+
+    def filters( self, dtype: np.dtype ) -> List:
+        if not np.issubdtype( dtype, np.floating ): return []
+        if self.keepbits is not None:
+            from numcodecs import BitRound
+            return [ BitRound( keepbits=self.keepbits ) ]
+        if self.digits is not None:
+            from numcodecs import Quantize
+            return [ Quantize( digits=self.digits, dtype=dtype ) ]
+        return []
+
+    def storage_dtype( self, v: xr.DataArray ) -> np.dtype:
+        return np.dtype( self.dtype ) if ( self.dtype is not None ) and np.issubdtype( v.dtype, np.floating ) else v.dtype
+
+    def encoding( self, v: xr.DataArray ) -> Dict[str,Any]:
+        """Zarr encoding (xarray to_zarr / rechunker target_options) for variable v."""
+        dtype = self.storage_dtype( v )
+        encoding = dict( compressor=self.compressor(), filters=self.filters( dtype ) )
+        if dtype != v.dtype: encoding['dtype'] = dtype
+        return encoding
+
+    def __repr__(self):
+        return f"EncodingProfile({self.cname}, clevel={self.clevel}, {self.shuffle}{', dtype='+self.dtype if self.dtype else ''}{', '+self.precision if self.lossy else ''})"
+
+ENCODING_PROFILES: Dict[str,EncodingProfile] = dict(
+    fast=     EncodingProfile( 'lz4',  clevel=5, shuffle='shuffle' ),
+    balanced= EncodingProfile( 'zstd', clevel=5, shuffle='shuffle' ),
+    archive=  EncodingProfile( 'zstd', clevel=9, shuffle='bitshuffle' ),
+)
+
+def get_profile( profile: Union[str,EncodingProfile] ) -> EncodingProfile:
+    if isinstance( profile, EncodingProfile ): return profile
+    assert profile in ENCODING_PROFILES, f"Unknown encoding profile '{profile}', must be one of {list(ENCODING_PROFILES.keys())}"
+    return ENCODING_PROFILES[profile]
+
+def resolve_profiles( dset: xr.Dataset, encoding: Union[str,EncodingProfile,Dict[str,Union[str,EncodingProfile]]] ) -> Dict[str,EncodingProfile]:
+    """Per data variable profiles from a single profile (all variables) or a {vname: profile} dict (others keep zarr defaults)."""
+    if encoding is None: return {}
+    if isinstance( encoding, dict ): return { vname: get_profile( p ) for vname, p in encoding.items() if vname in dset.data_vars }
+    return { vname: get_profile( encoding ) for vname in dset.data_vars }
+
+class EncodingBenchmark:
+    """Samples a few target-sized chunks of each variable and measures, per candidate profile, the compression ratio,
+       encode/decode throughput (MB/s of uncompressed data) and, for lossy profiles, the maximum absolute error."""
+
+    def __init__( self, dset: xr.Dataset, chunks: Dict[str,Dict[str,int]], **kwargs ):
+        self.dset = dset
+        self.chunks = chunks
+        self.nsamples: int = kwargs.get( 'nsamples', 3 )
+        self.seed: int = kwargs.get( 'seed', 0 )
+
+    def samples( self, vname: str ) -> List[np.ndarray]:
+        v: xr.DataArray = self.dset[vname]
+        rng = np.random.default_rng( self.seed )
+        vchunks = self.chunks[vname]
+        samples = []
+        for _ in range( self.nsamples ):
+            region = {}
+            for d in v.dims:
+                nchunks = -( -v.sizes[d] // vchunks[d] )
+                start = int( rng.integers( nchunks ) ) * vchunks[d]
+                region[d] = slice( start, min( start + vchunks[d], v.sizes[d] ) )
+            samples.append( np.ascontiguousarray( v.isel( region ).values ) )
+        return samples
+
+    @staticmethod
+    def measure( profile: EncodingProfile, data: np.ndarray ) -> Dict[str,float]:
+        from numcodecs.compat import ensure_ndarray
+        dtype = np.dtype( profile.dtype ) if ( profile.dtype is not None ) and np.issubdtype( data.dtype, np.floating ) else data.dtype
+        (filters, compressor) = ( profile.filters( dtype ), profile.compressor() )
+        t0 = time.perf_counter()
+        encoded = data.astype( dtype, copy=False )
+        for f in filters: encoded = f.encode( encoded )
+        encoded = compressor.encode( encoded )
+        t1 = time.perf_counter()
+        decoded = compressor.decode( encoded )
+        for f in reversed( filters ): decoded = f.decode( decoded )
+        t2 = time.perf_counter()
+        decoded = ensure_ndarray( decoded ).view( dtype ).reshape( data.shape )
+        error = float( np.nanmax( np.abs( decoded.astype( np.float64 ) - data.astype( np.float64 ) ) ) ) if np.issubdtype( data.dtype, np.floating ) else 0.0
+        return dict( raw=data.nbytes, stored=len( encoded ), encode_time=t1 - t0, decode_time=t2 - t1, max_error=error )
+
+    def run( self, candidates: Dict[str,Union[str,EncodingProfile]] = None ) -> pd.DataFrame:
+        candidates = { name: name for name in ENCODING_PROFILES.keys() } if candidates is None else candidates
+        rows = []
+        for vname in self.chunks.keys():
+            samples = self.samples( vname )
+            for (name, profile) in candidates.items():
+                profile = get_profile( profile )
+                results = [ self.measure( profile, data ) for data in samples ]
+                (raw, stored) = ( sum( r['raw'] for r in results ), sum( r['stored'] for r in results ) )
+                rows.append( dict( variable=vname, profile=name, ratio=raw / stored,
+                                   encode_MBps=raw / 1.0e6 / sum( r['encode_time'] for r in results ),
+                                   decode_MBps=raw / 1.0e6 / sum( r['decode_time'] for r in results ),
+                                   max_error=max( r['max_error'] for r in results ), precision=profile.precision ) )
+        return pd.DataFrame( rows ).set_index( [ 'variable', 'profile' ] )
@@ -0,0 +1,121 @@
+import os, time, numpy as np
+import xarray as xr
+import pandas as pd
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+from collections.abc import MutableMapping
+
+# Aggregate group name -> pandas resample frequency
+AGG_FREQS = dict( daily='1D', monthly='MS', annual='YS' )
+AGG_STATS = [ 'mean', 'min', 'max' ]
+
+def aggregates_path( store_path: str ) -> str:
+    return f"{store_path.rstrip('/')}.aggregates"
+
+class LISAggregates:
+    """Companion zarr groups '<store>.aggregates/<period>' holding daily/monthly/annual mean, min and max of each
+       (time, lat, lon) variable ('<vname>_<stat>'), plus a 'climatology' group of per-calendar-month sums and counts.
+       Groups record the last source time step they include, so updates only process newer time steps."""
+
+    def __init__( self, dset: xr.Dataset, path: str ):
+        self.dset = dset
+        self.path = path
+        self._groups: Dict[str,xr.Dataset] = {}
+
+    def _store( self, group: str, mode: str ) -> Union[str,MutableMapping]:
+        from eis.s3 import s3m
+        gpath = f"{self.path}/{group}"
+        return s3m().get_store( gpath, mode, batched=True ) if gpath.startswith("s3:") else gpath
+
+    def group( self, name: str ) -> Optional[xr.Dataset]:
+        if name not in self._groups:
+            store = self._store( name, "r" )
+            exists = ( ".zmetadata" in store ) if isinstance( store, MutableMapping ) else os.path.isfile( f"{store}/.zmetadata" )
+            if not exists: return None
+            self._groups[name] = xr.open_zarr( store, consolidated=True )
+        return self._groups[name]
+
+    @property
+    def variables(self) -> List[str]:
+        return [ vname for (vname, v) in self.dset.data_vars.items() if 'time' in v.dims ]
+
+    def update( self, periods: List[str] = None, stats: List[str] = None, climatology: bool = True ):
+        """Builds or incrementally extends the aggregate groups on the EIS dask cluster."""
+        from eis.cluster import dcm
+        if dcm().client is None: dcm().init_cluster( job_type='mixed' )
+        t0 = time.time()
+        for period in ( AGG_FREQS.keys() if periods is None else periods ):
+            self._update_period( period, AGG_STATS if stats is None else stats )
+            print( f"Updated {period} aggregates, elapsed = {time.time()-t0:.1f} sec" )
+        if climatology:
+            self._update_climatology()
+            print( f"Updated climatology, elapsed = {time.time()-t0:.1f} sec" )
+
+    def _last_time( self, group: str ) -> Optional[np.datetime64]:
+        existing = self.group( group )
+        return None if existing is None else np.datetime64( existing.attrs['last_time'] )
+
+    def _update_period( self, period: str, stats: List[str] ):
+        import zarr
+        freq = AGG_FREQS[period]
+        last_time, existing = self._last_time( period ), self.group( period )
+        source = self.dset[ self.variables ]
+        if last_time is not None:
+            if last_time >= source.time.values[-1]: return
+            period_start = existing.time.values[-1]
+            source = source.sel( time=slice( period_start, None ) )
+        resampled = source.resample( time=freq )
+        agg = xr.Dataset( { f"{vname}_{stat}": getattr( resampled, stat )()[vname] for vname in self.variables for stat in stats } )
+        agg.attrs['last_time'] = str( self.dset.time.values[-1] )
+        for v in agg.variables.values(): v.encoding = {}
+        store = self._store( period, "w" if existing is None else "a" )
+        if existing is None:
+            agg.to_zarr( store, mode='w', consolidated=True )
+        else:
+            nt = existing.sizes['time']
+            overlap = agg.isel( time=slice(0,1) ).drop_vars( [ c for c in agg.coords if 'time' not in agg[c].dims ] )
+            overlap.to_zarr( store, region=dict( time=slice( nt-1, nt ) ) )
+            if agg.sizes['time'] > 1:
+                agg.isel( time=slice(1,None) ).to_zarr( store, append_dim='time', consolidated=False )
+            zarr.open_group( store, mode='a' ).attrs['last_time'] = agg.attrs['last_time']
+            zarr.consolidate_metadata( store )
+        self._groups.pop( period, None )
+
+    def _update_climatology(self):
+        """Adds the monthly sums/counts of new time steps.  An existing group is updated in place by a region write of all
+           12 months followed by a single metadata consolidation (as in _update_period), so concurrent readers never open
+           a deleted or partially created store."""
+        import zarr
+        last_time, existing = self._last_time( 'climatology' ), self.group( 'climatology' )
+        source = self.dset[ self.variables ]
+        if last_time is not None:
+            if last_time >= source.time.values[-1]: return
+            source = source.sel( time=slice( last_time + np.timedelta64(1,'ns'), None ) )
+        grouped = source.groupby( 'time.month' )
+        clim = xr.Dataset()
+        for vname in self.variables:
+            clim[f"{vname}_sum"] = grouped.sum()[vname].reindex( month=np.arange(1,13), fill_value=0 )
+            clim[f"{vname}_count"] = source[vname].notnull().groupby( 'time.month' ).sum().reindex( month=np.arange(1,13), fill_value=0 )
+        if existing is not None: clim = clim + existing.compute()
+        clim.attrs['last_time'] = str( self.dset.time.values[-1] )
+        for v in clim.variables.values(): v.encoding = {}
+        store = self._store( 'climatology', "w" if existing is None else "a" )
+        if existing is None:
+            clim.to_zarr( store, mode='w', consolidated=True )
+        else:
+            region = clim.drop_vars( [ c for c in clim.coords if 'month' not in clim[c].dims ] )
+            region.to_zarr( store, region=dict( month=slice( 0, clim.sizes['month'] ) ), consolidated=False )
+            zarr.open_group( store, mode='a' ).attrs['last_time'] = clim.attrs['last_time']
+            zarr.consolidate_metadata( store )
+        self._groups.pop( 'climatology', None )
+
+    def climatology( self, vname: str ) -> Optional[xr.DataArray]:
+        clim = self.group( 'climatology' )
+        if clim is None: return None
+        return ( clim[f"{vname}_sum"] / clim[f"{vname}_count"].where( clim[f"{vname}_count"] > 0 ) ).rename( f"{vname}_climatology" )
+
+    def get( self, vname: str, period: str, stat: str = 'mean' ) -> Optional[xr.DataArray]:
+        """The stored aggregate of vname, or None if that group/statistic has not been built."""
+        if period == 'climatology': return self.climatology( vname )
+        agg = self.group( period )
+        if (agg is None) or (f"{vname}_{stat}" not in agg): return None
+        return agg[f"{vname}_{stat}"]
@@ -1,17 +1,15 @@
-import pandas as pd
+import pandas as pd, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
-from holoviews.streams import Selection1D, Params, Tap
-import panel as pn
 import xarray as xa
-import geopandas as gpd
 from eis.lis.data.routing import LISRoutingData
 from eis.lis.data.gage import LISGageDataset
+from eis.lis.data.metrics import skill_table
+from eis.lis.data.export import downsample, hv_curve
 import numpy as np
-import geoviews as gv
-import holoviews as hv
 from eis.smce import eis3, exception_handled
-import hvplot.pandas
-import hvplot.xarray
+from eis.cluster import timed
 
 class LISCombinedDataset:
 
@@ -20,13 +18,72 @@ class LISCombinedDataset:
         self.routing_data = routing_data
         self._null_routing_data = None
         self._null_gage_data = None
+        self._aligned_cache: OrderedDict = OrderedDict()
+        self._cache_size: int = kwargs.get( 'cache_size', 128 )
+        self._precomputed: Dict[Tuple[int,str],Tuple[xa.DataArray, xa.DataArray]] = {}
+        self._lock = threading.RLock()
+        self._prefetcher = ThreadPoolExecutor( 1 )
+        self._prefetching: set = set()
+        precompute = kwargs.get( 'precompute', False )
+        if precompute: self.precompute( None if (precompute is True) else precompute )
         self.init_null_data( **kwargs )
 
-    def add_variable(self, name: str, variable: xa.DataArray ):
-        self.routing_data.add_variable( name, variable )
+    def add_variable(self, name: str, variable: Union[xa.DataArray,Callable[...,xa.DataArray]], deps: List[str] = None ):
+        self.routing_data.add_variable( name, variable, deps )
+        for vname in [ name ] + self.routing_data.derived.dependents( name ):
+            self.invalidate( vname )
+
+    def invalidate( self, vname: str = None ):
+        """Drops cached aligned data for vname (all variables if None)."""
+        with self._lock:
+            for cache in [ self._aligned_cache, self._precomputed ]:
+                for key in [ k for k in cache.keys() if (vname is None) or (k[1] == vname) ]:
+                    del cache[key]
+
+    def precompute( self, vnames: List[str] = None ):
+        """Builds the aligned (routing, gage) series of every gage for each variable, using one batched site read per variable.
+           Entries are keyed by header row (gage_index) and paired by gage id, as in get_aligned_data."""
+        logger = eis3().get_logger()
+        for vname in ( self.var_names if vnames is None else vnames ):
+            (rdata, gdata) = self.aligned_matrices( vname )
+            sites = [ str(i) for i in rdata['site'].values ]
+            for gage_index in range( len( self.gage_data.header ) ):
+                gid = self.gage_data.header_id( gage_index )
+                if gid not in sites: continue
+                isite = sites.index( gid )
+                gseries = gdata.isel( site=isite, drop=True )
+                valid = gseries.notnull().values
+                with self._lock:
+                    self._precomputed[ (gage_index, vname) ] = ( rdata.isel( site=isite, time=valid ), gseries.isel( time=valid ).rename( gid ) )
+            logger.info( f"Precomputed aligned data for {vname}: {len( sites )} gages" )
+
+    def aligned_matrices( self, vname: str, **kwargs ) -> Tuple[xa.DataArray, xa.DataArray]:
+        """Returns (routing, gage) arrays of shape (time, site) on their common time axis, read with one batched site query.
+           Sites are the header entries that have gage data, in header order; gage columns are selected by id."""
+        gages: pd.DataFrame = self.gage_data.gages_data
+        sites: pd.DataFrame = self.gage_data.header
+        sites = sites[ [ str(i) in gages.columns for i in sites['id'] ] ]
+        routing_matrix: xa.DataArray = self.routing_data.sites_data( vname, sites, **kwargs )
+        gage_values = gages[ [ str(i) for i in sites['id'] ] ].to_numpy()
+        gage_matrix = xa.DataArray( gage_values, dims=['time','site'], coords=routing_matrix['site'].coords, name='gage' )
+        gage_matrix = gage_matrix.assign_coords( time=gages.index.to_numpy() )
+        return xa.align( routing_matrix, gage_matrix )
+
+    def skill_metrics( self, vnames: List[str] = None, **kwargs ) -> pd.DataFrame:
+        """Scores the routing output against every gage for each variable (default: all).
+           Returns a tidy table with columns variable, site, [groupby], n, nse, kge, bias, pbias, rmse, corr.
+           kwargs: time_window=(start,end), groupby='season'|'month'|..."""
+        tables = []
+        for vname in ( self.var_names if vnames is None else vnames ):
+            ts = kwargs.get( 'time_window', None )
+            (rdata, gdata) = self.aligned_matrices( vname, ts=ts )
+            table = skill_table( rdata, gdata, **kwargs )
+            table.insert( 0, 'variable', vname )
+            tables.append( table )
+        return pd.concat( tables, ignore_index=True )
 
     def get_variable(self, name: str ) -> Optional[xa.DataArray]:
-        return self.routing_data.dset[ name ]
+        return self.routing_data.variable( name )
 
     @property
     def var_names(self) -> List[str]:
@@ -39,62 +96,111 @@ class LISCombinedDataset:
         self._null_routing_data = xa.zeros_like( routing_adata )
         self._null_gage_data = xa.zeros_like(gage_adata)
 
-    def get_routing_data(self, gage_index: int, varname: str, can_use_null_data: bool = False  ) -> xa.DataArray:
+    def get_routing_data(self, gage_index: int, varname: str, can_use_null_data: bool = False, ts: Tuple = None ) -> xa.DataArray:
         if can_use_null_data and (self._null_routing_data is not None):
             return self._null_routing_data
         else:
             coords = self.gage_data.getCoords(gage_index)
-            streamflow_data: xa.DataArray = self.routing_data.var_data(varname, coords['lon'], coords['lat'])
+            streamflow_data: xa.DataArray = self.routing_data.var_data(varname, coords['lon'], coords['lat'], ts=ts)
             return streamflow_data
 
-    def get_gage_data(self, gage_index: int, can_use_null_data: bool = False  ) -> xa.DataArray:
+    def get_gage_data(self, gage_index: int, can_use_null_data: bool = False, ts: Tuple = None ) -> xa.DataArray:
         if can_use_null_data and (self._null_gage_data is not None):
             return self._null_gage_data
         else:
             gage_data: xa.DataArray = self.gage_data.xa_gage_data( gage_index )
-            return gage_data
+            return gage_data if ts is None else gage_data.sel( time=slice(*ts) )
 
-    def get_aligned_data(self, gage_index: int, vname: str = None  ) -> Tuple[xa.DataArray, ...]:
+    @staticmethod
+    def _window( aligned: Tuple[xa.DataArray, ...], ts: Tuple = None ) -> Tuple[xa.DataArray, ...]:
+        if ts is None: return aligned
+        return tuple( adata.sel( time=slice(*ts) ) for adata in aligned )
+
+    def time_bounds(self) -> Tuple[pd.Timestamp,pd.Timestamp]:
+        times = self.routing_data.dset['time'].values
+        return pd.Timestamp( times[0] ), pd.Timestamp( times[-1] )
+
+    @timed( 'combined.get_aligned_data' )
+    def get_aligned_data(self, gage_index: int, vname: str = None, ts: Tuple = None ) -> Tuple[xa.DataArray, ...]:
+        """Aligned (routing, gage) series at a gage, restricted to the time window ts=(start,end) if given.
+           A windowed request that misses the cache reads only the window (routing chunks outside it are never fetched),
+           then loads the full series in the background so later windows are served from the cache."""
         if (vname is None):
             streamflow_data: xa.DataArray = self._null_routing_data
             gage_data: xa.DataArray = self.gage_data.xa_gage_data( gage_index )
-        else:
-            streamflow_data: xa.DataArray = self.get_routing_data( gage_index, vname, False )
-            gage_data = self.get_gage_data( gage_index, True )
-        return xa.align( streamflow_data, gage_data )
+            return self._window( xa.align( streamflow_data, gage_data ), ts )
+        key = ( gage_index, vname )
+        with self._lock:
+            if key in self._precomputed: return self._window( self._precomputed[key], ts )
+            if key in self._aligned_cache:
+                self._aligned_cache.move_to_end( key )
+                return self._window( self._aligned_cache[key], ts )
+        if ts is not None:
+            windowed = xa.align( self.get_routing_data( gage_index, vname, False, ts ), self.get_gage_data( gage_index, False, ts ) )
+            self.prefetch( gage_index, vname )
+            return windowed
+        streamflow_data: xa.DataArray = self.get_routing_data( gage_index, vname, False )
+        gage_data = self.get_gage_data( gage_index, False )
+        aligned = xa.align( streamflow_data, gage_data )
+        with self._lock:
+            self._aligned_cache[key] = aligned
+            if len( self._aligned_cache ) > self._cache_size: self._aligned_cache.popitem( last=False )
+        return aligned
+
+    def prefetch( self, gage_index: int, vname: str ):
+        """Loads the full aligned series at a gage into the cache on a background thread."""
+        key = ( gage_index, vname )
+        with self._lock:
+            if key in self._prefetching: return
+            self._prefetching.add( key )
+        def load():
+            try:     self.get_aligned_data( gage_index, vname )
+            except Exception: eis3().exception( f"Error prefetching {vname} at gage {gage_index}" )
+            finally:
+                with self._lock: self._prefetching.discard( key )
+        self._prefetcher.submit( load )
 
     @exception_handled
-    def routing_data_graph( self, index: List[int], vname: str ):
+    def routing_data_graph( self, index: List[int], vname: str, time_range: Tuple = None ):
         logger = eis3().get_logger()
         if (index is None) or (len(index) == 0):
-            return self._null_routing_data.hvplot(title=f"No Gages")
+            return hv_curve( self._null_routing_data, title=f"No Gages" )
         gage_index = index[0]
-        (routing_adata, gage_adata) = self.get_aligned_data( gage_index, vname )
-        return routing_adata.hvplot( title = vname )
+        (routing_adata, gage_adata) = self.get_aligned_data( gage_index, vname, time_range )
+        return hv_curve( downsample( routing_adata, self.routing_data.max_points ), title = vname )
 
     @exception_handled
-    def gage_data_graph(self, index: List[int], vname: str):
+    def gage_data_graph(self, index: List[int], vname: str, time_range: Tuple = None ):
         logger = eis3().get_logger()
         if (index is None) or (len(index) == 0):
-            return self._null_gage_data.hvplot(title=f"No Gages")
+            return hv_curve( self._null_gage_data, title=f"No Gages" )
         else:
             gage_index = index[0]
-            (routing_adata, gage_adata) = self.get_aligned_data( gage_index )
-            return gage_adata.hvplot(title=f"Gage[{gage_index}]").opts( ylabel='Gage flow' )
+            (routing_adata, gage_adata) = self.get_aligned_data( gage_index, vname, time_range )
+            return hv_curve( downsample( gage_adata, self.routing_data.max_points ), title=f"Gage[{gage_index}]", ylabel='Gage flow' )
 
     @exception_handled
     def plot(self, **kwargs ):
+        """Gage map with linked gage/routing graphs.  The time-range slider limits reads to the visible window
+           (initially the last `window_days`, default 365); the full series at a selected gage is loaded in the background."""
+        import holoviews as hv, geoviews as gv, panel as pn
+        from holoviews.streams import Selection1D, Params
         color = kwargs.pop( 'color', 'red' )
         size  = kwargs.pop( 'size', 10 )
         tools = kwargs.pop( 'tools', [ 'tap', 'hover' ] )
+        window_days = kwargs.pop( 'window_days', 365 )
         var_select = pn.widgets.Select(options=self.routing_data.var_names, value='Streamflow_tavg', name="LIS Variable List")
         var_stream = Params( var_select, ['value'], rename={ 'value': 'vname' } )
+        (tstart, tend) = self.time_bounds()
+        time_slider = pn.widgets.DatetimeRangeSlider( start=tstart.to_pydatetime(), end=tend.to_pydatetime(), name="Time Range",
+                                                      value=( max( tstart, tend - pd.Timedelta( days=window_days ) ).to_pydatetime(), tend.to_pydatetime() ) )
+        time_stream = Params( time_slider, ['value'], rename={ 'value': 'time_range' } )
         pts_opts = gv.opts.Points( color=color, size=size, tools=tools, nonselection_fill_alpha=0.2, nonselection_line_alpha=0.6,  **kwargs )
         tiles = gv.tile_sources.EsriImagery()
         dpoints = hv.util.Dynamic( self.gage_data.points.opts( pts_opts ) ).opts(height=400, width=600)
         select_stream = Selection1D( default=[0], source=dpoints )
-        routing_graph = hv.DynamicMap( self.routing_data_graph, streams=[select_stream, var_stream ])
-        gage_graph = hv.DynamicMap( self.gage_data_graph, streams=[select_stream, var_stream] )
+        routing_graph = hv.DynamicMap( self.routing_data_graph, streams=[select_stream, var_stream, time_stream ])
+        gage_graph = hv.DynamicMap( self.gage_data_graph, streams=[select_stream, var_stream, time_stream] )
         graphs = pn.Column( gage_graph, routing_graph )
-        return pn.Row( pn.Column( var_select, tiles * dpoints ), graphs )
+        return pn.Row( pn.Column( var_select, time_slider, tiles * dpoints ), graphs )
 
@@ -0,0 +1,153 @@
+import threading, uuid, numpy as np
+import xarray as xa
+from dask.base import tokenize
+from dask.core import get_dependencies
+from dask.highlevelgraph import HighLevelGraph
+from collections import OrderedDict
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+class ChunkLRU:
+    """Thread-safe, byte-bounded LRU cache of computed chunks."""
+
+    def __init__( self, max_bytes: int ):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get( self, key: Hashable ) -> Optional[np.ndarray]:
+        with self._lock:
+            value = self._entries.get( key, None )
+            if value is not None:
+                self.hits += 1
+                self._entries.move_to_end( key )
+            return value
+
+    def put( self, key: Hashable, value: np.ndarray ) -> np.ndarray:
+        with self._lock:
+            self.misses += 1
+            if key not in self._entries:
+                self._entries[key] = value
+                self.nbytes += value.nbytes
+                while ( self.nbytes > self.max_bytes ) and ( len( self._entries ) > 1 ):
+                    self.nbytes -= self._entries.popitem( last=False )[1].nbytes
+        return value
+
+    def discard( self, test: Callable[[Hashable],bool] ):
+        with self._lock:
+            for key in [ k for k in self._entries.keys() if test(k) ]:
+                self.nbytes -= self._entries.pop( key ).nbytes
+
+_chunk_caches: Dict[str,ChunkLRU] = {}
+_chunk_caches_lock = threading.Lock()
+
+def chunk_cache( registry_id: str, max_bytes: int ) -> ChunkLRU:
+    """The chunk LRU of a derived-variable registry in this process (the client, or a dask worker)."""
+    with _chunk_caches_lock:
+        if registry_id not in _chunk_caches: _chunk_caches[registry_id] = ChunkLRU( max_bytes )
+        return _chunk_caches[registry_id]
+
+class CachedChunk:
+    """Task computing one chunk of a derived variable: served from the process-local chunk LRU, or computed from the
+       chunk's own (culled) source graph and memoized.  Holds only picklable state, so graphs run on any scheduler."""
+
+    def __init__( self, registry_id: str, max_bytes: int, ckey: Tuple, graph: Dict, key: Tuple ):
+        self.registry_id, self.max_bytes, self.ckey = registry_id, max_bytes, ckey
+        self.graph, self.key = graph, key
+
+    def __call__(self) -> np.ndarray:
+        from dask.local import get_sync
+        cache = chunk_cache( self.registry_id, self.max_bytes )
+        value = cache.get( self.ckey )
+        if value is None: value = cache.put( self.ckey, get_sync( self.graph, self.key ) )
+        return value
+
+def chunk_graph( graph: Dict, key: Hashable ) -> Dict:
+    """The tasks key depends on (directly or transitively), including key itself."""
+    result, pending = {}, [ key ]
+    while len( pending ):
+        k = pending.pop()
+        if k in result: continue
+        result[k] = graph[k]
+        pending.extend( get_dependencies( graph, k ) )
+    return result
+
+class DerivedVariable:
+
+    def __init__( self, name: str, func: Callable[...,xa.DataArray], deps: List[str] ):
+        self.name = name
+        self.func = func
+        self.deps = deps
+
+class DerivedVariableRegistry:
+    """Definitions of derived variables (a function of source variables plus its dependency list).
+       A derived variable is built lazily as a dask graph when first requested (once per version).  Each chunk task
+       is memoized in a bounded LRU in the process that runs it (the client with the threaded scheduler, each worker
+       under a distributed Client) and served from it afterwards, without reading its sources.
+       Redefining a variable invalidates the cached chunks of every derived variable that depends on it."""
+
+    def __init__( self, **kwargs ):
+        self.definitions: Dict[str,DerivedVariable] = {}
+        self.id: str = uuid.uuid4().hex
+        self.max_bytes = int( kwargs.get( 'cache_mb', 1000 ) * 1.0e6 )
+        self.cache: ChunkLRU = chunk_cache( self.id, self.max_bytes )
+        self._versions: Dict[str,int] = {}
+        self._lazy: Dict[str,Tuple[Tuple,xa.DataArray]] = {}
+
+    def __contains__( self, name: str ) -> bool:
+        return name in self.definitions
+
+    @property
+    def names(self) -> List[str]:
+        return list( self.definitions.keys() )
+
+    def register( self, name: str, func: Callable[...,xa.DataArray], deps: List[str] ):
+        self.definitions[name] = DerivedVariable( name, func, deps )
+        self.invalidate( name )
+
+    def dependents( self, name: str ) -> List[str]:
+        """Derived variables depending (directly or transitively) on name, including name itself if derived."""
+        result = [ name ] if name in self.definitions else []
+        for dvar in self.definitions.values():
+            if ( name in dvar.deps ) and ( dvar.name != name ):
+                result += [ d for d in self.dependents( dvar.name ) if d not in result ]
+        return result
+
+    def invalidate( self, name: str ):
+        self._versions[name] = self._versions.get( name, 0 ) + 1
+        stale = set( self.dependents( name ) )
+        for dname in stale: self._lazy.pop( dname, None )
+        self.cache.discard( lambda key: key[0] in stale )
+
+    def version( self, name: str ) -> Tuple:
+        """Changes whenever name (a derived or concrete variable) or anything it depends on is redefined."""
+        return self._version( name )
+
+    def _version( self, name: str ) -> Tuple:
+        deps = self.definitions[name].deps if name in self.definitions else []
+        return ( self._versions.get( name, 0 ), ) + tuple( self._version( d ) for d in deps )
+
+    def get( self, name: str, resolve: Callable[[str],xa.DataArray] ) -> xa.DataArray:
+        dvar = self.definitions[name]
+        version = self._version( name )
+        cached = self._lazy.get( name, None )
+        if ( cached is None ) or ( cached[0] != version ):
+            result: xa.DataArray = dvar.func( *[ resolve(d) for d in dvar.deps ] )
+            if result.chunks is None: result = result.chunk()
+            cached = ( version, self._memoized( name, version, result.rename( name ) ) )
+            self._lazy[name] = cached
+        return cached[1]
+
+    def _memoized( self, name: str, version: Tuple, result: xa.DataArray ) -> xa.DataArray:
+        """Same array, with one CachedChunk task per block (each carrying the culled graph of its source block)."""
+        import dask.array as da
+        arr: da.Array = result.data
+        graph = dict( arr.__dask_graph__() )
+        out_name = f"derived-{name}-{tokenize( arr.name, version )}"
+        layer = {}
+        for idx in np.ndindex( *arr.numblocks ):
+            key = (arr.name,) + idx
+            layer[ (out_name,) + idx ] = ( CachedChunk( self.id, self.max_bytes, ( name, version, idx ), chunk_graph( graph, key ), key ), )
+        graph = HighLevelGraph.from_collections( out_name, layer, dependencies=[] )
+        return result.copy( data=da.Array( graph, out_name, arr.chunks, meta=arr._meta ) )
@@ -0,0 +1,133 @@
+import io, json, numpy as np
+import xarray as xa
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+NPZ_MIME = "application/x-npz"
+JSON_MIME = "application/json"
+
+def _encode_coord( coord: xa.DataArray ) -> Dict[str,Any]:
+    values = coord.values
+    if np.issubdtype( values.dtype, np.datetime64 ):
+        return dict( dims=list( coord.dims ), dtype='datetime64[ns]', values=values.astype('datetime64[ns]').astype(np.int64).tolist() )
+    return dict( dims=list( coord.dims ), dtype=str( values.dtype ), values=values.tolist() )
+
+def _decode_coord( spec: Dict[str,Any] ) -> Tuple[List[str],np.ndarray]:
+    if spec['dtype'] == 'datetime64[ns]':
+        return spec['dims'], np.array( spec['values'], dtype=np.int64 ).astype( 'datetime64[ns]' )
+    return spec['dims'], np.array( spec['values'], dtype=spec['dtype'] )
+
+def to_arrow( data: xa.DataArray ) -> "pa.RecordBatch":
+    """Arrow record batch of a (computed) DataArray in its native dtype.  A 1-D series becomes the columns (<dim>, <name>);
+       higher-dimensional arrays a single flattened value column.  Dims, shape, non-index coordinates and attrs travel in
+       the schema metadata.  Numeric columns wrap the numpy buffers without copying."""
+    import pyarrow as pa
+    name = str( data.name or 'value' )
+    values = np.ascontiguousarray( data.values )
+    index_dims = [ data.dims[0] ] if ( data.ndim == 1 ) and ( data.dims[0] in data.coords ) else []
+    coords = { str(c): _encode_coord( data[c] ) for c in data.coords if c not in index_dims }
+    metadata = dict( dims=json.dumps( data.dims ), shape=json.dumps( data.shape ), coords=json.dumps( coords ), attrs=json.dumps( data.attrs, default=str ) )
+    arrays = [ pa.array( data[d].values ) for d in index_dims ] + [ pa.array( values.ravel() ) ]
+    batch = pa.RecordBatch.from_arrays( arrays, names=index_dims + [ name ] )
+    return batch.replace_schema_metadata( metadata )
+
+def from_arrow( batch: "pa.RecordBatch" ) -> xa.DataArray:
+    metadata = { k.decode(): v.decode() for k, v in batch.schema.metadata.items() }
+    (dims, shape) = ( json.loads( metadata['dims'] ), json.loads( metadata['shape'] ) )
+    names = batch.schema.names
+    values = batch.column( len(names) - 1 ).to_numpy( zero_copy_only=False ).reshape( shape )
+    coords = { c: _decode_coord( spec ) for c, spec in json.loads( metadata['coords'] ).items() }
+    for index_dim in names[:-1]: coords[index_dim] = ( [index_dim], batch.column( index_dim ).to_numpy( zero_copy_only=False ) )
+    return xa.DataArray( values, dims=dims, coords=coords, name=names[-1], attrs=json.loads( metadata['attrs'] ) )
+
+def arrow_bytes( data: xa.DataArray ) -> bytes:
+    import pyarrow as pa
+    batch = to_arrow( data )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream( sink, batch.schema ) as writer: writer.write_batch( batch )
+    return sink.getvalue().to_pybytes()
+
+def read_arrow( payload: bytes ) -> xa.DataArray:
+    import pyarrow as pa
+    return from_arrow( pa.ipc.open_stream( payload ).read_next_batch() )
+
+def npz_bytes( data: xa.DataArray ) -> bytes:
+    """Uncompressed npz holding the values (native dtype) plus dims, coordinates and attrs as JSON."""
+    coords = { str(c): _encode_coord( data[c] ) for c in data.coords }
+    header = dict( name=data.name, dims=data.dims, coords=coords, attrs=data.attrs )
+    buffer = io.BytesIO()
+    np.savez( buffer, values=np.ascontiguousarray( data.values ), header=np.array( json.dumps( header, default=str ) ) )
+    return buffer.getvalue()
+
+def read_npz( payload: bytes ) -> xa.DataArray:
+    with np.load( io.BytesIO( payload ) ) as npz:
+        header = json.loads( str( npz['header'] ) )
+        values = npz['values']
+    coords = { c: _decode_coord( spec ) for c, spec in header['coords'].items() }
+    return xa.DataArray( values, dims=header['dims'], coords=coords, name=header['name'], attrs=header['attrs'] )
+
+def json_bytes( data: xa.DataArray ) -> bytes:
+    coords = { str(c): _encode_coord( data[c] ) for c in data.coords }
+    values = np.where( np.isfinite( data.values ), data.values.astype( np.float64 ), None ).tolist() if np.issubdtype( data.dtype, np.floating ) else data.values.tolist()
+    return json.dumps( dict( name=data.name, dims=data.dims, coords=coords, attrs=data.attrs, values=values ), default=str ).encode()
+
+def read_json( payload: bytes ) -> xa.DataArray:
+    content = json.loads( payload )
+    coords = { c: _decode_coord( spec ) for c, spec in content['coords'].items() }
+    values = np.array( content['values'], dtype=float )
+    return xa.DataArray( values, dims=content['dims'], coords=coords, name=content['name'], attrs=content['attrs'] )
+
+def lttb_indices( x: np.ndarray, y: np.ndarray, n_out: int ) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of n_out points (including both ends) that preserve the visual shape of y(x)."""
+    n = x.size
+    if n <= n_out or n_out < 3: return np.arange( n )
+    edges = np.linspace( 1, n - 1, n_out - 1 ).astype( np.int64 )
+    selected = np.empty( n_out, dtype=np.int64 )
+    selected[0], selected[-1] = 0, n - 1
+    for ib in range( n_out - 2 ):
+        (start, stop) = ( edges[ib], edges[ib+1] )
+        (nstart, nstop) = ( stop, edges[ib+2] if ib + 2 < edges.size else n )
+        (xp, yp) = ( x[ selected[ib] ], y[ selected[ib] ] )
+        (xc, yc) = ( x[nstart:nstop].mean(), y[nstart:nstop].mean() )
+        areas = np.abs( ( xp - xc ) * ( y[start:stop] - yp ) - ( xp - x[start:stop] ) * ( yc - yp ) )
+        selected[ib+1] = start + int( np.argmax( areas ) )
+    return selected
+
+def downsample( data: xa.DataArray, max_points: Optional[int], dim: str = 'time' ) -> xa.DataArray:
+    """LTTB-downsamples a 1-D series to at most max_points samples (NaNs dropped); returns data unchanged if it is short enough."""
+    if ( max_points is None ) or ( data.ndim != 1 ) or ( data.sizes[dim] <= max_points ): return data
+    valid = np.flatnonzero( np.isfinite( data.values ) )
+    coord = data[dim].values
+    x = ( coord.astype('datetime64[ns]').astype(np.int64) if np.issubdtype( coord.dtype, np.datetime64 ) else coord ).astype( np.float64 )
+    keep = lttb_indices( x[valid], data.values[valid].astype( np.float64 ), max_points )
+    return data.isel( { dim: valid[keep] } )
+
+def to_shared_memory( data: xa.DataArray ) -> Tuple["SharedMemory",Dict[str,Any]]:
+    """Copies the values of a computed DataArray once into a shared-memory block; the returned descriptor (JSON-able)
+       lets another process attach to it with from_shared_memory.  The caller owns the block (close/unlink)."""
+    from multiprocessing.shared_memory import SharedMemory
+    values = np.ascontiguousarray( data.values )
+    shm = SharedMemory( create=True, size=max( values.nbytes, 1 ) )
+    np.ndarray( values.shape, dtype=values.dtype, buffer=shm.buf )[...] = values
+    coords = { str(c): _encode_coord( data[c] ) for c in data.coords }
+    descriptor = dict( shm=shm.name, shape=values.shape, dtype=values.dtype.str, name=data.name, dims=data.dims, coords=coords, attrs=data.attrs )
+    return shm, json.loads( json.dumps( descriptor, default=str ) )
+
+def from_shared_memory( descriptor: Dict[str,Any] ) -> Tuple[xa.DataArray,"SharedMemory"]:
+    """Zero-copy DataArray view of a block created by to_shared_memory; keep the returned SharedMemory open while the array is in use."""
+    from multiprocessing.shared_memory import SharedMemory
+    shm = SharedMemory( name=descriptor['shm'] )
+    values = np.ndarray( descriptor['shape'], dtype=np.dtype( descriptor['dtype'] ), buffer=shm.buf )
+    coords = { c: _decode_coord( spec ) for c, spec in descriptor['coords'].items() }
+    return xa.DataArray( values, dims=descriptor['dims'], coords=coords, name=descriptor['name'], attrs=descriptor['attrs'] ), shm
+
+def hv_curve( data: xa.DataArray, **opts ) -> "hv.Curve":
+    """holoviews Curve over the numpy buffers of a 1-D series (dictionary interface: no DataFrame copy, dtype preserved)."""
+    import holoviews as hv
+    dim, name = data.dims[0], str( data.name or 'value' )
+    return hv.Curve( { dim: data[dim].values, name: data.values }, kdims=[dim], vdims=[name], datatype=['dictionary'] ).opts( **opts )
+
+def hv_image( data: xa.DataArray, **opts ) -> "hv.Image":
+    """holoviews Image over a 2-D (lat, lon) DataArray (gridded xarray interface, dtype preserved)."""
+    import holoviews as hv
+    return hv.Image( data, kdims=['lon','lat'], vdims=[ str( data.name or 'value' ) ], datatype=['xarray'] ).opts( **opts )
@@ -1,15 +1,30 @@
 import pandas as pd
+import os, json, hashlib, time
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
-from holoviews.streams import Selection1D, Params, Tap
-import panel as pn
 import xarray as xa
-import geopandas as gpd
 import numpy as np
-import geoviews as gv
-import holoviews as hv
 from eis.smce import eis3, exception_handled
-import hvplot.pandas
-import hvplot.xarray
+
+def gage_id( filepath: str ) -> str:
+    return filepath.split('/')[-1].strip('.txt')
+
+def read_gage_file( filepath: str ) -> pd.DataFrame:
+    return parse_gage_file( filepath )[0]
+
+def parse_gage_file( filepath: str ) -> Tuple[pd.DataFrame, Dict[str,Any]]:
+    """Parses a USGS 'YYYYMMDD value' gage file, dropping (and reporting) records with an unparseable date or value."""
+    t0 = time.time()
+    gid = gage_id( filepath )
+    raw = pd.read_csv( filepath, names=['date', 'value'], usecols=[0,1], dtype=str, delim_whitespace=True )
+    dates = pd.to_datetime( raw['date'], format='%Y%m%d', errors='coerce' )
+    values = pd.to_numeric( raw['value'], errors='coerce' )
+    valid = dates.notna().to_numpy() & values.notna().to_numpy()
+    df = pd.DataFrame( { gid: values.to_numpy()[valid] }, index=pd.DatetimeIndex( dates.to_numpy()[valid], name='date' ) )
+    bad_lines = ( np.flatnonzero( ~valid ) + 1 ).tolist()
+    stats = dict( file=filepath, id=gid, records=int( valid.sum() ), malformed=len( bad_lines ), malformed_lines=bad_lines[:10], parse_time=time.time() - t0 )
+    return df, stats
 
 class LISGageDataset:
 
@@ -22,22 +37,36 @@ class LISGageDataset:
         self._null_plot: xa.DataArray = None
         usecols = [ idcol, geocols['x'], geocols['y'] ] + datacols
         self.header: pd.DataFrame = pd.read_csv( header_file, usecols=usecols, delim_whitespace=True, names=['id', 'lon', 'lat'], dtype={'id': idtype} )
-        self._gage_data: List[pd.DataFrame] = []
+        self._gages: pd.DataFrame = pd.DataFrame( index=pd.DatetimeIndex( [], name='date' ) )
+        self._use_cache: bool = kwargs.get( 'cache', True )
+        self._cache_file: Optional[str] = kwargs.get( 'cache_file', None )
+        self._workers: int = kwargs.get( 'workers', 1 )
+        self.ingest_report: pd.DataFrame = pd.DataFrame()
         self.add_gage_files( gage_files )
+        if 'gage_dir' in kwargs:
+            self.add_gage_directory( kwargs['gage_dir'], kwargs.get( 'pattern', '*.txt' ), header_file=header_file )
         self.init_null_data()
         logger.info( f" *** Creating LISGageDataset, header file = {header_file}, gage files = {gage_files}" )
 
+    @classmethod
+    def from_directory( cls, header_file: str, gage_dir: str, pattern: str = '*.txt', **kwargs ) -> "LISGageDataset":
+        """Ingests every gage file in gage_dir matching pattern, parsing in a pool of `workers` processes (default: all cores)."""
+        kwargs.setdefault( 'workers', os.cpu_count() )
+        return LISGageDataset( header_file, gage_dir=gage_dir, pattern=pattern, **kwargs )
+
     def init_null_data(self, **kwargs ):
         gage_index: int = kwargs.get( 'gage_index', 0 )
         gage_data = self.xa_gage_data( gage_index )
         self._null_plot = xa.zeros_like( gage_data )
 
     @property
-    def gage_map(self) -> gpd.GeoDataFrame:
+    def gage_map(self) -> "gpd.GeoDataFrame":
+        import geopandas as gpd
         return gpd.GeoDataFrame( self.header, geometry=gpd.points_from_xy( self.header.lon, self.header.lat ) )
 
     @property
-    def points( self, **kwargs ) -> gv.Points:
+    def points( self, **kwargs ) -> "gv.Points":
+        import geoviews as gv
         kdims = kwargs.pop( 'kdims', ['lon', 'lat'] )
         return gv.Points( self.header, kdims=kdims, vdims='id', **kwargs )
 
@@ -45,6 +74,7 @@ class LISGageDataset:
         return dict( lon = self.header['lon'][gage_index], lat = self.header['lat'][gage_index] )
 
     def plot_map(self, **kwargs ):
+        import holoviews as hv, geoviews as gv
         color = kwargs.pop( 'color', 'red' )
         size  = kwargs.pop( 'size', 10 )
         tools = kwargs.pop( 'tools', [ 'tap', 'hover' ] )
@@ -55,6 +85,8 @@ class LISGageDataset:
 
     @exception_handled
     def plot(self, **kwargs ):
+        import holoviews as hv, geoviews as gv, panel as pn
+        from holoviews.streams import Selection1D
         color = kwargs.pop( 'color', 'red' )
         size  = kwargs.pop( 'size', 10 )
         tools = kwargs.pop( 'tools', [ 'tap', 'hover' ] )
@@ -67,6 +99,7 @@ class LISGageDataset:
 
     @exception_handled
     def gage_data_graph( self, index: List[int] ):
+        import hvplot.xarray
         logger = eis3().get_logger()
         if (index is None) or (len(index) == 0):
             return self._null_plot.hvplot(title=f"No Gage")
@@ -75,20 +108,91 @@ class LISGageDataset:
             gage_data: xa.DataArray = self.xa_gage_data( gage_index )
             return gage_data.hvplot( title=f"Gage[{gage_index}]" )
 
+    def header_id( self, gage_index: int ) -> str:
+        """Id of the gage in header row gage_index (gage data columns are looked up by id, not position)."""
+        return str( self.header['id'][gage_index] )
+
     def xa_gage_data(self, gage_index: int ) -> xa.DataArray:
-        gage_dataset: xa.Dataset = self._gage_data[gage_index].to_xarray()
-        dvars = list(gage_dataset.data_vars.keys())
-        return gage_dataset[dvars[0]].rename( date="time" )
+        gdata: pd.Series = self._gages[ self.header_id( gage_index ) ].dropna()
+        return xa.DataArray( gdata.to_numpy(), dims=['time'], coords=dict( time=gdata.index.to_numpy() ), name=gdata.name )
 
     def add_gage_file( self, filepath: str ):
-        gage_id = filepath.split('/')[-1].strip('.txt')
-        df = pd.read_csv( filepath, names=['date', gage_id], delim_whitespace=True,  parse_dates=['date'], index_col='date' )
-        self._gage_data.append( df )
+        self._merge_gage_data( self._parse_gage_files( [ filepath ] ) )
 
     def add_gage_files(self, gage_file_paths: Optional[List[str]] ):
         if gage_file_paths is not None:
-            for gage_file in gage_file_paths:
-                self.add_gage_file( gage_file )
+            if self._use_cache: self._merge_gage_data( self._load_gage_files( gage_file_paths ) )
+            else:               self._merge_gage_data( self._parse_gage_files( gage_file_paths ) )
+
+    def add_gage_directory( self, gage_dir: str, pattern: str = '*.txt', **kwargs ):
+        """Adds the gage files in gage_dir that have an entry in the header table, in header order.
+           Header entries without a data file are dropped from the header so gage indices stay aligned with its rows."""
+        logger = eis3().get_logger()
+        header_file = kwargs.get( 'header_file', None )
+        paths = { gage_id(p): p for p in sorted( glob( os.path.join( gage_dir, pattern ) ) )
+                  if ( header_file is None ) or not os.path.samefile( p, header_file ) }
+        header_ids = [ str(i) for i in self.header['id'] ]
+        unlisted = sorted( set( paths.keys() ) - set( header_ids ) )
+        missing = [ i for i in header_ids if i not in paths ]
+        if len( unlisted ): logger.warning( f"Skipping gage files with no header entry: {[ paths[i] for i in unlisted ]}" )
+        if len( missing ):
+            logger.warning( f"Dropping header entries with no gage file: {missing}" )
+            self.header = self.header[ [ i in paths for i in header_ids ] ].reset_index( drop=True )
+        self.add_gage_files( [ paths[ str(i) ] for i in self.header['id'] ] )
+        malformed = self.ingest_report[ self.ingest_report['malformed'] > 0 ] if len( self.ingest_report ) else self.ingest_report
+        if len( malformed ): logger.warning( f"Malformed gage records:\n{malformed[['file','malformed','malformed_lines']].to_string()}" )
+
+    def _parse_gage_files( self, gage_file_paths: List[str] ) -> List[pd.DataFrame]:
+        if ( self._workers > 1 ) and ( len( gage_file_paths ) > 1 ):
+            with ProcessPoolExecutor( max_workers=self._workers ) as executor:
+                results = list( executor.map( parse_gage_file, gage_file_paths, chunksize=max( 1, len(gage_file_paths) // (4*self._workers) ) ) )
+        else:
+            results = [ parse_gage_file( p ) for p in gage_file_paths ]
+        if len( results ):
+            self.ingest_report = pd.concat( [ self.ingest_report, pd.DataFrame( [ r[1] for r in results ] ).set_index('id') ] )
+        return [ r[0] for r in results ]
+
+    def _merge_gage_data( self, frames: List[pd.DataFrame] ):
+        """Outer-joins gage frames onto the shared date index in a single concat."""
+        frames = [ df for df in frames if len( df.columns ) ]
+        if len( frames ):
+            new_ids = [ c for df in frames for c in df.columns ]
+            self._gages = pd.concat( [ self._gages.drop( columns=new_ids, errors='ignore' ) ] + frames, axis=1 ).sort_index()
+            self._gages.index.name = 'date'
+
+    def gage_cache_file( self, gage_file_paths: List[str] ) -> str:
+        if self._cache_file is not None: return self._cache_file
+        digest = hashlib.sha1( "\n".join( os.path.abspath(p) for p in gage_file_paths ).encode() ).hexdigest()[:16]
+        return os.path.join( eis3().cache_dir, f"gages.{digest}.parquet" )
+
+    def _load_gage_files( self, gage_file_paths: List[str] ) -> List[pd.DataFrame]:
+        """Loads gage data from the parquet cache, re-parsing only files that are new or whose mtime changed."""
+        cache_file = self.gage_cache_file( gage_file_paths )
+        mtimes = { os.path.abspath(p): os.path.getmtime(p) for p in gage_file_paths }
+        cached_mtimes: Dict[str,float] = {}
+        cached: pd.DataFrame = None
+        if os.path.isfile( cache_file ) and os.path.isfile( f"{cache_file}.json" ):
+            with open( f"{cache_file}.json" ) as f: cached_mtimes = json.load( f )
+            cached = pd.read_parquet( cache_file, memory_map=True )
+            cached.index = pd.to_datetime( cached.index.to_numpy( dtype=np.int64 ) ).rename( 'date' )
+        cached_ids = set() if cached is None else set( cached.columns )
+        stale = [ p for p in gage_file_paths if ( cached_mtimes.get( os.path.abspath(p) ) != mtimes[ os.path.abspath(p) ] ) or ( gage_id(p) not in cached_ids ) ]
+        fresh_ids = [ gage_id(p) for p in gage_file_paths if p not in stale ]
+        frames = self._parse_gage_files( stale )
+        if cached is not None: frames = [ cached[ fresh_ids ].dropna( how='all' ) ] + frames
+        if len( stale ) or ( set( cached_mtimes.keys() ) != set( mtimes.keys() ) ):
+            gages = pd.concat( frames, axis=1 )[ [ gage_id(p) for p in gage_file_paths ] ].sort_index()
+            self._save_gage_cache( cache_file, gages, mtimes )
+            return [ gages ]
+        return frames
+
+    @staticmethod
+    def _save_gage_cache( cache_file: str, gages: pd.DataFrame, mtimes: Dict[str,float] ):
+        stored = gages.copy()
+        stored.index = pd.Index( stored.index.to_numpy( dtype='datetime64[ns]' ).astype( np.int64 ), name='date' )
+        stored.to_parquet( f"{cache_file}.tmp" )
+        os.replace( f"{cache_file}.tmp", cache_file )
+        with open( f"{cache_file}.json", "w" ) as f: json.dump( mtimes, f )
 
     def get_empty_dataframe(self, dframe: pd.DataFrame ) -> pd.DataFrame:
         df = dframe.copy( deep = True )
@@ -99,7 +203,7 @@ class LISGageDataset:
 
     @property
     def gages_data(self) -> pd.DataFrame:
-        return pd.concat( self._gage_data, axis=1 )
+        return self._gages
 
     def gage_data(self, gage_index: int ) -> pd.DataFrame:
-        return self._gage_data[gage_index]
+        return self._gages[ [ self.header_id( gage_index ) ] ].dropna()
@@ -0,0 +1,132 @@
+import os, pickle, time, hashlib, numpy as np
+import xarray as xa
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+from eis.smce import eis3
+
+class LISGridIndex:
+    """Nearest-valid-cell index over a LIS lat/lon grid: regular-grid arithmetic where possible, cKDTree fallback otherwise.
+       Points farther than max_distance (degrees; default 'auto' = one cell diagonal, None = unbounded) from every valid
+       cell, e.g. gages outside the domain, map to index -1."""
+
+    def __init__( self, lon: np.ndarray, lat: np.ndarray, mask: np.ndarray = None, **kwargs ):
+        from scipy.spatial import cKDTree
+        lon, lat = np.asarray( lon, dtype=np.float64 ), np.asarray( lat, dtype=np.float64 )
+        self.signature: str = self.grid_signature( lon, lat, kwargs.get( 'mask_var', None ) )
+        self._axes = self._regular_axes( lon, lat ) if (lon.ndim == 1) else None
+        (glon, glat) = np.meshgrid( lon, lat ) if (lon.ndim == 1) else (lon, lat)
+        self.shape: Tuple[int,int] = glon.shape
+        self.cell_diagonal: float = float( np.hypot( np.nanmedian( np.abs( np.diff( glon, axis=1 ) ) ), np.nanmedian( np.abs( np.diff( glat, axis=0 ) ) ) ) )
+        valid = np.isfinite( glon ) & np.isfinite( glat )
+        if mask is not None: valid &= np.asarray( mask, dtype=bool )
+        self._valid: np.ndarray = valid
+        self._cells: np.ndarray = np.flatnonzero( valid )
+        self._tree = cKDTree( self._to_xyz( glon.ravel()[self._cells], glat.ravel()[self._cells] ) )
+        self.max_distance: Optional[float] = self.resolve_max_distance( kwargs.get( 'max_distance', 'auto' ) )
+
+    def resolve_max_distance( self, max_distance: Union[str,float,None] ) -> Optional[float]:
+        return self.cell_diagonal if max_distance == 'auto' else max_distance
+
+    @staticmethod
+    def grid_signature( lon: np.ndarray, lat: np.ndarray, mask_var: str = None ) -> str:
+        """Hash of the grid shape, coordinates and mask variable an index was built for."""
+        digest = hashlib.sha1()
+        for array in [ np.asarray( lon, dtype=np.float64 ), np.asarray( lat, dtype=np.float64 ) ]:
+            digest.update( str( array.shape ).encode() + np.ascontiguousarray( array ).tobytes() )
+        digest.update( str( mask_var ).encode() )
+        return digest.hexdigest()
+
+    @staticmethod
+    def _grid_coords( dset: xa.Dataset ) -> Tuple[xa.DataArray,xa.DataArray]:
+        lon, lat = dset['lon'], dset['lat']
+        if 'time' in lon.dims: lon, lat = lon.isel(time=0), lat.isel(time=0)
+        return lon, lat
+
+    @classmethod
+    def from_coords( cls, dset: xa.Dataset, mask_var: str = None, **kwargs ) -> "LISGridIndex":
+        """Builds an index from the dataset lat/lon (1-D axes or 2-D north_south/east_west fields); NaN cells of mask_var are skipped."""
+        lon, lat = cls._grid_coords( dset )
+        mask = None
+        if mask_var is not None:
+            mvar = dset[mask_var]
+            mask = mvar.isel(time=0).notnull().values if 'time' in mvar.dims else mvar.notnull().values
+        return LISGridIndex( lon.values, lat.values, mask, mask_var=mask_var, **kwargs )
+
+    @classmethod
+    def cached( cls, path: Optional[str], dset: xa.Dataset, mask_var: str = None, **kwargs ) -> "LISGridIndex":
+        """Loads the index persisted at path, building (and saving) it if absent or built for a different grid or mask_var.
+           kwargs max_distance applies to a loaded index as well as a built one."""
+        if (path is not None) and os.path.isfile( path ):
+            try:
+                index = cls.load( path )
+                (lon, lat) = cls._grid_coords( dset )
+                if getattr( index, 'signature', None ) == cls.grid_signature( lon.values, lat.values, mask_var ):
+                    index.max_distance = index.resolve_max_distance( kwargs.get( 'max_distance', 'auto' ) )
+                    return index
+                eis3().get_logger().info( f"Grid index {path} was built for a different grid or mask, rebuilding" )
+            except Exception:   eis3().exception( f"Error loading grid index {path}, rebuilding" )
+        t0 = time.time()
+        index = cls.from_coords( dset, mask_var, **kwargs )
+        eis3().get_logger().info( f"Built grid index{index.shape}, {index._cells.size} valid cells, in {time.time()-t0:.2f} sec" )
+        if path is not None: index.save( path )
+        return index
+
+    @staticmethod
+    def _regular_axes( lon: np.ndarray, lat: np.ndarray ) -> Optional[Tuple[float,float,float,float]]:
+        if (lon.size < 2) or (lat.size < 2): return None
+        (dlon, dlat) = ( np.diff( lon ), np.diff( lat ) )
+        if np.allclose( dlon, dlon[0], rtol=1e-4 ) and np.allclose( dlat, dlat[0], rtol=1e-4 ):
+            return ( lon[0], dlon[0], lat[0], dlat[0] )
+        return None
+
+    @staticmethod
+    def _to_xyz( lon: np.ndarray, lat: np.ndarray ) -> np.ndarray:
+        (rlon, rlat) = ( np.radians( lon ), np.radians( lat ) )
+        return np.column_stack( [ np.cos(rlat) * np.cos(rlon), np.cos(rlat) * np.sin(rlon), np.sin(rlat) ] )
+
+    def query( self, lons, lats ) -> Dict[str,np.ndarray]:
+        """Returns the (lon,lat) indices of the nearest valid cell for each point; -1 where max_distance (degrees) is exceeded."""
+        lons = np.atleast_1d( np.asarray( lons, dtype=np.float64 ) )
+        lats = np.atleast_1d( np.asarray( lats, dtype=np.float64 ) )
+        ix, iy = np.full( lons.shape, -1, np.int64 ), np.full( lons.shape, -1, np.int64 )
+        pending = np.ones( lons.shape, dtype=bool )
+        if self._axes is not None:
+            (x0, dx, y0, dy) = self._axes
+            rx, ry = np.rint( (lons - x0) / dx ).astype( np.int64 ), np.rint( (lats - y0) / dy ).astype( np.int64 )
+            inside = (rx >= 0) & (rx < self.shape[1]) & (ry >= 0) & (ry < self.shape[0])
+            hit = np.zeros( lons.shape, dtype=bool )
+            hit[inside] = self._valid[ ry[inside], rx[inside] ]
+            ix[hit], iy[hit], pending[hit] = rx[hit], ry[hit], False
+        if pending.any():
+            (_, nidx) = self._tree.query( self._to_xyz( lons[pending], lats[pending] ) )
+            (cy, cx) = np.unravel_index( self._cells[nidx], self.shape )
+            ix[pending], iy[pending] = cx, cy
+        if self.max_distance is not None:
+            far = self.distance( lons, lats, ix, iy ) > self.max_distance
+            ix[far], iy[far] = -1, -1
+        return dict( lon=ix, lat=iy )
+
+    def distance( self, lons: np.ndarray, lats: np.ndarray, ix: np.ndarray, iy: np.ndarray ) -> np.ndarray:
+        """Great-circle distance (degrees) between each point and its indexed cell center."""
+        cells = np.ravel_multi_index( (iy, ix), self.shape )
+        cpos = self._tree.data[ np.searchsorted( self._cells, cells ) ]
+        cosd = np.clip( np.sum( self._to_xyz( lons, lats ) * cpos, axis=1 ), -1.0, 1.0 )
+        return np.degrees( np.arccos( cosd ) )
+
+    def save( self, path: str ):
+        os.makedirs( os.path.dirname( os.path.abspath( path ) ), exist_ok=True )
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open( tmp_path, 'wb' ) as f:
+            pickle.dump( self, f, protocol=pickle.HIGHEST_PROTOCOL )
+        os.replace( tmp_path, path )
+
+    @classmethod
+    def load( cls, path: str ) -> "LISGridIndex":
+        with open( path, 'rb' ) as f:
+            return pickle.load( f )
+
+def index_path( store_path: str ) -> str:
+    """Location of the persisted grid index for a zarr store: beside local stores, in the EIS cache for remote ones."""
+    store_path = store_path.rstrip("/")
+    if ":" in store_path.split("/")[0]:
+        return os.path.join( eis3().cache_dir, eis3().item_path( store_path ).strip("/").replace("/",".") + ".grid_index.pkl" )
+    return f"{store_path}.grid_index.pkl"
@@ -0,0 +1,37 @@
+import xarray as xa
+import numpy as np
+import pandas as pd
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+SKILL_METRICS = [ 'nse', 'kge', 'bias', 'pbias', 'rmse', 'corr' ]
+
+def skill_scores( sim: xa.DataArray, obs: xa.DataArray, dim: str = 'time' ) -> xa.Dataset:
+    """Computes model (sim) vs. observation (obs) skill metrics along dim for every other coordinate at once.
+       Only time steps where both series are finite contribute; works on numpy- or dask-backed arrays."""
+    valid = np.isfinite( sim ) & np.isfinite( obs )
+    s, o = sim.where( valid ), obs.where( valid )
+    n = valid.sum( dim )
+    (ms, mo) = ( s.mean( dim ), o.mean( dim ) )
+    (ds, do) = ( s - ms, o - mo )
+    (ss, so) = ( np.sqrt( (ds**2).mean( dim ) ), np.sqrt( (do**2).mean( dim ) ) )
+    sse = ( (s - o)**2 ).sum( dim )
+    corr = (ds * do).mean( dim ) / ( ss * so )
+    kge = 1 - np.sqrt( (corr - 1)**2 + (ss/so - 1)**2 + (ms/mo - 1)**2 )
+    scores = dict( n=n, nse=1 - sse / (do**2).sum( dim ), kge=kge, bias=ms - mo, pbias=100 * (ms - mo) / mo,
+                   rmse=np.sqrt( sse / n ), corr=corr )
+    return xa.Dataset( { name: score.where( n > 1 ) if name != 'n' else score for name, score in scores.items() } )
+
+def skill_table( sim: xa.DataArray, obs: xa.DataArray, **kwargs ) -> pd.DataFrame:
+    """Tidy table of skill scores for (time, site) arrays, optionally restricted to a time window and/or grouped by a
+       time component (e.g. groupby='season' or 'month')."""
+    window = kwargs.get( 'time_window', None )
+    groupby = kwargs.get( 'groupby', None )
+    if window is not None:
+        sim, obs = sim.sel( time=slice(*window) ), obs.sel( time=slice(*window) )
+    if groupby is None:
+        scores = skill_scores( sim, obs )
+    else:
+        pair = xa.Dataset( dict( sim=sim, obs=obs ) )
+        scores = pair.groupby( f"time.{groupby}" ).map( lambda ds: skill_scores( ds['sim'], ds['obs'] ) )
+    scores = scores.compute()
+    return scores.to_dataframe().reset_index()
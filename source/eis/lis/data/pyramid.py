@@ -0,0 +1,79 @@
+import os, time, numpy as np
+import xarray as xr
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+from collections.abc import MutableMapping
+
+def default_reduction( vname: str ) -> str:
+    """Streamflow lives on thin river channels that a mean would wash out, so it is reduced by max; everything else by mean."""
+    return 'max' if vname.startswith('Streamflow') else 'mean'
+
+def pyramid_path( store_path: str ) -> str:
+    return f"{store_path.rstrip('/')}.pyramid"
+
+class LISPyramid:
+    """Coarsened overview levels of a (time, lat, lon) LIS dataset, stored as zarr groups '<store>.pyramid/<level>'.
+       Level 0 is the full-resolution dataset itself; level n is coarsened by factor**n along lat and lon."""
+
+    def __init__( self, dset: xr.Dataset, path: str, **kwargs ):
+        self.path = path
+        self.levels: List[xr.Dataset] = [ dset ]
+        self.factor: int = kwargs.get( 'factor', 2 )
+        level = 1
+        while self._exists( level ):
+            self.levels.append( xr.open_zarr( self._store( level, "r" ), consolidated=True ) )
+            level += 1
+
+    def _store( self, level: int, mode: str ) -> Union[str,MutableMapping]:
+        from eis.s3 import s3m
+        lpath = f"{self.path}/{level}"
+        return s3m().get_store( lpath, mode, batched=True ) if lpath.startswith("s3:") else lpath
+
+    def _exists( self, level: int ) -> bool:
+        store = self._store( level, "r" )
+        return ( ".zmetadata" in store ) if isinstance( store, MutableMapping ) else os.path.isfile( f"{store}/.zmetadata" )
+
+    @property
+    def nlevels(self) -> int:
+        return len( self.levels )
+
+    def build( self, nlevels: int = 4, reductions: Dict[str,str] = None, **kwargs ):
+        """Writes levels 1..nlevels, each coarsened from the previous level, with per-variable 'mean'/'max'/'min' reductions."""
+        t0 = time.time()
+        reductions = {} if reductions is None else reductions
+        spatial_chunk = kwargs.get( 'spatial_chunk', 256 )
+        source = self.levels[0]
+        del self.levels[1:]
+        for level in range( 1, nlevels + 1 ):
+            if min( source.sizes['lat'], source.sizes['lon'] ) < self.factor: break
+            coarse = xr.Dataset( attrs=source.attrs )
+            for (vname, v) in source.data_vars.items():
+                if ('lat' not in v.dims) or ('lon' not in v.dims): continue
+                window = v.coarsen( lat=self.factor, lon=self.factor, boundary='trim' )
+                coarse[vname] = getattr( window, reductions.get( vname, default_reduction( vname ) ) )()
+                coarse[vname].attrs = v.attrs
+            coarse = coarse.chunk( dict( time=1, lat=spatial_chunk, lon=spatial_chunk ) )
+            for v in coarse.variables.values(): v.encoding = {}
+            coarse.to_zarr( self._store( level, "w" ), mode='w', consolidated=True )
+            source = xr.open_zarr( self._store( level, "r" ), consolidated=True )
+            self.levels.append( source )
+            print( f"Pyramid level {level}: shape = {dict(source.sizes)}, elapsed = {time.time()-t0:.1f} sec" )
+
+    def select_level( self, x_range: Tuple[float,float], y_range: Tuple[float,float], width: int, height: int ) -> int:
+        """Coarsest level that still has at least one cell per screen pixel over the viewport."""
+        for level in reversed( range( self.nlevels ) ):
+            dset = self.levels[level]
+            dx = abs( float( dset.lon[1] - dset.lon[0] ) )
+            dy = abs( float( dset.lat[1] - dset.lat[0] ) )
+            if ( abs( x_range[1] - x_range[0] ) / dx >= width ) and ( abs( y_range[1] - y_range[0] ) / dy >= height ):
+                return level
+        return 0
+
+    def view( self, vname: str, x_range: Optional[Tuple[float,float]], y_range: Optional[Tuple[float,float]], width: int = 800, height: int = 600, **kwargs ) -> xr.DataArray:
+        """Data for the viewport at the matching level: only chunks overlapping the viewport are read."""
+        time_index = kwargs.get( 'time_index', 0 )
+        full = self.levels[0]
+        if x_range is None: x_range = ( float( full.lon[0] ), float( full.lon[-1] ) )
+        if y_range is None: y_range = ( float( full.lat[0] ), float( full.lat[-1] ) )
+        level = self.select_level( x_range, y_range, width, height )
+        vdata: xr.DataArray = self.levels[level][vname]
+        return vdata.isel( time=time_index ).sel( lon=slice( min(x_range), max(x_range) ), lat=slice( min(y_range), max(y_range) ) )
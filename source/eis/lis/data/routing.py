@@ -1,56 +1,118 @@
 import xarray as xr
-import time, numpy as np
-import matplotlib.pyplot as plt
+import os, time, numpy as np
 from eis.smce import eis3, exception_handled
 from functools import partial
-from scipy.spatial import distance
-import matplotlib as mpl, traceback
-from holoviews.streams import Selection1D, Params, Stream, param, Tap
+import traceback
 from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
-import holoviews as hv
-import panel as pn
 import xarray as xa
 import logging, pandas as pd
-import geopandas as gpd
-from eis.smce import eis3
-import hvplot.pandas
-import hvplot.xarray
+from eis.lis.data.grid_index import LISGridIndex, index_path
+from eis.lis.data.pyramid import LISPyramid, pyramid_path
+from eis.lis.data.aggregates import LISAggregates, aggregates_path, AGG_FREQS
+from eis.lis.data.derived import DerivedVariableRegistry
+from eis.lis.data.zonal import ZonalStatistics
+from eis.lis.data.export import downsample, to_arrow, to_shared_memory, hv_curve, hv_image
+from eis.cluster import cim, timed
 
 class LISRoutingData:
 
     def __init__( self, dset: xr.Dataset, **kwargs ):
         self.dset: xr.Dataset = self._add_latlon_coords( dset )
         self._vnames = None
+        self.derived = DerivedVariableRegistry( cache_mb=kwargs.get( 'derived_cache_mb', 1000 ) )
         defvar = kwargs.get('default_var','Streamflow_tavg')
         self.default_variable: str = defvar if defvar in self.var_names else self.var_names[0]
+        self._index_path: Optional[str] = kwargs.get( 'index_path', None )
+        self._mask_var: Optional[str] = kwargs.get( 'mask_var', self.default_variable )
+        self._grid_index: LISGridIndex = None
+        self._max_distance: Union[str,float,None] = kwargs.get( 'max_distance', 'auto' )
+        self._pyramid_path: Optional[str] = kwargs.get( 'pyramid_path', None )
+        self._pyramid: LISPyramid = None
+        self._aggregates_path: Optional[str] = kwargs.get( 'aggregates_path', None )
+        self._aggregates: LISAggregates = None
+        self.max_points: Optional[int] = kwargs.get( 'max_points', 10000 )
     #    self._loc = dset[['lon','lat']].isel(time=0).to_dataframe().reset_index().dropna()
     #   self._pts: np.ndarray = self._loc[['lon', 'lat']].to_numpy()
 
-    def add_variable(self, name: str, variable: xa.DataArray ):
-        self.dset = self.dset.assign( {name: variable} )
-        self._vnames = None
+    def add_variable(self, name: str, variable: Union[xa.DataArray,Callable[...,xa.DataArray]], deps: List[str] = None ):
+        """Adds a concrete variable, or (if variable is a function of the `deps` variables) registers a lazily evaluated,
+           chunk-memoized derived variable.  Derived variables depending on `name` are invalidated."""
+        if callable( variable ):
+            assert deps is not None, f"Derived variable {name} requires a dependency list"
+            self.derived.register( name, variable, deps )
+        else:
+            self.dset = self.dset.assign( {name: variable} )
+            self.derived.invalidate( name )
+        if (self._vnames is not None) and (name not in self._vnames):
+            self._vnames.append( name )
+
+    def variable(self, vname: str ) -> xa.DataArray:
+        if vname in self.derived: return self.derived.get( vname, self.variable )
+        return self.dset[vname]
 
     @classmethod
-    def from_smce( cls, bucket: str, key: str ) -> "LISRoutingData":
+    def from_smce( cls, bucket: str, key: str, **kwargs ) -> "LISRoutingData":
         dset = eis3().get_zarr_dataset(bucket, key)
-        return LISRoutingData( dset )
+        kwargs.setdefault( 'index_path', index_path( f"s3://{bucket}/{key}.zarr" ) )
+        kwargs.setdefault( 'pyramid_path', pyramid_path( f"s3://{bucket}/{key}.zarr" ) )
+        kwargs.setdefault( 'aggregates_path', aggregates_path( f"s3://{bucket}/{key}.zarr" ) )
+        return LISRoutingData( dset, **kwargs )
 
     @classmethod
     def from_disk( cls, path: str, **kwargs ) -> "LISRoutingData":
+        rkwargs = { k: kwargs.pop(k) for k in [ 'default_var', 'index_path', 'mask_var', 'max_distance', 'pyramid_path', 'aggregates_path' ] if k in kwargs }
+        rkwargs.setdefault( 'index_path', index_path( os.path.abspath( path ) ) )
+        rkwargs.setdefault( 'pyramid_path', pyramid_path( os.path.abspath( path ) ) )
+        rkwargs.setdefault( 'aggregates_path', aggregates_path( os.path.abspath( path ) ) )
         dset = xr.open_zarr( path, **kwargs )
-        return LISRoutingData( dset )
+        return LISRoutingData( dset, **rkwargs )
+
+    @property
+    def grid_index(self) -> LISGridIndex:
+        if self._grid_index is None:
+            self._grid_index = LISGridIndex.cached( self._index_path, self.dset, self._mask_var, max_distance=self._max_distance )
+        return self._grid_index
+
+    @property
+    def pyramid(self) -> LISPyramid:
+        if (self._pyramid is None) and (self._pyramid_path is not None):
+            self._pyramid = LISPyramid( self.dset, self._pyramid_path )
+        return self._pyramid
+
+    def build_pyramid( self, nlevels: int = 4, reductions: Dict[str,str] = None, **kwargs ) -> LISPyramid:
+        """Writes coarsened overview levels next to the zarr store; var_image then renders from the level matching the view."""
+        self.pyramid.build( nlevels, reductions, **kwargs )
+        return self.pyramid
+
+    @property
+    def aggregates(self) -> Optional[LISAggregates]:
+        if (self._aggregates is None) and (self._aggregates_path is not None):
+            self._aggregates = LISAggregates( self.dset, self._aggregates_path )
+        return self._aggregates
+
+    def update_aggregates( self, **kwargs ) -> LISAggregates:
+        """Builds (or extends with new time steps) the daily/monthly/annual and climatology aggregate groups."""
+        self.aggregates.update( **kwargs )
+        return self.aggregates
 
-    # def nearest_grid( self, lon, lat ) -> List[int]:
-    #     idx = distance.cdist( np.array([lon,lat]), self._pts ).argmin()
-    #     return  [ int(self._loc['east_west'].iloc[idx]), int(self._loc['north_south'].iloc[idx]) ]
+    def aggregate_data( self, vname: str, period: str, stat: str = 'mean' ) -> xr.DataArray:
+        """Coarse-time view of a variable ('daily', 'monthly', 'annual' or 'climatology'): read from the aggregates store
+           when it has been built, otherwise computed from the full-resolution record."""
+        stored = None if self.aggregates is None else self.aggregates.get( vname, period, stat )
+        if stored is not None: return stored
+        vardata = self.variable(vname)
+        if period == 'climatology': return vardata.groupby( 'time.month' ).mean()
+        return getattr( vardata.resample( time=AGG_FREQS[period] ), stat )()
 
     @property
     def var_names(self) -> List[str]:
         if self._vnames is None:
-            self._vnames = [ str(k) for k,v in self.dset.variables.items() if v.ndim == 3 ]
+            self._vnames = [ str(k) for k,v in self.dset.variables.items() if v.ndim == 3 ] + self.derived.names
         return self._vnames
 
     def dynamic_map( self, **kwargs  ):
+        import holoviews as hv
+        from holoviews.streams import param
         lat = param.Number( default=0.0, doc='Latitude' )
         lon = param.Number( default=0.0, doc='Longitude' )
         vname = param.String( default="", doc='Variable Name' )
@@ -58,20 +120,25 @@ class LISRoutingData:
 
     def site_data(self, vname: str, lon: float, lat: float, **kwargs ) -> xr.DataArray:
         ts = kwargs.get('ts',None)
-        vardata = self.dset[vname]
+        period = kwargs.get( 'period', None )
+        vardata = self.variable(vname) if period is None else self.aggregate_data( vname, period, kwargs.get( 'stat', 'mean' ) )
         sargs = dict( lat=lat, lon=lon )
         if ts is not None: sargs['time'] = slice(*ts)
         return vardata.sel( **sargs )
 
     @exception_handled
-    def var_image( self, streams ) -> hv.DynamicMap:
+    def var_image( self, streams ) -> "hv.DynamicMap":
+        import holoviews as hv
+        if (self.pyramid is not None) and (self.pyramid.nlevels > 1):
+            return self.pyramid_image( streams )
         def vmap( vname: str ):
             logger = eis3().get_logger()
             try:
                 t0 = time.time()
                 logger.info(f"Plotting map image[{vname}]")
-                image_data: xr.DataArray = self.dset[vname].isel(time=0)
-                image_plot =  image_data.hvplot( title=vname )
+                with cim().timer( 'routing.var_image' ):
+                    image_data: xr.DataArray = self.variable(vname).isel(time=0)
+                    image_plot =  hv_image( image_data, title=vname, colorbar=True )
                 logger.info(f"Result shape = {image_data.shape}, exec time = {time.time() - t0} sec")
                 return image_plot
             except Exception as err:
@@ -79,27 +146,97 @@ class LISRoutingData:
                 raise err
         return hv.DynamicMap( vmap, streams=streams )
 
-    def var_data( self, vname: str, x: float, y: float ) -> xa.DataArray:
+    def pyramid_image( self, streams, width: int = 800, height: int = 600 ) -> "hv.DynamicMap":
+        import holoviews as hv
+        from holoviews.streams import RangeXY
+        from holoviews.operation.datashader import rasterize
+        def vmap( vname: str, x_range, y_range ):
+            logger = eis3().get_logger()
+            t0 = time.time()
+            with cim().timer( 'routing.pyramid_view' ):
+                image_data: xr.DataArray = self.pyramid.view( vname, x_range, y_range, width, height )
+            image = hv.Image( image_data, kdims=['lon','lat'], vdims=[vname] ).opts( title=vname )
+            logger.info( f"Pyramid image[{vname}]: shape = {image_data.shape}, exec time = {time.time() - t0} sec" )
+            return image
+        dmap = hv.DynamicMap( vmap, streams=list(streams) + [ RangeXY() ] )
+        return rasterize( dmap, width=width, height=height ).opts( width=width, height=height, colorbar=True, tools=['tap','hover'] )
+
+    @timed( 'routing.var_data' )
+    def var_data( self, vname: str, x: float, y: float, ts: Tuple = None ) -> xa.DataArray:
+        """The series at the grid cell nearest (x,y).  With ts=(start,end) the time window is selected before the read,
+           so only the chunks overlapping it are fetched."""
         logger = eis3().get_logger()
         t0 = time.time()
         ics = self.get_indices(x, y)
-        logger.info( f"Plotting var_graph[{vname}]: lon={x} ({ics['lon']}), lat={y} ({ics['lat']})")
-        gdata = self.dset[vname].isel( lon= ics['lon'], lat= ics['lat'] )
-        gdata.compute()
+        logger.info( f"Plotting var_graph[{vname}]: lon={x} ({ics['lon']}), lat={y} ({ics['lat']}), ts={ts}")
+        vardata: xa.DataArray = self.variable(vname)
+        if ts is not None: vardata = vardata.sel( time=slice(*ts) )
+        if ( ics['lon'] < 0 ) or ( ics['lat'] < 0 ):
+            logger.info( f"No valid grid cell near lon={x}, lat={y}" )
+            gdata = xa.full_like( vardata.isel( lon=0, lat=0 ), np.nan, dtype=np.float64 ).compute()
+        else:
+            gdata = vardata.isel( lon= ics['lon'], lat= ics['lat'] ).compute()
         t1 = time.time()
         logger.info(f"-->> gdata[{vname}] shape = {gdata.shape}, dims={gdata.dims}: read time= {t1 - t0}, plot time= {time.time() - t1} sec")
         gdata.attrs['vname'] = vname
         return gdata
 
-    def var_graph(self, vname: str, x: float, y: float) :
-        return self.var_data( vname, x, y ).hvplot( title=vname )
+    @timed( 'routing.sites_data' )
+    def sites_data( self, vname: str, sites: pd.DataFrame, **kwargs ) -> xa.DataArray:
+        """Extracts the (time, site) series of a variable at every site of a gage table (e.g. LISGageDataset.header) in one pointwise read."""
+        logger = eis3().get_logger()
+        t0 = time.time()
+        idcol = kwargs.get( 'idcol', 'id' )
+        ts = kwargs.get( 'ts', None )
+        vardata: xa.DataArray = self.variable(vname)
+        if ts is not None: vardata = vardata.sel( time=slice(*ts) )
+        ics = self.get_site_indices( sites['lon'].to_numpy(), sites['lat'].to_numpy() )
+        valid = (ics['lon'] >= 0) & (ics['lon'] < self._nx) & (ics['lat'] >= 0) & (ics['lat'] < self._ny)
+        cells = np.stack( [ np.where( valid, ics['lat'], 0 ), np.where( valid, ics['lon'], 0 ) ], axis=1 )
+        (ucells, inverse) = np.unique( cells, axis=0, return_inverse=True )
+        order = self._chunk_order( vardata, ucells )
+        pts = dict( lat=xa.DataArray( ucells[order,0], dims='site' ), lon=xa.DataArray( ucells[order,1], dims='site' ) )
+        cdata: xa.DataArray = vardata.isel( **pts ).compute()
+        rank = np.empty_like( order )
+        rank[order] = np.arange( order.size )
+        sdata = cdata.isel( site=rank[ inverse.ravel() ] ).drop_vars( ['lat','lon'] )
+        sdata = sdata.where( xa.DataArray( valid, dims='site' ) )
+        site_ids = sites[idcol].to_numpy() if idcol in sites.columns else sites.index.to_numpy()
+        sdata = sdata.assign_coords( site=site_ids, lon=( 'site', sites['lon'].to_numpy() ), lat=( 'site', sites['lat'].to_numpy() ) )
+        sdata = sdata.transpose( 'time', 'site' )
+        sdata.attrs['vname'] = vname
+        logger.info( f"sites_data[{vname}]: {len(sites)} sites, {ucells.shape[0]} grid cells, shape = {sdata.shape}, read time= {time.time() - t0} sec" )
+        return sdata
+
+    @staticmethod
+    def _chunk_order( vardata: xa.DataArray, cells: np.ndarray ) -> np.ndarray:
+        """Orders (lat,lon) cell indices by the (lat,lon) zarr chunk containing them, so each chunk is read by a single task."""
+        if vardata.chunks is None: return np.arange( cells.shape[0] )
+        chunks = dict( zip( vardata.dims, vardata.chunks ) )
+        blocks = [ np.searchsorted( np.cumsum( chunks[d] ), cells[:,i], side='right' ) for (i,d) in enumerate(['lat','lon']) ]
+        return np.lexsort( ( cells[:,1], cells[:,0], blocks[1], blocks[0] ) )
+
+    def var_export( self, vname: str, x: float, y: float, format: str = 'arrow', max_points: int = None, ts: Tuple = None ):
+        """The series at (x,y) for external consumers, in its native dtype, optionally LTTB-downsampled to max_points:
+           format='arrow' -> pyarrow RecordBatch (time, <vname>); 'shm' -> (SharedMemory, descriptor) for another process;
+           'numpy' -> the computed DataArray."""
+        gdata = downsample( self.var_data( vname, x, y, ts ), max_points )
+        if format == 'arrow': return to_arrow( gdata )
+        if format == 'shm':   return to_shared_memory( gdata )
+        return gdata
+
+    def var_graph(self, vname: str, x: float, y: float, ts: Tuple = None ) :
+        return hv_curve( downsample( self.var_data( vname, x, y, ts ), self.max_points ), title=vname )
 
     @exception_handled
-    def dvar_graph( self, streams ) -> hv.DynamicMap:
+    def dvar_graph( self, streams ) -> "hv.DynamicMap":
+        import holoviews as hv
         return hv.DynamicMap( self.var_graph, streams=streams )
 
     @exception_handled
     def plot(self):
+        import panel as pn
+        from holoviews.streams import Params, Tap
         var_select = pn.widgets.Select(options=self.var_names, value=self.default_variable, name="LIS Variable List")
         var_stream = Params( var_select, ['value'], rename={ 'value': 'vname' } )
         varmap = self.var_image(streams=[var_stream])
@@ -112,14 +249,24 @@ class LISRoutingData:
         vardata: xr.DataArray = self.site_data( varName, lat, lon, ts=kwargs.pop('ts',None) )
         figsize = kwargs.pop( 'figsize', (8, 5) )
         lplots = vardata.plot( figsize=figsize, **kwargs )
-        fig: plt.Figure = lplots[0].get_figure()
+        fig: "plt.Figure" = lplots[0].get_figure()
         fig.set_facecolor('yellow')
         return lplots
 
+    def zonal_stats( self, polygons, vnames: Union[str,List[str]] = None, stats: List[str] = None, ts: Tuple = None, **kwargs ) -> xr.Dataset:
+        """Area-weighted mean/sum/min/max series per polygon (a vector file, GeoDataFrame or geometries), streamed over time
+           chunks; the rasterized polygon index is cached on disk.  kwargs: id_col, subsample, compute."""
+        compute = kwargs.pop( 'compute', True )
+        zonal = ZonalStatistics( self.dset, polygons, dims=( 'lat', 'lon' ), variable=self.variable, **kwargs )
+        with cim().timer( 'routing.zonal_stats' ):
+            return zonal.compute( self.default_variable if vnames is None else vnames, stats, ts, compute )
+
     def get_indices( self, lon: float, lat: float ) -> Dict[str,int]:
-        ix = int( ( lon - self._x0 ) // self._dx )
-        iy = int( ( lat - self._y0 ) // self._dy )
-        return dict( lon=ix, lat=iy )
+        ics = self.grid_index.query( lon, lat )
+        return dict( lon=int( ics['lon'][0] ), lat=int( ics['lat'][0] ) )
+
+    def get_site_indices( self, lons: np.ndarray, lats: np.ndarray ) -> Dict[str,np.ndarray]:
+        return self.grid_index.query( lons, lats )
 
     def _add_latlon_coords(self, input_dset: xr.Dataset) -> xr.Dataset:
         """Adds lat/lon as dimensions and coordinates to an xarray.Dataset object."""
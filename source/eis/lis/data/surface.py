@@ -1,55 +1,65 @@
 import numpy as np
 import pandas as pd
-import geopandas
 import xarray as xr
-import fsspec
-from datashader.utils import lnglat_to_meters
-from datashader.colors import viridis
-import datashader
-from holoviews.operation.datashader import datashade, shade, dynspread, spread, rasterize
-import holoviews as hv, geoviews as gv
-from geoviews import opts
-from geoviews import tile_sources as gvts
-from holoviews.streams import Selection1D, Params
-import panel as pn
-import hvplot.pandas
-import hvplot.xarray
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
 from eis.smce import eis3
-from scipy.spatial import distance
-gv.extension('bokeh')
+from eis.lis.data.grid_index import LISGridIndex, index_path
+from eis.lis.data.export import hv_curve
+from eis.lis.data.zonal import ZonalStatistics
 
 class LISSurfaceData:
 
     def __init__( self, dset: xr.Dataset, **kwargs ):
         self.dset = dset
+        self._index_path = kwargs.get( 'index_path', None )
+        self._mask_var = kwargs.get( 'mask_var', None )
+        self._grid_index: LISGridIndex = None
+        self.sites: Optional[pd.DataFrame] = kwargs.get( 'sites', None )
 
     @classmethod
-    def from_smce( cls, bucket: str, key: str ) -> "LISSurfaceData":
+    def from_smce( cls, bucket: str, key: str, **kwargs ) -> "LISSurfaceData":
         dset = eis3().get_zarr_dataset(bucket, key)
-        return LISSurfaceData( dset )
+        kwargs.setdefault( 'index_path', index_path( f"s3://{bucket}/{key}.zarr" ) )
+        return LISSurfaceData( dset, **kwargs )
+
+    @property
+    def grid_index(self) -> LISGridIndex:
+        if self._grid_index is None:
+            self._grid_index = LISGridIndex.cached( self._index_path, self.dset, self._mask_var )
+        return self._grid_index
+
+    def zonal_stats( self, polygons, vnames: Union[str,List[str]], stats: List[str] = None, ts: Tuple = None, **kwargs ) -> xr.Dataset:
+        """Area-weighted zonal statistics series per polygon on the (north_south, east_west) grid; see ZonalStatistics."""
+        compute = kwargs.pop( 'compute', True )
+        return ZonalStatistics( self.dset, polygons, dims=( 'north_south', 'east_west' ), **kwargs ).compute( vnames, stats, ts, compute )
+
+    def var_subset( self, vname: str, ix: int, iy: int, ts_tag: str = None, te_tag: str = None ) -> xr.DataArray:
+        """The series of vname at grid cell (ix,iy) between ts_tag and te_tag; the window is selected before the read.
+           All NaN if (ix,iy) is -1 (no valid grid cell)."""
+        subset = self.dset[vname].sel( time=slice( ts_tag, te_tag ) )
+        if ( ix < 0 ) or ( iy < 0 ): return xr.full_like( subset.isel( north_south=0, east_west=0 ), np.nan, dtype=np.float64 ).compute()
+        return subset.isel( north_south=iy, east_west=ix ).compute()
 
     def line_callback(self, index, vname, ts_tag, te_tag):
-        time_tag = '2013-02'
         if not index:
             title = 'Var: -- Lon: -- Lat: --'
-            return self.dset[vname].isel(north_south=1682, east_west=2).sel(time=time_tag).hvplot(title=title)
+            (ny, nx) = ( self.dset.sizes['north_south'], self.dset.sizes['east_west'] )
+            return hv_curve( self.var_subset( vname, nx//2, ny//2, ts_tag, te_tag ), title=title )
 
         first_index = index[0]
-        row = sites.iloc[first_index]
+        row = self.sites.iloc[first_index]
 
         ix, iy = self.nearest_grid( (row.lon, row.lat) )
-        # vals = ds_ol[vname].isel(north_south=iy, east_west=ix).sel(time=time_tag).load()
-        vals = var_subset(vname, ix, iy, ts_tag, te_tag)
+        vals = self.var_subset(vname, ix, iy, ts_tag, te_tag)
 
         vs = vname.split('_')[0]
         title = f'Var: {vs} Lon: {row.lon} Lat: {row.lat}'
 
-        return vals.hvplot(title=title)
+        return hv_curve( vals, title=title )
 
     def nearest_grid( self, pt ):
         # pt : input point, tuple (longtitude, latitude)
         # output:
         #        x_idx, y_idx
-        loc_valid = df_loc.dropna()
-        pts = loc_valid[['lon', 'lat']].to_numpy()
-        idx = distance.cdist([pt], pts).argmin()
\ No newline at end of file
+        ics = self.grid_index.query( pt[0], pt[1] )
+        return int( ics['lon'][0] ), int( ics['lat'][0] )
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os, json, hashlib, time, numpy as np
+import xarray as xa
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable, Sequence
+from eis.smce import eis3
+
+ZONAL_STATS = [ 'mean', 'sum', 'min', 'max' ]
+INDEX_VERSION = 2       # bump when ZonalIndex.build changes, so cached indexes are rebuilt
+
+def load_polygons( polygons, id_col: str = None ) -> Tuple[List[str],List]:
+    """(zone ids, shapely geometries in lon/lat) from a vector file path (GeoJSON read directly, anything else via geopandas),
+       a GeoDataFrame, or a sequence of shapely geometries."""
+    from shapely.geometry import shape
+    if isinstance( polygons, str ):
+        if polygons.lower().endswith( ( ".geojson", ".json" ) ):
+            with open( polygons ) as f: content = json.load( f )
+            features = content['features'] if content.get( 'type' ) == 'FeatureCollection' else [ content ]
+            ids = [ str( ( f.get( 'properties' ) or {} ).get( id_col, i ) ) if id_col else str( f.get( 'id', i ) ) for i, f in enumerate( features ) ]
+            return ids, [ shape( f['geometry'] ) for f in features ]
+        import geopandas as gpd
+        polygons = gpd.read_file( polygons )
+    if hasattr( polygons, 'geometry' ):
+        if ( polygons.crs is not None ) and ( polygons.crs.to_epsg() != 4326 ): polygons = polygons.to_crs( 4326 )
+        ids = polygons[id_col] if id_col else polygons.index
+        return [ str(i) for i in ids ], list( polygons.geometry )
+    return [ str(i) for i in range( len( polygons ) ) ], list( polygons )
+
+class ZonalIndex:
+    """Rasterized polygons on a LIS lat/lon grid: for each zone, the (iy, ix) cells it touches with their covered fraction
+       (estimated on a subsample x subsample grid of points per cell) and relative cell area (cos(lat)).  A polygon too
+       small to contain any subsample point is assigned to the cell nearest its representative point, with the fraction
+       of that cell it covers."""
+
+    def __init__( self, ids: List[str], cells: List[Dict[str,np.ndarray]] ):
+        self.ids = ids
+        self.cells = cells
+
+    @classmethod
+    def build( cls, lon: np.ndarray, lat: np.ndarray, ids: List[str], geometries: List, subsample: int = 4 ) -> "ZonalIndex":
+        import shapely
+        lon, lat = np.asarray( lon, dtype=np.float64 ), np.asarray( lat, dtype=np.float64 )
+        (glon, glat) = np.meshgrid( lon, lat ) if (lon.ndim == 1) else (lon, lat)
+        dx = np.nanmedian( np.abs( np.diff( glon, axis=1 ) ) )
+        dy = np.nanmedian( np.abs( np.diff( glat, axis=0 ) ) )
+        offsets = ( np.arange( subsample ) + 0.5 ) / subsample - 0.5
+        cells = []
+        for geometry in geometries:
+            (x0, y0, x1, y1) = geometry.bounds
+            candidates = np.isfinite( glon ) & np.isfinite( glat ) & ( glon >= x0 - dx ) & ( glon <= x1 + dx ) & ( glat >= y0 - dy ) & ( glat <= y1 + dy )
+            (iy, ix) = np.nonzero( candidates )
+            (clon, clat) = ( glon[iy,ix], glat[iy,ix] )
+            px = clon[:,None,None] + dx * offsets[None,:,None] + np.zeros( (1,1,subsample) )
+            py = clat[:,None,None] + dy * offsets[None,None,:] + np.zeros( (1,subsample,1) )
+            fraction = shapely.contains_xy( geometry, px, py ).mean( axis=(1,2) )
+            if ( fraction.size > 0 ) and not ( fraction > 0 ).any():
+                point = geometry.representative_point()
+                nearest = int( np.argmin( ( clon - point.x ) ** 2 + ( clat - point.y ) ** 2 ) )
+                fraction[nearest] = min( geometry.area / ( dx * dy ), 1.0 )
+            keep = fraction > 0
+            cells.append( dict( iy=iy[keep], ix=ix[keep], fraction=fraction[keep], area=np.cos( np.deg2rad( clat[keep] ) ) ) )
+        return ZonalIndex( ids, cells )
+
+    @classmethod
+    def cached( cls, lon: np.ndarray, lat: np.ndarray, ids: List[str], geometries: List, subsample: int = 4, cache_dir: str = None ) -> "ZonalIndex":
+        """Loads the index for this grid + zones from cache_dir (default: the EIS cache), building and saving it if absent."""
+        digest = hashlib.sha1()
+        for array in [ np.asarray( lon ), np.asarray( lat ) ]: digest.update( np.ascontiguousarray( array ).tobytes() )
+        for (zid, geometry) in zip( ids, geometries ): digest.update( zid.encode() + geometry.wkb )
+        digest.update( f"{subsample}.{INDEX_VERSION}".encode() )
+        cache_dir = os.path.join( eis3().cache_dir if cache_dir is None else cache_dir, "zonal" )
+        path = os.path.join( cache_dir, f"{digest.hexdigest()}.npz" )
+        if os.path.isfile( path ): return cls.load( path )
+        t0 = time.time()
+        index = cls.build( lon, lat, ids, geometries, subsample )
+        os.makedirs( cache_dir, exist_ok=True )
+        index.save( path )
+        eis3().get_logger().info( f"Built zonal index ({len(ids)} zones) in {time.time()-t0:.2f} sec: {path}" )
+        return index
+
+    def save( self, path: str ):
+        sizes = np.array( [ c['iy'].size for c in self.cells ] )
+        arrays = { k: np.concatenate( [ c[k] for c in self.cells ] ) for k in [ 'iy', 'ix', 'fraction', 'area' ] }
+        np.savez( path, ids=np.array( self.ids ), sizes=sizes, **arrays )
+
+    @classmethod
+    def load( cls, path: str ) -> "ZonalIndex":
+        with np.load( path ) as npz:
+            bounds = np.concatenate( [ [0], np.cumsum( npz['sizes'] ) ] )
+            cells = [ { k: npz[k][ bounds[i]:bounds[i+1] ] for k in [ 'iy', 'ix', 'fraction', 'area' ] } for i in range( bounds.size - 1 ) ]
+            return ZonalIndex( [ str(i) for i in npz['ids'] ], cells )
+
+class ZonalStatistics:
+    """Area-weighted zonal statistics of (time, y, x) LIS variables over polygons.
+         mean: sum( value * fraction * area ) / sum( fraction * area ) over valid cells
+         sum:  sum( value * fraction )  (cell values weighted by the covered fraction)
+         min/max: over cells touched by the polygon
+       Each zone reads only its bounding box, and reductions run chunk by chunk over time with dask, so memory is bounded
+       by the chunk size rather than the record length.  For example, basin-averaged streamflow over the delta domain:
+
+           zs = ZonalStatistics( routing.dset, "data/mississippi-river-delta/vector/mississippi_river_delta_domain.geojson" )
+           series = zs.compute( 'Streamflow_tavg', stats=['mean','max'] )
+    """
+
+    def __init__( self, dset: xa.Dataset, polygons, **kwargs ):
+        self.dset = dset
+        (self.ydim, self.xdim) = kwargs.get( 'dims', ( 'lat', 'lon' ) if 'lat' in dset.dims else ( 'north_south', 'east_west' ) )
+        (self.ids, self.geometries) = load_polygons( polygons, kwargs.get( 'id_col', None ) )
+        self._subsample: int = kwargs.get( 'subsample', 4 )
+        self._cache_dir: Optional[str] = kwargs.get( 'cache_dir', None )
+        self._variable: Callable[[str],xa.DataArray] = kwargs.get( 'variable', lambda vname: self.dset[vname] )
+        self._index: ZonalIndex = None
+
+    @property
+    def index(self) -> ZonalIndex:
+        if self._index is None:
+            lon, lat = self.dset['lon'], self.dset['lat']
+            if 'time' in lon.dims: lon, lat = lon.isel(time=0), lat.isel(time=0)
+            self._index = ZonalIndex.cached( lon.values, lat.values, self.ids, self.geometries, self._subsample, self._cache_dir )
+        return self._index
+
+    def _zone_stats( self, data: xa.DataArray, cells: Dict[str,np.ndarray], stats: List[str] ) -> Dict[str,xa.DataArray]:
+        dims = [ self.ydim, self.xdim ]
+        if cells['iy'].size == 0:
+            return { stat: xa.full_like( data.isel( { d: 0 for d in dims }, drop=True ), np.nan, dtype=np.float64 ) for stat in stats }
+        (y0, x0) = ( int( cells['iy'].min() ), int( cells['ix'].min() ) )
+        (y1, x1) = ( int( cells['iy'].max() ) + 1, int( cells['ix'].max() ) + 1 )
+        block = data.isel( { self.ydim: slice( y0, y1 ), self.xdim: slice( x0, x1 ) } )
+        block = block.drop_vars( [ c for c in block.coords if ( self.ydim in block[c].dims ) or ( self.xdim in block[c].dims ) ] )
+        fraction = np.zeros( ( y1 - y0, x1 - x0 ), dtype=np.float64 )
+        area = np.zeros_like( fraction )
+        fraction[ cells['iy'] - y0, cells['ix'] - x0 ] = cells['fraction']
+        area[ cells['iy'] - y0, cells['ix'] - x0 ] = cells['area']
+        fraction = xa.DataArray( fraction, dims=dims )
+        weight = fraction * xa.DataArray( area, dims=dims )
+        result = {}
+        if 'mean' in stats: result['mean'] = ( block * weight ).sum( dims ) / weight.where( block.notnull() ).sum( dims )
+        if 'sum' in stats:  result['sum'] = ( block * fraction ).sum( dims, min_count=1 )
+        if 'min' in stats:  result['min'] = block.where( fraction > 0 ).min( dims )
+        if 'max' in stats:  result['max'] = block.where( fraction > 0 ).max( dims )
+        return result
+
+    def compute( self, vnames: Union[str,List[str]], stats: List[str] = None, ts: Tuple = None, compute: bool = True ) -> xa.Dataset:
+        """Dataset of '<vname>_<stat>' series with dims (time, zone); lazy (dask) if compute=False."""
+        stats = ZONAL_STATS if stats is None else stats
+        vnames = [ vnames ] if isinstance( vnames, str ) else vnames
+        result = xa.Dataset()
+        for vname in vnames:
+            data: xa.DataArray = self._variable( vname )
+            if ts is not None: data = data.sel( time=slice(*ts) )
+            zones = [ self._zone_stats( data, cells, stats ) for cells in self.index.cells ]
+            for stat in stats:
+                series = xa.concat( [ zone[stat] for zone in zones ], dim='zone' ).assign_coords( zone=self.ids )
+                result[f"{vname}_{stat}"] = series.transpose( 'time', 'zone', ... ) if 'time' in series.dims else series
+        return result.compute() if compute else result
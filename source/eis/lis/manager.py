@@ -1,7 +1,6 @@
 import xarray as xr
 import numpy as np
 import pandas as pd
-import geopandas as gpd
 from eis.smce import eis3
 
 class LIS:
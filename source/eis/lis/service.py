@@ -0,0 +1,223 @@
+"""Local HTTP query service over LIS routing (and gage) data.
+
+    python -m eis.lis.service --path /data/lis_routing.zarr [--header gages/header.txt --gage-dir gages] --port 8765
+    python -m eis.lis.service --bucket eis-dh-hydro --key projects/LIS/routing [--port 8765]
+
+Endpoints (GET; binary payloads via format=arrow (default) | npz | json):
+    /point?var=&lon=&lat=[&start=&end=&max_points=]         time series at the grid cell nearest (lon, lat), optionally LTTB-downsampled
+    /box?var=&lon0=&lon1=&lat0=&lat1=[&start=&end=&stride=]  (time, lat, lon) block, optionally strided
+    /gage?var=&index=[&start=&end=]                          aligned (series=[routing,gage], time) at a gage
+    /variables, /stats                                       JSON
+"""
+import asyncio, json, time, argparse, urllib.request, urllib.parse, numpy as np
+import xarray as xa
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+from tornado.web import Application, RequestHandler, HTTPError
+from eis.lis.data.routing import LISRoutingData
+from eis.lis.data.derived import ChunkLRU
+from eis.lis.data.export import downsample, arrow_bytes, npz_bytes, json_bytes, read_arrow, read_npz, read_json, ARROW_MIME, NPZ_MIME, JSON_MIME
+from eis.smce import eis3
+from eis.cluster import cim
+
+ENCODERS = dict( arrow=( arrow_bytes, ARROW_MIME ), npz=( npz_bytes, NPZ_MIME ), json=( json_bytes, JSON_MIME ) )
+DECODERS = dict( arrow=read_arrow, npz=read_npz, json=read_json )
+
+class LISQueryService:
+    """Long-lived query service over one LISRoutingData (plus an optional LISCombinedDataset for gage queries).
+       The datasets and grid index are opened once and kept warm.  Queries run on a thread pool; identical concurrent
+       queries share a single computation, and results are kept in a byte-bounded LRU shared by all clients.  Chunk
+       reads go through the process-wide EIS3 chunk caches."""
+
+    def __init__( self, routing: LISRoutingData, combined = None, **kwargs ):
+        self.routing = routing
+        self.combined = combined
+        self.results = ChunkLRU( int( kwargs.get( 'cache_mb', 500 ) * 1.0e6 ) )
+        self.max_cells: int = kwargs.get( 'max_cells', 50000000 )
+        self.coalesced = 0
+        self._executor = ThreadPoolExecutor( kwargs.get( 'workers', 8 ) )
+        self._pending: Dict[Tuple,asyncio.Future] = {}
+
+    def warm(self):
+        """Opens everything the first query would otherwise pay for: variable list, grid index, gage table."""
+        t0 = time.time()
+        self.routing.var_names
+        self.routing.grid_index
+        if self.combined is not None: self.combined.gage_data.gages_data
+        eis3().get_logger().info( f"LISQueryService warmed up in {time.time()-t0:.2f} sec" )
+
+    def _check_var( self, vname: str ) -> Tuple:
+        """The current version of vname (part of every result key, so redefined variables are recomputed)."""
+        if vname not in self.routing.var_names: raise KeyError( f"Unknown variable '{vname}'" )
+        return self.routing.derived.version( vname )
+
+    async def query( self, key: Tuple, compute: Callable[[],xa.DataArray] ) -> xa.DataArray:
+        """Result for key: from the result cache, by joining an identical in-flight query, or by running compute."""
+        cached = self.results.get( key )
+        if cached is not None: return cached
+        future = self._pending.get( key )
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor( self._executor, compute )
+            self._pending[key] = future
+            future.add_done_callback( partial( self._completed, key ) )
+        else:
+            self.coalesced += 1
+        return await asyncio.shield( future )
+
+    def _completed( self, key: Tuple, future: asyncio.Future ):
+        self._pending.pop( key, None )
+        if not future.cancelled() and ( future.exception() is None ):
+            self.results.put( key, future.result() )
+
+    async def point( self, vname: str, lon: float, lat: float, start: str = None, end: str = None, max_points: int = None ) -> xa.DataArray:
+        version = self._check_var( vname )
+        ics = self.routing.get_indices( lon, lat )
+        if ( ics['lon'] < 0 ) or ( ics['lat'] < 0 ): raise ValueError( f"No valid grid cell near lon={lon}, lat={lat}" )
+        subset = self.routing.variable( vname ).isel( **ics ).sel( time=slice( start, end ) )
+        compute = lambda: downsample( self._compute( 'point', subset ), max_points )
+        return await self.query( ( 'point', vname, version, ics['lon'], ics['lat'], start, end, max_points ), compute )
+
+    async def box( self, vname: str, lon0: float, lon1: float, lat0: float, lat1: float, start: str = None, end: str = None, stride: int = 1 ) -> xa.DataArray:
+        version = self._check_var( vname )
+        subset = self.routing.variable( vname ).sel( lon=slice( lon0, lon1 ), lat=slice( lat0, lat1 ), time=slice( start, end ) )
+        if stride > 1: subset = subset.isel( lat=slice( None, None, stride ), lon=slice( None, None, stride ) )
+        if subset.size > self.max_cells: raise ValueError( f"Box query selects {subset.size} values (max {self.max_cells}): use a smaller box, time window or a stride" )
+        return await self.query( ( 'box', vname, version, lon0, lon1, lat0, lat1, start, end, stride ), partial( self._compute, 'box', subset ) )
+
+    async def gage( self, vname: str, gage_index: int, start: str = None, end: str = None ) -> xa.DataArray:
+        if self.combined is None: raise KeyError( "No gage data loaded in this service" )
+        version = self._check_var( vname )
+        def compute() -> xa.DataArray:
+            with cim().timer( 'service.gage' ):
+                (rdata, gdata) = self.combined.get_aligned_data( gage_index, vname )
+                values = np.stack( [ rdata.values, gdata.values.astype( rdata.dtype ) ] )
+                aligned = xa.DataArray( values, dims=['series','time'], coords=dict( series=['routing','gage'], time=rdata['time'].values ), name=vname )
+                return aligned.sel( time=slice( start, end ) )
+        return await self.query( ( 'gage', vname, version, gage_index, start, end ), compute )
+
+    @staticmethod
+    def _compute( kind: str, subset: xa.DataArray ) -> xa.DataArray:
+        with cim().timer( f'service.{kind}' ):
+            return subset.compute()
+
+    async def encode( self, result: xa.DataArray, fmt: str ) -> bytes:
+        return await asyncio.get_running_loop().run_in_executor( self._executor, ENCODERS[fmt][0], result )
+
+    def stats(self) -> Dict[str,Any]:
+        derived = self.routing.derived.cache
+        return dict( results=dict( hits=self.results.hits, misses=self.results.misses, nbytes=self.results.nbytes ),
+                     coalesced=self.coalesced, pending=len( self._pending ),
+                     derived=dict( hits=derived.hits, misses=derived.misses, nbytes=derived.nbytes ),
+                     chunk_caches={ path: cache.stats for path, cache in eis3().chunk_caches.items() },
+                     timings=cim().summary()['histograms'] )
+
+    def app(self) -> Application:
+        args = dict( service=self )
+        return Application( [ ( r"/(point|box|gage)", QueryHandler, args ), ( r"/variables", VariablesHandler, args ), ( r"/stats", StatsHandler, args ) ] )
+
+    def listen( self, port: int = 8765, address: str = "127.0.0.1" ):
+        return self.app().listen( port, address )
+
+    def serve( self, port: int = 8765, address: str = "127.0.0.1" ):
+        """Warms up, then serves on address:port until interrupted."""
+        async def main():
+            self.warm()
+            self.listen( port, address )
+            print( f"LISQueryService listening on http://{address}:{port}" )
+            await asyncio.Event().wait()
+        asyncio.run( main() )
+
+class ServiceHandler(RequestHandler):
+
+    def initialize( self, service: LISQueryService ):
+        self.service = service
+
+    def write_json( self, content: Any ):
+        self.set_header( "Content-Type", JSON_MIME )
+        self.write( json.dumps( content, default=str ) )
+
+class VariablesHandler(ServiceHandler):
+
+    def get(self):
+        self.write_json( self.service.routing.var_names )
+
+class StatsHandler(ServiceHandler):
+
+    def get(self):
+        self.write_json( self.service.stats() )
+
+class QueryHandler(ServiceHandler):
+
+    async def get( self, kind: str ):
+        fmt = self.get_argument( 'format', 'arrow' )
+        if fmt not in ENCODERS: raise HTTPError( 400, f"Unknown format '{fmt}', must be one of {list(ENCODERS.keys())}" )
+        vname = self.get_argument( 'var' )
+        window = dict( start=self.get_argument( 'start', None ), end=self.get_argument( 'end', None ) )
+        try:
+            if kind == 'point':
+                max_points = self.get_argument( 'max_points', None )
+                result = await self.service.point( vname, float( self.get_argument('lon') ), float( self.get_argument('lat') ), max_points=( None if max_points is None else int( max_points ) ), **window )
+            elif kind == 'box':
+                bounds = [ float( self.get_argument(b) ) for b in [ 'lon0', 'lon1', 'lat0', 'lat1' ] ]
+                result = await self.service.box( vname, *bounds, stride=int( self.get_argument( 'stride', '1' ) ), **window )
+            else:
+                result = await self.service.gage( vname, int( self.get_argument('index') ), **window )
+        except KeyError as err:
+            raise HTTPError( 404, str(err) )
+        except ValueError as err:
+            raise HTTPError( 400, str(err) )
+        self.set_header( "Content-Type", ENCODERS[fmt][1] )
+        self.write( await self.service.encode( result, fmt ) )
+
+class LISQueryClient:
+    """Minimal client for LISQueryService returning DataArrays."""
+
+    def __init__( self, url: str = "http://127.0.0.1:8765", format: str = 'arrow' ):
+        self.url = url.rstrip("/")
+        self.format = format
+
+    def _get( self, path: str, **params ) -> bytes:
+        query = urllib.parse.urlencode( { k: v for k, v in params.items() if v is not None } )
+        with urllib.request.urlopen( f"{self.url}/{path}?{query}" ) as response:
+            return response.read()
+
+    def _query( self, kind: str, **params ) -> xa.DataArray:
+        return DECODERS[self.format]( self._get( kind, format=self.format, **params ) )
+
+    def point( self, vname: str, lon: float, lat: float, start: str = None, end: str = None, max_points: int = None ) -> xa.DataArray:
+        return self._query( 'point', var=vname, lon=lon, lat=lat, start=start, end=end, max_points=max_points )
+
+    def box( self, vname: str, lon0: float, lon1: float, lat0: float, lat1: float, start: str = None, end: str = None, stride: int = 1 ) -> xa.DataArray:
+        return self._query( 'box', var=vname, lon0=lon0, lon1=lon1, lat0=lat0, lat1=lat1, start=start, end=end, stride=stride )
+
+    def gage( self, vname: str, gage_index: int, start: str = None, end: str = None ) -> xa.DataArray:
+        return self._query( 'gage', var=vname, index=gage_index, start=start, end=end )
+
+    def variables(self) -> List[str]:
+        return json.loads( self._get( 'variables' ) )
+
+    def stats(self) -> Dict[str,Any]:
+        return json.loads( self._get( 'stats' ) )
+
+def main( argv: List[str] = None ):
+    parser = argparse.ArgumentParser( prog="eis.lis.service" )
+    parser.add_argument( '--path', help="local zarr store" )
+    parser.add_argument( '--bucket' )
+    parser.add_argument( '--key', help="store key in bucket, without the .zarr suffix" )
+    parser.add_argument( '--header', help="gage header file (enables /gage)" )
+    parser.add_argument( '--gage-dir' )
+    parser.add_argument( '--port', type=int, default=8765 )
+    parser.add_argument( '--address', default="127.0.0.1" )
+    parser.add_argument( '--cache-mb', type=float, default=500 )
+    args = parser.parse_args( argv )
+    routing = LISRoutingData.from_disk( args.path ) if args.path else LISRoutingData.from_smce( args.bucket, args.key )
+    combined = None
+    if args.header:
+        from eis.lis.data.gage import LISGageDataset
+        from eis.lis.data.combined import LISCombinedDataset
+        combined = LISCombinedDataset( LISGageDataset.from_directory( args.header, args.gage_dir ), routing )
+    LISQueryService( routing, combined, cache_mb=args.cache_mb ).serve( args.port, args.address )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import sys, logging, logging.handlers, queue, threading, time, json, atexit, weakref
+from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
+
+WORKER_LOG_TOPIC = "eis-log"
+
+class RateLimitFilter(logging.Filter):
+    """Passes at most `rate` records per `interval` seconds from each logging call site (logger, file, line) at or below
+       `max_level`; the number suppressed is appended to the next record that gets through."""
+
+    def __init__( self, rate: int = 10, interval: float = 60.0, max_level: int = logging.INFO ):
+        super(RateLimitFilter, self).__init__()
+        self.rate, self.interval, self.max_level = rate, interval, max_level
+        self._windows: Dict[Tuple,List] = {}
+        self._lock = threading.Lock()
+
+    def filter( self, record: logging.LogRecord ) -> bool:
+        if record.levelno > self.max_level: return True
+        key, now = ( record.name, record.pathname, record.lineno ), time.time()
+        with self._lock:
+            window = self._windows.setdefault( key, [ now, 0, 0 ] )     # [ window start, passed, suppressed ]
+            if now - window[0] > self.interval: window[0], window[1] = now, 0
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2] > 0:
+                record.msg = f"{record.msg} [{window[2]} similar messages suppressed]"
+                window[2] = 0
+        return True
+
+class JsonFormatter(logging.Formatter):
+
+    def format( self, record: logging.LogRecord ) -> str:
+        entry = dict( time=self.formatTime( record ), name=record.name, level=record.levelname, message=record.getMessage(),
+                      host=getattr( record, 'host', None ), pid=record.process, file=record.pathname, line=record.lineno )
+        if record.exc_info: entry['exception'] = self.formatException( record.exc_info )
+        return json.dumps( entry )
+
+_listeners: List[logging.handlers.QueueListener] = []
+_worker_handlers: "weakref.WeakSet[WorkerEventHandler]" = weakref.WeakSet()
+
+class PeriodicFlush:
+    """Handler mixin: a daemon thread calls flush() every `flush_interval` seconds, so buffered records are written
+       after a quiet period instead of waiting for the next emit."""
+
+    def start_flusher(self):
+        self._stopped = threading.Event()
+        threading.Thread( target=self._flush_loop, name=f"{type(self).__name__}-flush", daemon=True ).start()
+
+    def _flush_loop(self):
+        while not self._stopped.wait( self.flush_interval ):
+            try:                self.flush()
+            except Exception:   pass
+
+    def stop_flusher(self):
+        self._stopped.set()
+
+class BatchingFileHandler(PeriodicFlush,logging.FileHandler):
+    """File handler that writes records in batches: flushed when `capacity` records are buffered, every `flush_interval`
+       seconds, or immediately for records at or above `flush_level`."""
+
+    def __init__( self, filename: str, capacity: int = 200, flush_interval: float = 2.0, flush_level: int = logging.ERROR ):
+        super(BatchingFileHandler, self).__init__( filename, delay=True )
+        self.capacity, self.flush_interval, self.flush_level = capacity, flush_interval, flush_level
+        self._buffer: List[str] = []
+        self._last_flush = time.time()
+        self.start_flusher()
+
+    def emit( self, record: logging.LogRecord ):
+        try:
+            self._buffer.append( self.format( record ) )
+            if ( len( self._buffer ) >= self.capacity ) or ( record.levelno >= self.flush_level ) or ( time.time() - self._last_flush > self.flush_interval ):
+                self.flush()
+        except Exception:
+            self.handleError( record )
+
+    def flush(self):
+        self.acquire()
+        try:
+            if len( self._buffer ):
+                if self.stream is None: self.stream = self._open()
+                self.stream.write( self.terminator.join( self._buffer ) + self.terminator )
+                self.stream.flush()
+                self._buffer = []
+            self._last_flush = time.time()
+        finally:
+            self.release()
+
+    def close(self):
+        self.stop_flusher()
+        self.flush()
+        super(BatchingFileHandler, self).close()
+
+class WorkerEventHandler(PeriodicFlush,logging.Handler):
+    """On a dask worker, ships batches of formatted records to the scheduler as WORKER_LOG_TOPIC events
+       instead of writing a log file per worker process.  Besides the periodic flush, WorkerLogsPlugin flushes
+       pending records when the worker shuts down."""
+
+    def __init__( self, worker, capacity: int = 100, flush_interval: float = 2.0 ):
+        super(WorkerEventHandler, self).__init__()
+        self.worker = worker
+        self.capacity, self.flush_interval = capacity, flush_interval
+        self._buffer: List[str] = []
+        self._last_flush = time.time()
+        _worker_handlers.add( self )
+        self.start_flusher()
+
+    def emit( self, record: logging.LogRecord ):
+        try:
+            self._buffer.append( self.format( record ) )
+            if ( len( self._buffer ) >= self.capacity ) or ( time.time() - self._last_flush > self.flush_interval ):
+                self.flush()
+        except Exception:
+            self.handleError( record )
+
+    def flush(self):
+        self.acquire()
+        try:
+            if len( self._buffer ):
+                self.worker.log_event( WORKER_LOG_TOPIC, dict( worker=self.worker.address, records=self._buffer ) )
+                self._buffer = []
+            self._last_flush = time.time()
+        finally:
+            self.release()
+
+    def close(self):
+        self.stop_flusher()
+        self.flush()
+        super(WorkerEventHandler, self).close()
+
+def current_worker():
+    if 'distributed' not in sys.modules: return None     # don't pay the distributed import just to find out
+    try:
+        from distributed import get_worker
+        return get_worker()
+    except ( ImportError, ValueError ):
+        return None
+
+def queued_handler( handlers: List[logging.Handler] ) -> logging.handlers.QueueHandler:
+    """Wraps handlers behind a QueueHandler: callers only enqueue, a background listener thread does the I/O."""
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener( log_queue, *handlers, respect_handler_level=True )
+    listener.start()
+    atexit.register( listener.stop )
+    _listeners.append( listener )
+    return logging.handlers.QueueHandler( log_queue )
+
+def flush_worker_logs():
+    """Drains the queued records of this process into its WorkerEventHandlers and ships them."""
+    for listener in _listeners:
+        if any( isinstance( h, WorkerEventHandler ) for h in listener.handlers ) and ( listener._thread is not None ):
+            listener.stop()
+            listener.start()
+    for handler in list( _worker_handlers ): handler.flush()
+
+def worker_logs_plugin():
+    """Worker plugin flushing pending worker log records on teardown (worker shutdown or plugin removal)."""
+    from distributed.diagnostics.plugin import WorkerPlugin
+    class WorkerLogsPlugin(WorkerPlugin):
+        name = "eis-worker-logs"
+        def teardown( self, worker ): flush_worker_logs()
+    return WorkerLogsPlugin()
+
+def forward_worker_logs( client, log_file: str ) -> BatchingFileHandler:
+    """Subscribes the client to worker log events and appends them to a single log file on the client host."""
+    handler = BatchingFileHandler( log_file )
+    def write_events( event: Tuple[float,Dict] ):
+        (timestamp, msg) = event
+        handler.acquire()
+        try:     handler._buffer.extend( msg['records'] )
+        finally: handler.release()
+        handler.flush()
+    client.subscribe_topic( WORKER_LOG_TOPIC, write_events )
+    client.register_plugin( worker_logs_plugin() )
+    return handler
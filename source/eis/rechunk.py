@@ -1,12 +1,50 @@
 import xarray as xr
-import os, time, numpy as np
+import pandas as pd
+import os, time, json, math, itertools, numpy as np
 from eis.smce import eis3, exception_handled
 from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
-from zarr.storage import DirectoryStore
-from rechunker import rechunk, Rechunked
+from collections.abc import MutableMapping
+from zarr.storage import DirectoryStore, listdir
 from eis.smce import eis3
+from eis.chunk_plan import ChunkPlanner, ChunkPlan
+from eis.encoding import EncodingProfile, EncodingBenchmark, resolve_profiles
+from eis.cluster import cim
 import shutil
 
+class RechunkManifest:
+    """Record of completed (variable, region) copy tasks, kept in the target store so interrupted runs can resume."""
+
+    key = ".rechunk_manifest.json"
+
+    def __init__( self, store: MutableMapping, chunks: Dict[str,Dict[str,int]], region_dim: str ):
+        self.store = store
+        self.chunks = chunks
+        self.region_dim = region_dim
+        self.completed: Dict[str,List[int]] = {}
+
+    @classmethod
+    def load( cls, store: MutableMapping ) -> Optional["RechunkManifest"]:
+        if cls.key not in store: return None
+        spec = json.loads( store[cls.key] )
+        manifest = RechunkManifest( store, spec['chunks'], spec['region_dim'] )
+        manifest.completed = spec['completed']
+        return manifest
+
+    def compatible( self, chunks: Dict[str,Dict[str,int]], region_dim: str ) -> bool:
+        return ( self.chunks == chunks ) and ( self.region_dim == region_dim )
+
+    def is_complete( self, vname: str, region_start: int ) -> bool:
+        return region_start in self.completed.get( vname, [] )
+
+    def mark_complete( self, vname: str, region_start: int ):
+        completed = self.completed.setdefault( vname, [] )
+        if region_start not in completed: completed.append( region_start )
+        self.save()
+
+    def save(self):
+        spec = dict( chunks=self.chunks, region_dim=self.region_dim, completed=self.completed )
+        self.store[self.key] = json.dumps( spec ).encode()
+
 
 class Rechunker:
 
@@ -21,7 +59,7 @@ class Rechunker:
 
     @classmethod
     def from_smce( cls, bucket: str, key: str, **kwargs ) -> "Rechunker":
-        dset = eis3().get_zarr_dataset( bucket, key )
+        dset = eis3().get_zarr_dataset( bucket, key, cache=False )
         name = key.replace("/",".")
         return Rechunker( name, dset, **kwargs  )
 
@@ -32,7 +70,15 @@ class Rechunker:
         dset = xr.open_zarr( zarr_dset_path, consolidated=True )
         return Rechunker( name, dset, data_dir=data_dir, **kwargs  )
 
-    def get_chunks(self, chunk_sizes: Dict[str,int] ):
+    def plan_chunks( self, access: Union[str,Dict[str,float]], **kwargs ) -> ChunkPlan:
+        """Chooses target chunks and max_memory for an access pattern ('timeseries', 'map', or a weighted dict of both)."""
+        plan = ChunkPlanner( self.dset, **kwargs ).plan( access, **kwargs )
+        print( plan )
+        return plan
+
+    def get_chunks(self, chunk_sizes: Union[Dict[str,int],ChunkPlan] ):
+        if isinstance( chunk_sizes, ChunkPlan ):
+            return chunk_sizes.chunks
         for d in self.dset.dims:
             assert d in chunk_sizes.keys(), f"Missing chunk_size declaration for dim {d}"
         chunks = {}
@@ -40,32 +86,191 @@ class Rechunker:
             chunks[vname] = { d: chunk_sizes[d] for d in v.dims }
         return chunks
 
-    def rechunk( self, chunk_sizes: Dict[str,int], **kwargs ):
+    def benchmark_encodings( self, chunk_sizes: Union[Dict[str,int],ChunkPlan], candidates: Dict[str,Union[str,EncodingProfile]] = None, **kwargs ) -> pd.DataFrame:
+        """Compression ratio vs. encode/decode throughput (and max error for lossy profiles) of each candidate encoding,
+           measured on `nsamples` sampled target chunks per variable, without writing anything."""
+        report = EncodingBenchmark( self.dset, self.get_chunks( chunk_sizes ), **kwargs ).run( candidates )
+        print( report.to_string() )
+        return report
+
+    def encoded_source( self, encoding ) -> Tuple[xr.Dataset,Dict[str,EncodingProfile]]:
+        """Source dataset with each profiled variable's storage dtype and declared precision (attrs['precision']) attached."""
+        profiles = resolve_profiles( self.dset, encoding )
+        dset = self.dset.copy()
+        for (vname, profile) in profiles.items():
+            if profile.dtype is not None: dset[vname].encoding['dtype'] = profile.storage_dtype( dset[vname] )
+            if profile.lossy: dset[vname].attrs['precision'] = profile.precision
+        return dset, profiles
+
+    def rechunk( self, chunk_sizes: Union[Dict[str,int],ChunkPlan], **kwargs ):
+        """kwargs: encoding = a profile name ('fast', 'balanced', 'archive'), an EncodingProfile, or {vname: profile};
+           variables without a profile get zarr's default compressor."""
+        import zarr
+        from rechunker import rechunk, Rechunked
         from eis.s3 import s3m
+        if kwargs.pop( 'resume', False ):
+            return self.resumable_rechunk( chunk_sizes, **kwargs )
+        if kwargs.pop( 'append', False ):
+            return self.append_rechunk( chunk_sizes, **kwargs )
         t0 = time.time()
-        max_memory =   kwargs.pop( 'max_memory', 100 ) * 1000 * 1000
+        default_memory = chunk_sizes.max_memory if isinstance( chunk_sizes, ChunkPlan ) else 100
+        max_memory =   kwargs.pop( 'max_memory', default_memory ) * 1000 * 1000
         target_store = kwargs.pop( 'target_store',  f"{self.data_dir}/{self.name}.zarr" )
         temp_dir   =   kwargs.pop( 'temp_dir', self.cache_dir )
         clear_cache = kwargs.get('clear_cache', False)
+        s3_kwargs = { k: kwargs.pop(k) for k in [ 'max_concurrency', 'max_retries', 'backoff' ] if k in kwargs }
         chunks = self.get_chunks( chunk_sizes )
+        (source, profiles) = self.encoded_source( kwargs.pop( 'encoding', None ) )
+        target_options = { vname: { k: v for k, v in profile.encoding( source[vname] ).items() if k != 'dtype' } for vname, profile in profiles.items() }
         if isinstance( target_store, str ):
             if target_store.startswith("/"):
                 target_store = f"{target_store}.zarr"
                 shutil.rmtree( target_store, ignore_errors= True )
             elif target_store.startswith("s3:"):
-                target_store = s3m().get_store( f"{target_store}.zarr", "w")
+                target_store = s3m().get_store( f"{target_store}.zarr", "w", batched=True, **s3_kwargs )
             print( f"Writing result to {target_store} with max-memory-per-worker set to {max_memory} bytes" )
         temp_store =  f"{temp_dir}/{self.name}.zarr"
         shutil.rmtree( temp_store, ignore_errors= True )
         print(f"Using temp_store: {temp_store} with chunks = {chunks}")
-        rechunked: Rechunked = rechunk( self.dset, chunks, max_memory, target_store=target_store, temp_store=temp_store, **kwargs )
-        rv = rechunked.execute()
+        rechunked: Rechunked = rechunk( source, chunks, max_memory, target_store=target_store, temp_store=temp_store, target_options=target_options, **kwargs )
+        with cim().timer( 'rechunk.execute' ), cim().profile( f'rechunk.{self.name}' ):
+            rv = rechunked.execute()
+        zarr.consolidate_metadata( target_store )
         t1 = time.time()
-        print( f"Rechunking completed in {(t1-t0)/60.0} min.")
+        if hasattr( target_store, 'report' ): print( f"Rechunking completed in {(t1-t0)/60.0} min. {target_store.report()}" )
+        else: print( f"Rechunking completed in {(t1-t0)/60.0} min, {self.dset.nbytes/1.0e6/(t1-t0):.1f} MB/s (uncompressed).")
         if clear_cache:
             self.clear_cache( **kwargs )
         return rv
 
+    def resumable_rechunk( self, chunk_sizes: Union[Dict[str,int],ChunkPlan], **kwargs ):
+        """Rechunks region by region (slabs of whole target chunks along region_dim), recording each completed
+           (variable, region) in a manifest in the target store.  A restarted run skips regions whose chunks are all present."""
+        t0 = time.time()
+        target_store = kwargs.pop( 'target_store',  f"{self.data_dir}/{self.name}" )
+        region_dim: str = kwargs.pop( 'region_dim', 'time' )
+        region_chunks: int = kwargs.pop( 'region_chunks', 1 )
+        encoding = kwargs.pop( 'encoding', None )
+        for unused in [ 'max_memory', 'temp_dir', 'clear_cache' ]: kwargs.pop( unused, None )
+        chunks = self.get_chunks( chunk_sizes )
+        target_store = self.open_target_store( target_store )
+        manifest = RechunkManifest.load( target_store )
+        if (manifest is not None) and not manifest.compatible( chunks, region_dim ):
+            raise Exception( f"Existing target store was written with different chunks ({manifest.chunks}), rerun with resume=False to overwrite it" )
+        if manifest is None:
+            print( f"Initializing target store {target_store} with chunks = {chunks}" )
+            if len( listdir( target_store ) ): target_store.clear()
+            self._write_template( target_store, chunks, region_dim, encoding )
+            manifest = RechunkManifest( target_store, chunks, region_dim )
+            manifest.save()
+        else:
+            print( f"Resuming rechunk into {target_store}, completed regions: { {v: len(r) for v,r in manifest.completed.items()} }" )
+        for (vname, vchunks) in chunks.items():
+            vdata: xr.DataArray = self.dset[vname]
+            if region_dim not in vdata.dims: continue
+            rsize = vchunks[region_dim] * region_chunks
+            stored = set( listdir( target_store, vname ) )
+            for r0 in range( 0, vdata.sizes[region_dim], rsize ):
+                region = slice( r0, min( r0 + rsize, vdata.sizes[region_dim] ) )
+                if manifest.is_complete( vname, r0 ) and self._region_stored( stored, vdata, vchunks, region_dim, region ): continue
+                t1 = time.time()
+                rdata = self.dset[[vname]].isel( { region_dim: region } ).chunk( vchunks )
+                rdata = rdata.drop_vars( [ c for c in rdata.coords if region_dim not in rdata[c].dims ] )
+                for v in rdata.variables.values(): v.encoding = {}
+                rdata.to_zarr( target_store, region={ region_dim: region }, write_empty_chunks=True, **kwargs )
+                manifest.mark_complete( vname, r0 )
+                print( f" -> {vname}[{region_dim}={region.start}:{region.stop}] written in {time.time()-t1:.1f} sec" )
+        print( f"Rechunking completed in {(time.time()-t0)/60.0} min." )
+        return target_store
+
+    def append_rechunk( self, chunk_sizes: Union[Dict[str,int],ChunkPlan], **kwargs ):
+        """Rechunks only the source time steps beyond the end of an existing target store and appends them along time.
+           Array metadata is written unconsolidated and .zmetadata is replaced in a single put at the end, so readers
+           opening the store with consolidated metadata never see a partially extended store.
+           Raises if there is no target store, or if it does not match the source and chunk_sizes; run rechunk without append to (re)create it."""
+        import zarr
+        t0 = time.time()
+        target_path = kwargs.get( 'target_store',  f"{self.data_dir}/{self.name}" )
+        target_store = self.open_target_store( target_path )
+        if ( ".zgroup" not in target_store ) and ( ".zarray" not in target_store ):
+            raise Exception( f"No existing target store at {target_path}, run rechunk without append=True to create it" )
+        chunks = self.get_chunks( chunk_sizes )
+        target: xr.Dataset = xr.open_zarr( target_store, consolidated=( ".zmetadata" in target_store ) )
+        self._check_append_target( target, chunks, target_path )
+        src_times, nt0 = self.dset['time'].values, target.sizes['time']
+        i0 = int( np.searchsorted( src_times, target['time'].values[-1], side='right' ) )
+        if ( i0 == 0 ) or ( src_times[i0-1] != target['time'].values[-1] ):
+            raise Exception( f"Last time step of target store {target_path} ({target['time'].values[-1]}) is not a source time step" )
+        if i0 >= src_times.size:
+            print( f"Target store is up to date ({nt0} time steps)" )
+            return target_store
+        new_data: xr.Dataset = self.dset.isel( time=slice( i0, None ) )
+        new_data = new_data.drop_vars( [ v for v in new_data.variables if 'time' not in new_data[v].dims ] )
+        print( f"Appending {new_data.sizes['time']} time steps ({src_times[i0]} -> {src_times[-1]}) to {target_path}" )
+        for (vname, v) in new_data.variables.items():
+            v.encoding = {}
+            if vname in chunks:
+                vchunks = dict( chunks[vname] )
+                vchunks['time'] = self._append_chunks( nt0, new_data.sizes['time'], target[vname].encoding['chunks'][ target[vname].dims.index('time') ] )
+                new_data[vname] = new_data[vname].chunk( vchunks )
+        new_data.to_zarr( target_store, append_dim='time', consolidated=False )
+        zarr.consolidate_metadata( target_store )
+        print( f"Append completed in {(time.time()-t0)/60.0} min." )
+        return target_store
+
+    def _check_append_target( self, target: xr.Dataset, chunks: Dict[str,Dict[str,int]], target_path: str ):
+        """Raises unless every time-dependent source variable is in the target with the same dims, non-time sizes and non-time chunks."""
+        if 'time' not in target.dims:
+            raise Exception( f"Target store {target_path} has no time dimension to append along" )
+        for (vname, v) in self.dset.data_vars.items():
+            if 'time' not in v.dims: continue
+            if vname not in target.data_vars:
+                raise Exception( f"Variable {vname} is missing from target store {target_path}" )
+            tv: xr.DataArray = target[vname]
+            if tv.dims != v.dims:
+                raise Exception( f"Variable {vname} has dims {tv.dims} in target store {target_path}, expected {v.dims}" )
+            for (d, tchunk) in zip( tv.dims, tv.encoding['chunks'] ):
+                if d == 'time': continue
+                if tv.sizes[d] != v.sizes[d]:
+                    raise Exception( f"Variable {vname} has {d} size {tv.sizes[d]} in target store {target_path}, expected {v.sizes[d]}" )
+                if tchunk != chunks[vname][d]:
+                    raise Exception( f"Variable {vname} has {d} chunks {tchunk} in target store {target_path}, expected {chunks[vname][d]}" )
+
+    @staticmethod
+    def _append_chunks( nt0: int, nt: int, ct: int ) -> Tuple[int,...]:
+        """Dask chunks for appended time steps, aligned with the zarr chunks of the existing store (first fills any partial chunk)."""
+        head = min( ( ct - nt0 % ct ) % ct, nt )
+        body = [ ct ] * ( ( nt - head ) // ct )
+        tail = ( nt - head ) % ct
+        return tuple( c for c in [ head ] + body + [ tail ] if c > 0 )
+
+    def open_target_store( self, target_store: Union[str,MutableMapping] ) -> MutableMapping:
+        from eis.s3 import s3m
+        if isinstance( target_store, str ):
+            if target_store.startswith("s3:"): return s3m().get_store( f"{target_store}.zarr", "a", batched=True )
+            else:                              return DirectoryStore( f"{target_store}.zarr" )
+        return target_store
+
+    def _write_template( self, target_store: MutableMapping, chunks: Dict[str,Dict[str,int]], region_dim: str, encodings = None ):
+        (template, profiles) = self.encoded_source( encodings )
+        encoding = {}
+        for (vname, v) in template.variables.items():
+            v.encoding = { k: v.encoding[k] for k in [ 'dtype', '_FillValue', 'scale_factor', 'add_offset', 'units', 'calendar' ] if k in v.encoding }
+            if vname in chunks:
+                encoding[vname] = dict( chunks = tuple( chunks[vname][d] for d in v.dims ) )
+                if vname in profiles: encoding[vname].update( profiles[vname].encoding( template[vname] ) )
+                if region_dim not in v.dims: template[vname] = template[vname].load()
+                else:                        template[vname] = template[vname].chunk( chunks[vname] )
+        template.to_zarr( target_store, mode='w', compute=False, consolidated=True, encoding=encoding )
+
+    @staticmethod
+    def _region_stored( stored: set, vdata: xr.DataArray, vchunks: Dict[str,int], region_dim: str, region: slice ) -> bool:
+        ranges = []
+        for d in vdata.dims:
+            nc = math.ceil( vdata.sizes[d] / vchunks[d] )
+            ranges.append( range( region.start // vchunks[d], math.ceil( region.stop / vchunks[d] ) ) if d == region_dim else range( nc ) )
+        return all( ".".join( map( str, idx ) ) in stored for idx in itertools.product( *ranges ) )
+
     def clear_cache(self, **kwargs ):
         print("Clearing Cache...")
         temp_dir = kwargs.pop('temp_dir', self.cache_dir)
@@ -1,22 +1,64 @@
 import fnmatch, s3fs
 from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapping, Hashable
-import glob, os
+import glob, os, time, random, asyncio
 from collections.abc import MutableMapping
+from fsspec.asyn import sync
+from zarr.storage import BaseStore
 from .base import EISSingleton
 
 def s3m(): return S3Manager.instance()
+def s3f(): return S3FileSystemFactory.instance()
 def has_char(string: str, chars: str): return 1 in [c in string for c in chars]
 
+class S3FileSystemFactory(EISSingleton):
+    """Single source of s3fs filesystems for the EIS package.  All filesystems share one tunable configuration
+       (connection pool size, concurrency, block size, read-ahead cache type, endpoint).  s3fs instances are cached per
+       process by their arguments and pickle by arguments, so a filesystem shipped to a dask worker reattaches to that
+       worker's warm session rather than opening a new one for every task."""
+
+    def __init__( self, **kwargs ):
+        EISSingleton.__init__( self, **kwargs )
+        self.config: Dict[str,Any] = dict( max_pool_connections=64, max_concurrency=32, block_size=5*2**20, cache_type='readahead',
+                                           endpoint_url=os.environ.get( 'EIS_S3_ENDPOINT' ) )
+        self.configure( **kwargs )
+
+    def configure( self, **kwargs ):
+        for (key, value) in kwargs.items():
+            assert key in self.config, f"Unknown s3 filesystem parameter '{key}', must be one of {list(self.config.keys())}"
+            self.config[key] = value
+
+    def get_fs( self, anon: bool = False, acl: str = None, **kwargs ) -> s3fs.S3FileSystem:
+        cfg = dict( self.config, **{ k: kwargs.pop(k) for k in list(kwargs.keys()) if k in self.config } )
+        client_kwargs = dict( kwargs.pop( 'client_kwargs', {} ) )
+        if cfg['endpoint_url'] is not None: client_kwargs.setdefault( 'endpoint_url', cfg['endpoint_url'] )
+        s3_additional_kwargs = dict( kwargs.pop( 's3_additional_kwargs', {} ) )
+        if acl is not None: s3_additional_kwargs['ACL'] = acl
+        fs = s3fs.S3FileSystem( anon=anon, client_kwargs=client_kwargs, s3_additional_kwargs=s3_additional_kwargs,
+                                config_kwargs=dict( max_pool_connections=cfg['max_pool_connections'] ), max_concurrency=cfg['max_concurrency'],
+                                default_block_size=cfg['block_size'], default_cache_type=cfg['cache_type'], **kwargs )
+        fs.batch_size = cfg['max_concurrency']     # fsspec bulk-operation concurrency (not an S3FileSystem argument)
+        return fs
+
+    def configure_workers( self, client ):
+        """Applies this process's filesystem configuration to the factory on every current and future dask worker."""
+        from distributed.diagnostics.plugin import WorkerPlugin
+        config = dict( self.config )
+        class S3ConfigPlugin(WorkerPlugin):
+            name = "eis-s3-config"
+            def setup( self, worker ): s3f().configure( **config )
+        client.register_plugin( S3ConfigPlugin() )
+
 class S3Manager(EISSingleton):
 
     def __init__( self, **kwargs ):
         EISSingleton.__init__( self, **kwargs )
         self._fs: s3fs.S3FileSystem = None
+        if 'endpoint_url' in kwargs: s3f().configure( endpoint_url=kwargs['endpoint_url'] )
 
     @property
     def fs(self) -> s3fs.S3FileSystem:
         if self._fs is None:
-            self._fs = s3fs.S3FileSystem( anon=False, s3_additional_kwargs=dict( ACL="bucket-owner-full-control" ) )
+            self._fs = s3f().get_fs( anon=False, acl="bucket-owner-full-control" )
         return self._fs
 
     def item_key(self, path: str) -> str:
@@ -26,12 +68,115 @@ class S3Manager(EISSingleton):
         ptoks = urlpath.split(":")[-1].strip("/").split("/")
         return ( ptoks[0], "/".join( ptoks[1:] ) )
 
-    def get_store(self, path: str, mode: str ) -> MutableMapping:
+    def get_store(self, path: str, mode: str, **kwargs ) -> MutableMapping:
         create: bool = (mode == "w")
-        mapper = self.fs.get_mapper( path, create=create )
-        if create: mapper.clear()
-        return mapper
+        if kwargs.pop( 'batched', False ):
+            store = S3ChunkStore( self.fs, path, **kwargs )
+        else:
+            store = self.fs.get_mapper( path, create=create )
+        if create: store.clear()
+        return store
+
+    def upload_store(self, local_path: str, s3_path: str, **kwargs ) -> "S3ChunkStore":
+        """Uploads a local (directory) zarr store to s3 through an S3ChunkStore, replacing `aws s3 mv --recursive`."""
+        batch_size = kwargs.pop( 'batch_size', 256 )
+        store = S3ChunkStore( self.fs, s3_path, **kwargs )
+        local_path = local_path.rstrip("/")
+        batch: Dict[str,bytes] = {}
+        for (root, dirs, files) in os.walk( local_path ):
+            for fname in files:
+                fpath = os.path.join( root, fname )
+                with open( fpath, 'rb' ) as f:
+                    batch[ os.path.relpath( fpath, local_path ) ] = f.read()
+                if len( batch ) >= batch_size:
+                    store.setitems( batch )
+                    batch = {}
+        if len( batch ): store.setitems( batch )
+        print( store.report() )
+        return store
+
+class S3ChunkStore(BaseStore):
+    """Zarr store writing straight to s3 with bounded-concurrency async PUTs, retry/backoff and throughput counters.
+       Objects inherit the filesystem's s3_additional_kwargs (ACL=bucket-owner-full-control for S3Manager.fs).
+       As a zarr BaseStore (not wrapped in a KVStore), zarr hands it all the chunks of each array write in one setitems call."""
+
+    def __init__( self, fs: s3fs.S3FileSystem, path: str, **kwargs ):
+        self.fs = fs
+        self.root: str = path.split("://")[-1].rstrip("/")
+        self.max_concurrency: int = kwargs.get( 'max_concurrency', s3f().config['max_concurrency'] )
+        self.max_retries: int = kwargs.get( 'max_retries', 5 )
+        self.backoff: float = kwargs.get( 'backoff', 0.2 )
+        self.nbytes_written = 0
+        self.write_time = 0.0
+
+    def _key_path( self, key: str ) -> str:
+        return f"{self.root}/{key}"
+
+    async def _put( self, key: str, data: bytes, semaphore: asyncio.Semaphore ):
+        async with semaphore:
+            for attempt in range( self.max_retries + 1 ):
+                try:
+                    await self.fs._pipe_file( self._key_path( key ), data )
+                    return
+                except Exception:
+                    if attempt == self.max_retries: raise
+                    await asyncio.sleep( self.backoff * ( 2 ** attempt ) * ( 1 + random.random() ) )
 
+    async def _put_all( self, values: Dict[str,bytes] ):
+        semaphore = asyncio.Semaphore( self.max_concurrency )
+        await asyncio.gather( *[ self._put( key, data, semaphore ) for key, data in values.items() ] )
 
+    def setitems( self, values: Mapping[str,Any] ):
+        values = { key: bytes( data ) for key, data in values.items() }
+        t0 = time.time()
+        sync( self.fs.loop, self._put_all, values )
+        from .cluster import cim
+        nbytes = sum( len(data) for data in values.values() )
+        self.write_time += time.time() - t0
+        self.nbytes_written += nbytes
+        cim().count( 's3.bytes_written', nbytes )
+        cim().add( 's3.put_batch_time', time.time() - t0 )
+
+    def __setitem__( self, key: str, value ):
+        self.setitems( { key: value } )
+
+    def __getitem__( self, key: str ) -> bytes:
+        try:                        return self.fs.cat( self._key_path( key ) )
+        except FileNotFoundError:   raise KeyError( key )
+
+    def __delitem__( self, key: str ):
+        try:                        self.fs.rm( self._key_path( key ) )
+        except FileNotFoundError:   raise KeyError( key )
+
+    def delitems( self, keys ):
+        paths = [ self._key_path( key ) for key in keys ]
+        if len( paths ): self.fs.rm( paths )
+
+    def __contains__( self, key ) -> bool:
+        return self.fs.exists( self._key_path( key ) )
+
+    def __iter__(self):
+        for path in self.fs.find( self.root ):
+            yield path[ len(self.root)+1: ]
+
+    def __len__(self) -> int:
+        return len( self.fs.find( self.root ) )
+
+    def clear(self):
+        if self.fs.exists( self.root ): self.fs.rm( self.root, recursive=True )
+        self.fs.invalidate_cache( self.root )
+
+    def listdir( self, path: str = "" ) -> List[str]:
+        try:                        return [ p.split("/")[-1] for p in self.fs.ls( self._key_path( path ).rstrip("/"), detail=False ) ]
+        except FileNotFoundError:   return []
+
+    @property
+    def throughput(self) -> float:
+        """Measured write throughput in MB/s."""
+        return self.nbytes_written / 1.0e6 / max( self.write_time, 1.0e-9 )
 
+    def report(self) -> str:
+        return f"Wrote {self.nbytes_written/1.0e6:.1f} MB to s3://{self.root} in {self.write_time:.1f} sec: {self.throughput:.1f} MB/s"
 
+    def __repr__(self):
+        return f"S3ChunkStore(s3://{self.root})"
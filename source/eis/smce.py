@@ -5,17 +5,23 @@ from typing import List, Union, Dict, Callable, Tuple, Optional, Any, Type, Mapp
 import pandas as pd
 import xarray as xr
 from .base import EISSingleton
+from .cache import ChunkCache
+from .s3 import s3f
+from .logs import RateLimitFilter, JsonFormatter, BatchingFileHandler, WorkerEventHandler, current_worker, queued_handler, forward_worker_logs
 
 class EIS3(EISSingleton):
 
     def __init__( self, **kwargs ):
         EISSingleton.__init__( self, **kwargs )
         anon = kwargs.pop( 'anon', False )
-        self.s3 = s3fs.S3FileSystem( anon=anon, **kwargs )
+        self.log_format: str = kwargs.pop( 'log_format', os.environ.get( 'EIS_LOG_FORMAT', 'text' ) )
+        self.log_rate: Tuple[int,float] = kwargs.pop( 'log_rate', ( 10, 60.0 ) )
+        self.s3: s3fs.S3FileSystem = s3f().get_fs( anon=anon, **kwargs )
         self.eis_dir = os.path.expanduser( "~/.eis_smce" )
         self.cache_dir = self.eis_subdir(  "cache" )
         self.log_dir =   self.eis_subdir(  "logging" )
         self.data_dir =  self.eis_subdir(   "data" )
+        self.chunk_caches: Dict[str,ChunkCache] = {}
 
     def eis_subdir(self, name: str ):
         subdir = os.path.join( self.eis_dir, name )
@@ -23,7 +29,16 @@ class EIS3(EISSingleton):
         return subdir
 
     def get_zarr_dataset(self, bucket: str, key: str, **kwargs ) -> xr.Dataset:
-        return xr.open_zarr( self.s3.get_mapper(f'{bucket}/{key}.zarr' ),  **kwargs )
+        cache = kwargs.pop( 'cache', True )
+        cache_args = { k: kwargs.pop(k) for k in [ 'max_size_gb', 'ttl' ] if k in kwargs }
+        store = self.get_cached_store( f'{bucket}/{key}.zarr', **cache_args ) if cache else self.s3.get_mapper( f'{bucket}/{key}.zarr' )
+        return xr.open_zarr( store,  **kwargs )
+
+    def get_cached_store(self, path: str, **kwargs ) -> ChunkCache:
+        """One ChunkCache per store path, shared by every dataset opened on it in this process."""
+        if path not in self.chunk_caches:
+            self.chunk_caches[path] = ChunkCache( self.s3, path, self.cache_dir, **kwargs )
+        return self.chunk_caches[path]
 
     @classmethod
     def hostname(cls):
@@ -37,30 +52,47 @@ class EIS3(EISSingleton):
     def item_path( path: str) -> str:
         return path.split(":")[-1].replace("//", "/").replace("//", "/")
 
+    def log_formatter(self) -> logging.Formatter:
+        if self.log_format == 'json': return JsonFormatter()
+        return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
     def get_logger(self):
+        """Per-process logger.  Records are only enqueued by the caller; a background listener formats them and writes
+           batches, so logging never blocks compute threads on (EFS) file I/O.  Repetitive DEBUG/INFO messages from the same
+           call site are rate limited (log_rate = (count, seconds)).  Inside a dask task the records are shipped to the
+           scheduler as events (see forward_worker_logs) instead of being written to a log file per worker process."""
         _logger = logging.getLogger(f'eis.smce.{self.hostname()}.{self.pid()}')
         _root_logger = logging.getLogger()
         if len( _logger.handlers ) == 0:
             _logger.setLevel(logging.DEBUG)
-            log_file = f'{self.log_dir}/eis.smce.{self.hostname()}.{self.pid()}.log'
-            root_log_file = f'{self.log_dir}/root.{self.hostname()}.{self.pid()}.log'
-            print( f" ***   Opening Log file: {log_file}  *** ")
-            os.makedirs( os.path.dirname(log_file), exist_ok=True )
-            fh = logging.FileHandler( log_file )
-            fh.setLevel(logging.DEBUG)
+            formatter = self.log_formatter()
             ch = logging.StreamHandler()
             ch.setLevel(logging.ERROR)
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            fh.setFormatter(formatter)
             ch.setFormatter(formatter)
-            _logger.addHandler(fh)
-            _logger.addHandler(ch)
-            rfh = logging.FileHandler(root_log_file)
-            rfh.setLevel(logging.INFO)
-            rfh.setFormatter(formatter)
-            _root_logger.addHandler(rfh)
+            worker = current_worker()
+            if worker is not None:
+                fh = WorkerEventHandler( worker )
+            else:
+                log_file = f'{self.log_dir}/eis.smce.{self.hostname()}.{self.pid()}.log'
+                root_log_file = f'{self.log_dir}/root.{self.hostname()}.{self.pid()}.log'
+                print( f" ***   Opening Log file: {log_file}  *** ")
+                os.makedirs( os.path.dirname(log_file), exist_ok=True )
+                fh = BatchingFileHandler( log_file )
+                rfh = BatchingFileHandler(root_log_file)
+                rfh.setLevel(logging.INFO)
+                rfh.setFormatter(formatter)
+                _root_logger.addHandler( queued_handler( [rfh] ) )
+            fh.setLevel(logging.DEBUG)
+            fh.setFormatter(formatter)
+            _logger.addFilter( RateLimitFilter( *self.log_rate ) )
+            _logger.addHandler( queued_handler( [ fh, ch ] ) )
         return _logger
 
+    def forward_worker_logs(self, client ):
+        """Collects the log records of all dask workers into a single file on this host."""
+        log_file = f'{self.log_dir}/eis.smce.workers.{self.hostname()}.{self.pid()}.log'
+        return forward_worker_logs( client, log_file )
+
     def exception(self, msg: str ):
         self.get_logger().error( f"\n{msg}\n{traceback.format_exc()}\n" )
 
@@ -0,0 +1,50 @@
+import pytest
+from eis.s3 import s3f
+
+@pytest.fixture( scope="session" )
+def s3fs_moto():
+    """An s3fs filesystem (bucket 'eis-test') served by a local moto server."""
+    moto_server = pytest.importorskip( "moto.server" )
+    boto3 = pytest.importorskip( "boto3" )
+    server = moto_server.ThreadedMotoServer( port=0 )
+    server.start()
+    (host, port) = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+    boto3.client( "s3", endpoint_url=endpoint_url, region_name="us-east-1", aws_access_key_id="testing", aws_secret_access_key="testing" ).create_bucket( Bucket="eis-test" )
+    yield s3f().get_fs( key="testing", secret="testing", client_kwargs=dict( endpoint_url=endpoint_url, region_name="us-east-1" ), skip_instance_cache=True )
+    server.stop()
+
+GAGES = [ ( '07344370', -94.5, 30.2 ), ( '07289000', -94.3, 30.4 ), ( '08012000', -94.8, 30.1 ) ]    # header order != sorted file order
+
+def lis_routing_dataset( nt: int = 60 ) -> "xa.Dataset":
+    """A small LIS routing-output-like dataset: (time, north_south, east_west) on a 0.1 degree grid at (-95, 30)."""
+    import numpy as np, pandas as pd, xarray as xa
+    (ny, nx) = ( 6, 8 )
+    values = np.random.default_rng(0).random( ( nt, ny, nx ), dtype=np.float32 ) + 1.0
+    lon, lat = np.meshgrid( -95.0 + 0.1 * np.arange( nx ), 30.0 + 0.1 * np.arange( ny ) )
+    dset = xa.Dataset( dict( Streamflow_tavg=( ('time','north_south','east_west'), values ),
+                             lat=( ('north_south','east_west'), lat ), lon=( ('north_south','east_west'), lon ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ) ),
+                       attrs=dict( DX=0.1, DY=0.1, SOUTH_WEST_CORNER_LAT=30.0, SOUTH_WEST_CORNER_LON=-95.0 ) )
+    return dset.chunk( dict( time=10 ) )
+
+@pytest.fixture
+def routing_data():
+    from eis.lis.data.routing import LISRoutingData
+    return LISRoutingData( lis_routing_dataset() )
+
+@pytest.fixture
+def gage_dir( tmp_path ):
+    """(header file, gage directory, {id: observed series}) for GAGES; gage records cover days 5..54 of the routing record."""
+    import numpy as np, pandas as pd
+    directory = tmp_path / "gages"
+    directory.mkdir()
+    header = directory / "header.txt"
+    header.write_text( "".join( f"{gid} site {i} {lon} {lat}\n" for i, ( gid, lon, lat ) in enumerate( GAGES ) ) )
+    series = {}
+    for i, ( gid, lon, lat ) in enumerate( GAGES ):
+        dates = pd.date_range( "2010-01-06", periods=50 )
+        values = 100.0 * ( i + 1 ) + np.arange( 50, dtype=np.float64 )
+        ( directory / f"{gid}.txt" ).write_text( "".join( f"{d:%Y%m%d} {v}\n" for d, v in zip( dates, values ) ) )
+        series[gid] = pd.Series( values, index=dates )
+    return str( header ), str( directory ), series
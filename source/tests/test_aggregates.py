@@ -0,0 +1,22 @@
+import os, numpy as np, pandas as pd
+import xarray as xa
+from eis.lis.data.aggregates import LISAggregates
+
+def routing_dataset( nt: int ) -> xa.Dataset:
+    values = np.random.default_rng(0).random( ( 800, 4, 5 ), dtype=np.float32 )[:nt]
+    return xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), values ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ), lat=np.arange(4) * 0.1, lon=np.arange(5) * 0.1 ) ).chunk( dict( time=100 ) )
+
+def test_climatology_is_updated_in_place( tmp_path ):
+    path = str( tmp_path / "routing.aggregates" )
+    LISAggregates( routing_dataset( 400 ), path )._update_climatology()
+    sentinel = os.path.join( path, "climatology", "sentinel" )
+    open( sentinel, "w" ).close()
+
+    aggregates = LISAggregates( routing_dataset( 800 ), path )
+    aggregates._update_climatology()
+    assert os.path.isfile( sentinel )                                     # the store was not deleted and recreated
+    full = routing_dataset( 800 )['Streamflow_tavg']
+    expected = full.groupby( 'time.month' ).sum() / full.notnull().groupby( 'time.month' ).sum()
+    np.testing.assert_allclose( aggregates.climatology( 'Streamflow_tavg' ).values, expected.values, rtol=1e-5 )
+    assert aggregates.group( 'climatology' ).attrs['last_time'] == str( full.time.values[-1] )
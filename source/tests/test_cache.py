@@ -0,0 +1,44 @@
+from eis.cache import ChunkCache
+
+def test_miss_is_a_single_get_and_hits_are_local( s3fs_moto, tmp_path, monkeypatch ):
+    s3fs_moto.pipe_file( "eis-test/cached.zarr/0.0", b"chunk-0" )
+    cache = ChunkCache( s3fs_moto, "s3://eis-test/cached.zarr", str( tmp_path ), ttl=3600.0 )
+    calls = []
+    call_s3 = s3fs_moto._call_s3
+    async def counted( method, *args, **kwargs ):
+        calls.append( method )
+        return await call_s3( method, *args, **kwargs )
+    monkeypatch.setattr( s3fs_moto, "_call_s3", counted )
+    assert cache["0.0"] == b"chunk-0"
+    assert calls == [ 'get_object' ]
+    assert cache["0.0"] == b"chunk-0"
+    assert calls == [ 'get_object' ]
+    assert ( cache.stats['hits'], cache.stats['misses'] ) == ( 1, 1 )
+
+def test_stale_entries_are_refetched( s3fs_moto, tmp_path ):
+    s3fs_moto.pipe_file( "eis-test/stale.zarr/0.0", b"old" )
+    cache = ChunkCache( s3fs_moto, "s3://eis-test/stale.zarr", str( tmp_path ), ttl=0.0 )
+    assert cache["0.0"] == b"old"
+    s3fs_moto.pipe_file( "eis-test/stale.zarr/0.0", b"new" )
+    assert cache["0.0"] == b"new"
+    assert cache.stats['validations'] == 1
+
+def test_metadata_is_always_revalidated( s3fs_moto, tmp_path ):
+    s3fs_moto.pipe_file( "eis-test/meta.zarr/Streamflow/.zattrs", b'{"v": 1}' )
+    cache = ChunkCache( s3fs_moto, "s3://eis-test/meta.zarr", str( tmp_path ), ttl=3600.0 )
+    assert cache["Streamflow/.zattrs"] == b'{"v": 1}'
+    assert cache["Streamflow/.zattrs"] == b'{"v": 1}'
+    s3fs_moto.pipe_file( "eis-test/meta.zarr/Streamflow/.zattrs", b'{"v": 2}' )
+    assert cache["Streamflow/.zattrs"] == b'{"v": 2}'
+    assert cache.stats['validations'] == 2
+
+def test_changed_zmetadata_invalidates_chunks( s3fs_moto, tmp_path ):
+    s3fs_moto.pipe_file( "eis-test/group.zarr/.zmetadata", b'{"nt": 10}' )
+    s3fs_moto.pipe_file( "eis-test/group.zarr/Streamflow/0.0", b"old" )
+    cache = ChunkCache( s3fs_moto, "s3://eis-test/group.zarr", str( tmp_path ), ttl=3600.0 )
+    assert ( cache[".zmetadata"], cache["Streamflow/0.0"] ) == ( b'{"nt": 10}', b"old" )
+    assert ( cache[".zmetadata"], cache["Streamflow/0.0"] ) == ( b'{"nt": 10}', b"old" )
+    s3fs_moto.pipe_file( "eis-test/group.zarr/Streamflow/0.0", b"new" )
+    s3fs_moto.pipe_file( "eis-test/group.zarr/.zmetadata", b'{"nt": 20}' )
+    assert ( cache[".zmetadata"], cache["Streamflow/0.0"] ) == ( b'{"nt": 20}', b"new" )
+    assert cache.stats['misses'] == 4
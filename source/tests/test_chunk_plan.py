@@ -0,0 +1,30 @@
+import numpy as np
+import xarray as xa
+import dask.array as da
+from eis.chunk_plan import ChunkPlanner
+
+def lis_dataset() -> xa.Dataset:
+    """A lazy ten-year daily LIS-like variable, chunked time=1 as LIS output stores are."""
+    values = da.zeros( ( 3650, 200, 300 ), dtype=np.float32, chunks=( 1, 200, 300 ) )
+    return xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), values ) ) )
+
+def test_planner_picks_cheaper_layout_per_access_pattern():
+    planner = ChunkPlanner( lis_dataset() )
+    (ts_plan, map_plan) = ( planner.plan( 'timeseries' ), planner.plan( 'map' ) )
+    assert ts_plan.chunks['Streamflow_tavg']['time'] == 3650
+    assert map_plan.chunks['Streamflow_tavg'] == dict( time=map_plan.chunks['Streamflow_tavg']['time'], lat=200, lon=300 )
+    (ts, mp) = ( ts_plan.report.loc['Streamflow_tavg'], map_plan.report.loc['Streamflow_tavg'] )
+    assert ( ts['timeseries_objects'], mp['map_objects'] ) == ( 1, 1 )
+    assert ts['timeseries_sec'] < mp['timeseries_sec']
+    assert mp['map_sec'] < ts['map_sec']
+    mixed = planner.plan( dict( timeseries=1, map=1 ) ).report.loc['Streamflow_tavg']
+    assert mixed['timeseries_sec'] + mixed['map_sec'] < min( ts['timeseries_sec'] + ts['map_sec'], mp['timeseries_sec'] + mp['map_sec'] )
+
+def test_planner_respects_memory_cap():
+    dset = lis_dataset()
+    for max_chunk_mb in [ 1, 4, 16 ]:
+        plan = ChunkPlanner( dset, min_chunk_mb=0, max_chunk_mb=max_chunk_mb ).plan( 'timeseries' )
+        chunk_bytes = 4 * np.prod( list( plan.chunks['Streamflow_tavg'].values() ) )
+        assert chunk_bytes <= max_chunk_mb * 1.0e6
+        assert plan.max_memory * 1.0e6 >= 2 * chunk_bytes
+    assert ChunkPlanner( dset ).plan( 'map', max_memory=500 ).max_memory == 500
@@ -0,0 +1,37 @@
+import pytest
+from eis.cluster import ClusterPolicy, DaskClusterManager
+
+def test_policy_kwargs_per_job_type():
+    policies = { job_type: ClusterPolicy( job_type, cores=16, memory=64e9, memory_fraction=0.75 ) for job_type in ClusterPolicy.JOB_TYPES }
+    assert policies['io'].cluster_kwargs() == dict( n_workers=4, threads_per_worker=8, memory_limit=int( 12e9 ), processes=True )
+    assert policies['cpu'].cluster_kwargs() == dict( n_workers=16, threads_per_worker=1, memory_limit=int( 3e9 ), processes=True )
+    assert policies['mixed'].cluster_kwargs() == dict( n_workers=8, threads_per_worker=2, memory_limit=int( 6e9 ), processes=True )
+    assert ClusterPolicy( 'io', cores=2, memory=8e9 ).cluster_kwargs()['n_workers'] == 1
+    assert policies['cpu'].adapt_bounds() == ( 1, 16 )
+    with pytest.raises( AssertionError ):
+        ClusterPolicy( 'gpu' )
+
+@pytest.fixture
+def manager():
+    manager = DaskClusterManager()
+    yield manager
+    manager.shutdown()
+
+def test_init_cluster_reuses_matching_cluster( manager ):
+    spec = dict( n_workers=1, threads_per_worker=1, processes=False, dashboard_address=None )
+    client = manager.init_cluster( **spec )
+    assert manager.healthy
+    assert manager.init_cluster( **spec ) is client
+    restarted = manager.init_cluster( restart=True, **spec )
+    assert ( restarted is not client ) and ( client.status == 'closed' )
+    changed = manager.init_cluster( **dict( spec, threads_per_worker=2 ) )
+    assert ( changed is not restarted ) and ( restarted.status == 'closed' )
+    assert manager.init_cluster( **dict( spec, threads_per_worker=2 ) ) is changed
+
+def test_init_cluster_applies_job_type_policy( manager ):
+    client = manager.init_cluster( job_type='io', n_workers=1, processes=False, dashboard_address=None )
+    expected = ClusterPolicy( 'io' )
+    assert manager._cluster_spec == dict( expected.cluster_kwargs(), n_workers=1, processes=False, dashboard_address=None, adaptive=True,
+                                          minimum=1, maximum=expected.adapt_bounds()[1] )
+    client.wait_for_workers( 1, timeout=10 )
+    assert [ w['nthreads'] for w in client.scheduler_info()['workers'].values() ] == [ 8 ]
@@ -0,0 +1,55 @@
+import os, numpy as np
+import xarray as xa
+import pytest
+from eis.lis.data.gage import LISGageDataset
+from eis.lis.data.combined import LISCombinedDataset
+
+VNAME = 'Streamflow_tavg'
+
+@pytest.fixture
+def combined( routing_data, gage_dir ):
+    (header, directory, observed) = gage_dir
+    files = sorted( os.path.join( directory, f ) for f in os.listdir( directory ) if f != "header.txt" )   # file order != header order
+    return LISCombinedDataset( LISGageDataset( header, files, cache=False ), routing_data, cache_size=2 )
+
+def count_reads( combined: LISCombinedDataset, monkeypatch ) -> list:
+    reads = []
+    var_data = combined.routing_data.var_data
+    monkeypatch.setattr( combined.routing_data, "var_data", lambda *args, **kwargs: ( reads.append( args ), var_data( *args, **kwargs ) )[1] )
+    return reads
+
+def test_aligned_data_lru( combined, monkeypatch ):
+    combined.invalidate()
+    reads = count_reads( combined, monkeypatch )
+    first = combined.get_aligned_data( 0, VNAME )
+    assert combined.get_aligned_data( 0, VNAME )[0] is first[0]
+    assert len( reads ) == 1
+    combined.get_aligned_data( 1, VNAME )
+    combined.get_aligned_data( 2, VNAME )
+    assert list( combined._aligned_cache.keys() ) == [ ( 1, VNAME ), ( 2, VNAME ) ]
+    combined.get_aligned_data( 0, VNAME )
+    assert len( reads ) == 4
+
+def test_graphs_share_one_entry( combined, monkeypatch ):
+    hv = pytest.importorskip( "holoviews" )
+    pytest.importorskip( "holoviews.plotting.bokeh" )
+    combined.invalidate()
+    reads = count_reads( combined, monkeypatch )
+    assert isinstance( combined.routing_data_graph( [1], VNAME ), hv.Curve )
+    assert isinstance( combined.gage_data_graph( [1], VNAME ), hv.Curve )
+    assert len( reads ) == 1
+    assert list( combined._aligned_cache.keys() ) == [ ( 1, VNAME ) ]
+
+def test_precompute_matches_aligned_data( combined, gage_dir ):
+    observed = gage_dir[2]
+    combined.precompute( [ VNAME ] )
+    assert len( combined._precomputed ) == 3
+    for gage_index in range( 3 ):
+        (rdirect, gdirect) = xa.align( combined.get_routing_data( gage_index, VNAME ), combined.get_gage_data( gage_index ) )
+        (rdata, gdata) = combined.get_aligned_data( gage_index, VNAME )
+        gid = combined.gage_data.header_id( gage_index )
+        assert gdata.name == gdirect.name == gid
+        np.testing.assert_array_equal( gdata['time'].values, gdirect['time'].values )
+        np.testing.assert_allclose( gdata.values, observed[gid].values )
+        np.testing.assert_allclose( gdata.values, gdirect.values )
+        np.testing.assert_allclose( rdata.values, rdirect.values )
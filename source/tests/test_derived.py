@@ -0,0 +1,42 @@
+import numpy as np
+import xarray as xa
+import dask.array as da
+from eis.lis.data.derived import DerivedVariableRegistry
+
+def source_dataset() -> xa.Dataset:
+    values = np.random.default_rng(0).random( ( 10, 4, 5 ) )
+    return xa.Dataset( dict( a=( ('time','lat','lon'), values ) ) ).chunk( dict( time=2 ) )
+
+def test_chunks_are_memoized_and_graph_is_reused():
+    reads = []
+    def counted( block ):
+        reads.append( block.shape )
+        return block
+    dset = source_dataset()
+    source = dset['a'].copy( data=da.map_blocks( counted, dset['a'].data, dtype=float, meta=np.array( (), dtype=float ) ) )
+    registry = DerivedVariableRegistry( cache_mb=10 )
+    registry.register( 'b', lambda a: a * 2, ['a'] )
+    variable = registry.get( 'b', lambda n: source )
+    assert registry.get( 'b', lambda n: source ) is variable
+    np.testing.assert_allclose( variable.values, dset['a'].values * 2 )
+    assert ( len( reads ), registry.cache.misses ) == ( 5, 5 )
+    np.testing.assert_allclose( variable.isel( time=slice( 0, 4 ) ).values, dset['a'].values[:4] * 2 )
+    assert ( len( reads ), registry.cache.hits ) == ( 5, 2 )
+
+def test_redefinition_invalidates():
+    dset = source_dataset()
+    registry = DerivedVariableRegistry( cache_mb=10 )
+    registry.register( 'b', lambda a: a * 2, ['a'] )
+    registry.get( 'b', dset.__getitem__ ).values
+    registry.register( 'b', lambda a: a * 3, ['a'] )
+    assert registry.cache.nbytes == 0
+    np.testing.assert_allclose( registry.get( 'b', dset.__getitem__ ).values, dset['a'].values * 3 )
+
+def test_distributed_compute():
+    from distributed import Client, LocalCluster
+    dset = source_dataset()
+    registry = DerivedVariableRegistry( cache_mb=10 )
+    registry.register( 'b', lambda a: a * 2, ['a'] )
+    with LocalCluster( n_workers=1, processes=False, dashboard_address=None ) as cluster, Client( cluster ):
+        for _ in range( 2 ):
+            np.testing.assert_allclose( registry.get( 'b', dset.__getitem__ ).values, dset['a'].values * 2 )
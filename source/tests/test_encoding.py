@@ -0,0 +1,49 @@
+import numpy as np, pandas as pd
+import xarray as xa
+import pytest
+from eis.encoding import EncodingProfile, ENCODING_PROFILES
+from eis.rechunk import Rechunker
+
+LOSSY = dict( bits7=EncodingProfile( 'zstd', keepbits=7 ), bits12=EncodingProfile( 'zstd', keepbits=12, shuffle='bitshuffle' ),
+              digits2=EncodingProfile( 'zstd', digits=2 ), digits4=EncodingProfile( 'lz4', digits=4 ) )
+
+def error_bound( profile: EncodingProfile, values: np.ndarray ) -> np.ndarray:
+    """Declared precision: relative 2**-keepbits for bit-rounding, absolute 10**-digits for quantization."""
+    if profile.keepbits is not None: return np.abs( values ) * 2.0 ** -profile.keepbits
+    return np.full( values.shape, 10.0 ** -profile.digits )
+
+def source_dataset() -> xa.Dataset:
+    (nt, nlat, nlon) = ( 20, 12, 16 )
+    rng = np.random.default_rng(0)
+    values = ( 1000.0 * rng.lognormal( size=( nt, nlat, nlon ) ) ).astype( np.float32 )
+    return xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), values ), SoilMoist_tavg=( ('time','lat','lon'), rng.random( ( nt, nlat, nlon ) ) ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ), lat=np.arange( nlat ) * 0.1, lon=np.arange( nlon ) * 0.1 ) ).chunk( dict( time=1 ) )
+
+@pytest.mark.parametrize( "name", list( LOSSY.keys() ) )
+def test_lossy_round_trip_within_declared_precision( tmp_path, name ):
+    profile = LOSSY[name]
+    source = source_dataset()
+    Rechunker( "source", source, data_dir=str( tmp_path ), cache_dir=str( tmp_path ) ).rechunk( dict( time=10, lat=12, lon=16 ), target_store=str( tmp_path / "target" ), encoding=profile )
+    result = xa.open_zarr( str( tmp_path / "target.zarr" ), consolidated=True )
+    for vname in source.data_vars:
+        (original, decoded) = ( source[vname].values.astype( np.float64 ), result[vname].values.astype( np.float64 ) )
+        assert result[vname].dtype == source[vname].dtype
+        assert result[vname].attrs['precision'] == profile.precision
+        assert np.all( np.abs( decoded - original ) <= error_bound( profile, original ) )
+        assert not np.array_equal( decoded, original )
+
+def test_benchmark_reports_one_row_per_profile( tmp_path ):
+    source = source_dataset()
+    rechunker = Rechunker( "source", source, data_dir=str( tmp_path ), cache_dir=str( tmp_path ) )
+    chunk_sizes = dict( time=10, lat=12, lon=16 )
+    report = rechunker.benchmark_encodings( chunk_sizes, nsamples=2 )
+    assert list( report.index ) == [ ( vname, name ) for vname in source.data_vars for name in ENCODING_PROFILES ]
+    assert ( report['max_error'] == 0 ).all() and ( report['ratio'] > 1 ).all()
+    report = rechunker.benchmark_encodings( chunk_sizes, dict( LOSSY, balanced='balanced' ), nsamples=2 )
+    assert list( report.index ) == [ ( vname, name ) for vname in source.data_vars for name in list( LOSSY ) + [ 'balanced' ] ]
+    for name, profile in LOSSY.items():
+        for vname in source.data_vars:
+            row = report.loc[ ( vname, name ) ]
+            assert 0 < row['max_error'] <= error_bound( profile, source[vname].values.astype( np.float64 ) ).max()
+            assert row['precision'] == profile.precision
+    assert ( report[ [ 'ratio', 'encode_MBps', 'decode_MBps' ] ] > 0 ).all().all()
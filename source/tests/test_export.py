@@ -0,0 +1,39 @@
+import numpy as np, pandas as pd
+import xarray as xa
+import pytest
+from eis.lis.data.export import lttb_indices, downsample, to_arrow, from_arrow, arrow_bytes, read_arrow
+
+def series( n: int = 1000 ) -> xa.DataArray:
+    values = np.sin( np.linspace( 0, 20, n ) ).astype( np.float32 )
+    values[n//3], values[2*n//3] = 25.0, -30.0
+    return xa.DataArray( values, dims=['time'], coords=dict( time=pd.date_range( "2010-01-01", periods=n ), site=3 ), name='Streamflow_tavg', attrs=dict( units='m3/s' ) )
+
+@pytest.mark.parametrize( "n_out", [ 3, 10, 100, 500 ] )
+def test_lttb_keeps_endpoints_and_extrema( n_out ):
+    data = series()
+    x = np.arange( data.size, dtype=np.float64 )
+    selected = lttb_indices( x, data.values.astype( np.float64 ), n_out )
+    assert selected.size == n_out
+    assert ( selected[0], selected[-1] ) == ( 0, data.size - 1 )
+    assert np.all( np.diff( selected ) > 0 )
+    if n_out >= 10: assert { 333, 666 } <= set( selected.tolist() )
+
+def test_downsample():
+    data = series()
+    data[100:110] = np.nan
+    reduced = downsample( data, 200 )
+    assert reduced.sizes['time'] == 200 and not reduced.isnull().any()
+    assert ( reduced['time'].values[0], reduced['time'].values[-1] ) == ( data['time'].values[0], data['time'].values[-1] )
+    assert ( float( reduced.max() ), float( reduced.min() ) ) == ( 25.0, -30.0 )
+    assert downsample( data, 1000 ) is data and downsample( data, None ) is data
+
+def test_arrow_round_trip():
+    data = series( 50 )
+    batch = to_arrow( data )
+    assert batch.schema.names == [ 'time', 'Streamflow_tavg' ] and batch.num_rows == 50
+    for result in [ from_arrow( batch ), read_arrow( arrow_bytes( data ) ) ]:
+        xa.testing.assert_identical( result, data )
+        assert result.dtype == np.float32
+    image = xa.DataArray( np.arange( 12, dtype=np.int16 ).reshape( 3, 4 ), dims=['lat','lon'], name='mask',
+                          coords=dict( lat=[ 30.0, 30.1, 30.2 ], lon=[ -95.0, -94.9, -94.8, -94.7 ], time=np.datetime64( "2010-01-01", 'ns' ) ) )
+    xa.testing.assert_identical( read_arrow( arrow_bytes( image ) ), image )
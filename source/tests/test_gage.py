@@ -0,0 +1,62 @@
+import os
+import pandas as pd
+import eis.lis.data.gage as gage
+from eis.lis.data.gage import LISGageDataset
+
+def count_parses( monkeypatch ) -> list:
+    parsed = []
+    parse_gage_file = gage.parse_gage_file
+    def counted( filepath: str ):
+        parsed.append( gage.gage_id( filepath ) )
+        return parse_gage_file( filepath )
+    monkeypatch.setattr( gage, "parse_gage_file", counted )
+    return parsed
+
+def test_parquet_cache_is_reused_until_a_file_changes( gage_dir, tmp_path, monkeypatch ):
+    (header, directory, series) = gage_dir
+    files = sorted( os.path.join( directory, f"{gid}.txt" ) for gid in series )
+    cache_file = str( tmp_path / "gages.parquet" )
+    parsed = count_parses( monkeypatch )
+
+    first = LISGageDataset( header, files, cache_file=cache_file )
+    assert sorted( parsed ) == sorted( series ) and os.path.isfile( cache_file )
+    parsed.clear()
+    second = LISGageDataset( header, files, cache_file=cache_file )
+    assert parsed == []
+    pd.testing.assert_frame_equal( second._gages, first._gages, check_freq=False )
+
+    changed = os.path.join( directory, "07289000.txt" )
+    with open( changed, "w" ) as f: f.write( "20100106 1.5\n20100107 2.5\n" )
+    os.utime( changed, ( os.path.getatime( changed ), os.path.getmtime( changed ) + 10 ) )
+    third = LISGageDataset( header, files, cache_file=cache_file )
+    assert parsed == [ "07289000" ]
+    assert third.xa_gage_data( 1 ).values.tolist() == [ 1.5, 2.5 ]
+    for gage_index in [ 0, 2 ]:
+        assert third.xa_gage_data( gage_index ).values.tolist() == series[ third.header_id( gage_index ) ].tolist()
+    parsed.clear()
+    LISGageDataset( header, files, cache_file=cache_file )
+    assert parsed == []
+
+def test_parallel_directory_ingestion_matches_serial( gage_dir ):
+    (header, directory, series) = gage_dir
+    parallel = LISGageDataset.from_directory( header, directory, workers=2, cache=False )
+    serial = LISGageDataset.from_directory( header, directory, workers=1, cache=False )
+    pd.testing.assert_frame_equal( parallel._gages, serial._gages )
+    assert parallel.header['id'].tolist() == [ gid for gid in series ]
+    for gage_index, gid in enumerate( series ):
+        assert parallel.xa_gage_data( gage_index ).values.tolist() == series[gid].tolist()
+    assert sorted( parallel.ingest_report.index ) == sorted( series )
+    assert ( parallel.ingest_report['records'] == 50 ).all() and ( parallel.ingest_report['parse_time'] >= 0 ).all()
+
+def test_directory_ingestion_validates_against_header( gage_dir ):
+    (header, directory, series) = gage_dir
+    os.remove( os.path.join( directory, "07289000.txt" ) )
+    with open( os.path.join( directory, "09999999.txt" ), "w" ) as f: f.write( "20100106 1.0\n" )
+    with open( os.path.join( directory, "08012000.txt" ), "a" ) as f: f.write( "2010013x 7.0\n20100301 n/a\n" )
+    gages = LISGageDataset.from_directory( header, directory, workers=2, cache=False )
+    assert gages.header['id'].tolist() == [ "07344370", "08012000" ]
+    assert sorted( gages._gages.columns ) == [ "07344370", "08012000" ]
+    assert gages.xa_gage_data( 1 ).values.tolist() == series["08012000"].tolist()
+    report = gages.ingest_report.loc["08012000"]
+    assert ( report['records'], report['malformed'], report['malformed_lines'] ) == ( 50, 2, [ 51, 52 ] )
+    assert gages.ingest_report.loc["07344370", 'malformed'] == 0
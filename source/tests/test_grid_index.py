@@ -0,0 +1,30 @@
+import numpy as np
+import xarray as xa
+from eis.lis.data.grid_index import LISGridIndex
+
+def grid_dataset( nlat: int = 20, nlon: int = 30, lat0: float = 30.0, lon0: float = -95.0, d: float = 0.1 ) -> xa.Dataset:
+    lat, lon = lat0 + d * np.arange( nlat ), lon0 + d * np.arange( nlon )
+    values = np.ones( ( 2, nlat, nlon ), dtype=np.float32 )
+    values[:, :, :5] = np.nan
+    return xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), values ) ), coords=dict( lat=lat, lon=lon ) )
+
+def test_out_of_domain_points_are_invalid():
+    index = LISGridIndex.from_coords( grid_dataset(), 'Streamflow_tavg' )
+    ics = index.query( [ -94.0, -94.0, -80.0, -94.48 ], [ 31.0, 40.0, 31.0, 31.0 ] )
+    assert ( ics['lon'][0], ics['lat'][0] ) == ( 10, 10 )
+    assert ics['lon'][1] == -1 and ics['lon'][2] == -1          # outside the domain
+    assert ics['lon'][3] == 5                                    # masked cell: nearest valid neighbour within one cell diagonal
+
+def test_unbounded_max_distance_snaps_to_edge():
+    index = LISGridIndex.from_coords( grid_dataset(), 'Streamflow_tavg', max_distance=None )
+    ics = index.query( -80.0, 31.0 )
+    assert ics['lon'][0] == 29
+
+def test_cached_index_is_validated( tmp_path ):
+    path = str( tmp_path / "grid_index.pkl" )
+    index = LISGridIndex.cached( path, grid_dataset(), 'Streamflow_tavg' )
+    assert LISGridIndex.cached( path, grid_dataset(), 'Streamflow_tavg' ).signature == index.signature
+    assert LISGridIndex.cached( path, grid_dataset(), 'Streamflow_tavg', max_distance=None ).max_distance is None
+    other = LISGridIndex.cached( path, grid_dataset( nlat=25 ), 'Streamflow_tavg' )
+    assert other.shape == ( 25, 30 )
+    assert LISGridIndex.cached( path, grid_dataset( nlat=25 ), None ).signature != other.signature
@@ -0,0 +1,13 @@
+import sys, json, subprocess
+
+DATA_MODULES = [ 'eis.lis.data.gage', 'eis.lis.data.routing', 'eis.lis.data.combined', 'eis.lis.data.surface', 'eis.s3', 'eis.rechunk' ]
+HEAVY_MODULES = [ 'holoviews', 'geoviews', 'panel', 'hvplot', 'geopandas', 'datashader', 'matplotlib', 'scipy' ]
+MAX_IMPORT_TIME = 15.0
+
+def test_data_layer_imports_no_viz_packages():
+    code = ( f"import sys, time, json; t0 = time.perf_counter(); import {', '.join( DATA_MODULES )}; t1 = time.perf_counter(); "
+             f"print( json.dumps( dict( time=t1-t0, loaded=[ m for m in {HEAVY_MODULES} if m in sys.modules ] ) ) )" )
+    output = subprocess.run( [ sys.executable, "-c", code ], capture_output=True, text=True, check=True ).stdout
+    result = json.loads( output.strip().splitlines()[-1] )
+    assert result['loaded'] == []
+    assert result['time'] < MAX_IMPORT_TIME
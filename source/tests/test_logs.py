@@ -0,0 +1,45 @@
+import os, time, logging
+from eis.logs import BatchingFileHandler, WorkerEventHandler, queued_handler, forward_worker_logs
+
+def wait_for( condition, timeout: float = 10.0 ) -> bool:
+    t0 = time.time()
+    while not condition():
+        if time.time() - t0 > timeout: return False
+        time.sleep( 0.05 )
+    return True
+
+def read( path: str ) -> str:
+    if not os.path.isfile( path ): return ""
+    with open( path ) as f: return f.read()
+
+def test_batched_records_are_flushed_after_a_quiet_period( tmp_path ):
+    path = str( tmp_path / "batched.log" )
+    handler = BatchingFileHandler( path, flush_interval=0.2 )
+    logger = logging.getLogger( "eis.test.batched" )
+    logger.addHandler( handler )
+    logger.warning( "first" )
+    logger.warning( "last before a quiet period" )
+    assert wait_for( lambda: "last before a quiet period" in read( path ), timeout=2.0 )
+    logger.removeHandler( handler )
+    handler.close()
+
+def log_on_worker( message: str, flush_interval: float ):
+    from distributed import get_worker
+    logger = logging.getLogger( f"eis.test.worker.{flush_interval}" )
+    if len( logger.handlers ) == 0:
+        logger.setLevel( logging.INFO )
+        logger.addHandler( queued_handler( [ WorkerEventHandler( get_worker(), flush_interval=flush_interval ) ] ) )
+    logger.info( message )
+
+def test_worker_records_are_forwarded( tmp_path ):
+    from distributed import Client, LocalCluster
+    path = str( tmp_path / "workers.log" )
+    with LocalCluster( n_workers=1, processes=False, dashboard_address=None ) as cluster, Client( cluster ) as client:
+        forward_worker_logs( client, path )
+        client.submit( log_on_worker, "periodic", 0.2, pure=False ).result()
+        assert wait_for( lambda: "periodic" in read( path ) )
+        client.submit( log_on_worker, "at teardown", 3600.0, pure=False ).result()
+        time.sleep( 0.5 )
+        assert "at teardown" not in read( path )
+        client.unregister_worker_plugin( "eis-worker-logs" )
+        assert wait_for( lambda: "at teardown" in read( path ) )
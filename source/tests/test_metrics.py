@@ -0,0 +1,62 @@
+import os, numpy as np, pandas as pd
+import xarray as xa
+from eis.lis.data.metrics import skill_scores, skill_table
+from eis.lis.data.gage import LISGageDataset
+from eis.lis.data.combined import LISCombinedDataset
+
+def nse( sim: np.ndarray, obs: np.ndarray ) -> float:
+    return 1 - np.sum( ( sim - obs ) ** 2 ) / np.sum( ( obs - obs.mean() ) ** 2 )
+
+def kge( sim: np.ndarray, obs: np.ndarray ) -> float:
+    r = np.corrcoef( sim, obs )[0,1]
+    return 1 - np.sqrt( ( r - 1 ) ** 2 + ( sim.std() / obs.std() - 1 ) ** 2 + ( sim.mean() / obs.mean() - 1 ) ** 2 )
+
+def series( values, start: str = "2010-01-01" ) -> xa.DataArray:
+    values = np.asarray( values, dtype=np.float64 )
+    time = pd.date_range( start, periods=values.shape[0] )
+    return xa.DataArray( values.reshape( values.shape[0], -1 ), dims=['time','site'], coords=dict( time=time, site=[ 'a' ] ) )
+
+def test_scores_match_hand_computed_values():
+    (obs, sim) = ( np.array( [ 1.0, 2.0, 3.0, 4.0, 5.0 ] ), np.array( [ 1.5, 2.0, 3.5, 3.0, 6.0 ] ) )
+    scores = skill_scores( series( sim ), series( obs ) ).isel( site=0 )
+    np.testing.assert_allclose( float( scores['nse'] ), nse( sim, obs ) )
+    np.testing.assert_allclose( float( scores['kge'] ), kge( sim, obs ) )
+    np.testing.assert_allclose( float( scores['bias'] ), sim.mean() - obs.mean() )
+    np.testing.assert_allclose( float( scores['rmse'] ), np.sqrt( np.mean( ( sim - obs ) ** 2 ) ) )
+
+def test_steps_missing_in_either_series_are_masked():
+    obs = np.array( [ 1.0, 2.0, np.nan, 4.0, 5.0, 3.0 ] )
+    sim = np.array( [ 1.5, 2.0, 3.5, np.nan, 6.0, 2.0 ] )
+    valid = np.isfinite( obs ) & np.isfinite( sim )
+    scores = skill_scores( series( sim ), series( obs ) ).isel( site=0 )
+    assert int( scores['n'] ) == 4
+    np.testing.assert_allclose( float( scores['nse'] ), nse( sim[valid], obs[valid] ) )
+    np.testing.assert_allclose( float( scores['kge'] ), kge( sim[valid], obs[valid] ) )
+
+def test_window_and_season_groups():
+    rng = np.random.default_rng(1)
+    obs = rng.random( 365 ) + 1.0
+    sim = obs + 0.2 * rng.random( 365 )
+    table = skill_table( series( sim ), series( obs ), time_window=( "2010-02-01", "2010-03-31" ) )
+    np.testing.assert_allclose( table['nse'].iloc[0], nse( sim[31:90], obs[31:90] ) )
+    table = skill_table( series( sim ), series( obs ), groupby='season' ).set_index( 'season' )
+    summer = slice( 151, 243 )                                           # Jun 1 - Aug 31
+    np.testing.assert_allclose( table.loc['JJA','kge'], kge( sim[summer], obs[summer] ) )
+
+def test_gages_are_aligned_by_id( routing_data, gage_dir ):
+    (header, directory, observed) = gage_dir
+    files = sorted( os.path.join( directory, f"{gid}.txt" ) for gid in [ '07344370', '07289000' ] )     # no file for 08012000
+    gages = LISGageDataset( header, files, cache=False )
+    combined = LISCombinedDataset( gages, routing_data )
+    (rdata, gdata) = combined.aligned_matrices( 'Streamflow_tavg' )
+    assert list( gdata['site'].values ) == [ '07344370', '07289000' ]
+    for gid in [ '07344370', '07289000' ]:
+        gseries = gdata.sel( site=gid ).to_series().dropna()
+        pd.testing.assert_series_equal( gseries, observed[gid], check_names=False, check_index_type=False, check_freq=False )
+        lon, lat = float( rdata['lon'].sel( site=gid ) ), float( rdata['lat'].sel( site=gid ) )
+        expected = routing_data.dset['Streamflow_tavg'].sel( lon=lon, lat=lat, method='nearest' )
+        np.testing.assert_allclose( rdata.sel( site=gid ).values, expected.sel( time=rdata.time ).values )
+    table = combined.skill_metrics( [ 'Streamflow_tavg' ] ).set_index( 'site' )
+    (sim, obs) = ( rdata.sel( site='07344370' ).values, gdata.sel( site='07344370' ).values )
+    valid = np.isfinite( obs )
+    np.testing.assert_allclose( table.loc['07344370','nse'], nse( sim[valid].astype( np.float64 ), obs[valid] ), rtol=1e-5 )
@@ -0,0 +1,60 @@
+import re, json, math
+import pytest
+import dask.array as da
+from eis.cluster import ClusterInformationManager
+
+SAMPLE = re.compile( r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-z_]+="[^"]*"\})? (-?[0-9.e+-]+|nan)$' )
+
+def parse_exposition( text: str ) -> dict:
+    """{sample name with labels: value}, checking every line is a TYPE comment or a sample of the last declared metric."""
+    samples, declared = {}, None
+    for line in text.strip().splitlines():
+        if line.startswith( "# TYPE " ):
+            (name, kind) = line.split()[2:]
+            assert kind in ( 'summary', 'counter', 'gauge' )
+            declared = name
+            continue
+        assert SAMPLE.match( line ), line
+        (name, value) = line.rsplit( " ", 1 )
+        assert name.split( "{" )[0] in ( declared, f"{declared}_sum", f"{declared}_count" ), line
+        samples[name] = float( value )
+    return samples
+
+def test_percentiles_and_counters():
+    cim = ClusterInformationManager()
+    for value in range( 1, 101 ): cim.add( "s3.read", float( value ) )
+    assert cim.percentiles( "s3.read" ) == pytest.approx( { 50: 50.5, 90: 90.1, 99: 99.01 } )
+    assert all( math.isnan( v ) for v in cim.percentiles( "missing" ).values() )
+    cim.count( "s3.bytes_read", 1024 )
+    cim.count( "s3.bytes_read", 512 )
+    cim.count( "cache.hits" )
+    assert ( cim.counter( "s3.bytes_read" ), cim.counter( "cache.hits" ), cim.counter( "missing" ) ) == ( 1536, 1, 0 )
+    summary = cim.summary()
+    assert summary['histograms']['s3.read'] == pytest.approx( dict( count=100, mean=50.5, p50=50.5, p90=90.1, p99=99.01 ) )
+    assert summary['counters'] == { "s3.bytes_read": 1536, "cache.hits": 1 }
+
+def test_prometheus_exposition_format():
+    cim = ClusterInformationManager()
+    for value in range( 1, 101 ): cim.add( "s3.read", float( value ) )
+    cim.count( "s3.bytes_read", 1536 )
+    samples = parse_exposition( cim.prometheus() )
+    assert samples == pytest.approx( { 'eis_s3_read{quantile="0.5"}': 50.5, 'eis_s3_read{quantile="0.9"}': 90.1, 'eis_s3_read{quantile="0.99"}': 99.01,
+                        'eis_s3_read_sum': 5050.0, 'eis_s3_read_count': 100.0, 'eis_s3_bytes_read_total': 1536.0 } )
+
+def test_profiles_are_exported_as_metrics( tmp_path ):
+    cim = ClusterInformationManager()
+    data = da.ones( ( 40, 40 ), chunks=( 10, 10 ) )
+    for _ in range( 2 ):
+        with cim.profile( "rechunk.test", dt=0.01 ):
+            ( data + 1 ).sum().compute( scheduler='sync' )
+    profile = cim.summary()['profiles']['rechunk.test']
+    assert profile['ntasks'] > 16 and profile['wall_time'] > 0
+    assert cim.summary()['histograms']['rechunk.test']['count'] == 2
+    assert cim.counter( "rechunk.test.tasks" ) == 2 * profile['ntasks']
+    samples = parse_exposition( cim.prometheus() )
+    assert samples['eis_rechunk_test_count'] == 2
+    assert samples['eis_rechunk_test_tasks_total'] == 2 * profile['ntasks']
+    assert 'eis_rechunk_test_peak_memory_mb' in samples and 'eis_rechunk_test_mean_cpu' in samples
+    assert sum( v for k, v in samples.items() if k.startswith( 'eis_rechunk_test_task_seconds{' ) ) == pytest.approx( sum( profile['task_time'].values() ) )
+    cim.export( str( tmp_path / "metrics.json" ) )
+    with open( tmp_path / "metrics.json" ) as f: assert json.load( f )['counters']['rechunk.test.tasks'] == 2 * profile['ntasks']
@@ -0,0 +1,41 @@
+import numpy as np, pandas as pd
+import xarray as xa
+from eis.lis.data.pyramid import LISPyramid
+
+def lis_map_dataset() -> xa.Dataset:
+    (nt, nlat, nlon) = ( 3, 16, 32 )
+    rng = np.random.default_rng(0)
+    return xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), rng.random( ( nt, nlat, nlon ) ) ), SoilMoist_tavg=( ('time','lat','lon'), rng.random( ( nt, nlat, nlon ) ) ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ), lat=30.0 + 0.1 * np.arange( nlat ), lon=-95.0 + 0.1 * np.arange( nlon ) ) )
+
+def coarsened( values: np.ndarray, factor: int, reduction: str ) -> np.ndarray:
+    (nt, ny, nx) = values.shape
+    return getattr( values.reshape( nt, ny // factor, factor, nx // factor, factor ), reduction )( axis=( 2, 4 ) )
+
+def test_build_levels_and_reopen( tmp_path ):
+    dset = lis_map_dataset()
+    path = str( tmp_path / "lis.zarr.pyramid" )
+    pyramid = LISPyramid( dset, path )
+    pyramid.build( nlevels=3 )
+    assert [ ( l.sizes['lat'], l.sizes['lon'] ) for l in pyramid.levels ] == [ ( 16, 32 ), ( 8, 16 ), ( 4, 8 ), ( 2, 4 ) ]
+    for level in range( 1, 4 ):
+        factor = 2 ** level
+        np.testing.assert_allclose( pyramid.levels[level]['Streamflow_tavg'].values, coarsened( dset['Streamflow_tavg'].values, factor, 'max' ) )
+        np.testing.assert_allclose( pyramid.levels[level]['SoilMoist_tavg'].values, coarsened( dset['SoilMoist_tavg'].values, factor, 'mean' ) )
+    assert LISPyramid( dset, path ).nlevels == 4
+
+    pyramid.build( nlevels=10, reductions=dict( Streamflow_tavg='mean' ) )
+    assert pyramid.nlevels == 5
+    np.testing.assert_allclose( pyramid.levels[1]['Streamflow_tavg'].values, coarsened( dset['Streamflow_tavg'].values, 2, 'mean' ) )
+
+def test_select_level_matches_viewport_resolution( tmp_path ):
+    pyramid = LISPyramid( lis_map_dataset(), str( tmp_path / "lis.zarr.pyramid" ) )
+    pyramid.build( nlevels=3 )
+    full = ( ( -95.0, -91.8 ), ( 30.0, 31.6 ) )                  # 32 x 16 full-resolution cells
+    assert pyramid.select_level( *full, width=32, height=16 ) == 0
+    assert pyramid.select_level( *full, width=12, height=6 ) == 1
+    assert pyramid.select_level( *full, width=6, height=3 ) == 2
+    assert pyramid.select_level( *full, width=2, height=1 ) == 3
+    assert pyramid.select_level( *full, width=800, height=600 ) == 0
+    assert pyramid.select_level( ( -95.0, -94.2 ), ( 30.0, 30.4 ), width=3, height=1 ) == 1
+    assert pyramid.view( 'Streamflow_tavg', None, None, width=6, height=3 ).shape == ( 4, 8 )
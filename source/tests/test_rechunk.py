@@ -0,0 +1,61 @@
+import numpy as np, pandas as pd
+import xarray as xa
+import pytest
+from eis.rechunk import Rechunker, RechunkManifest
+
+def source_dataset( path: str ) -> xa.Dataset:
+    """A LIS-like store: chunked time=1, as every LIS output store is."""
+    (nt, nlat, nlon) = ( 50, 20, 30 )
+    values = np.random.default_rng(0).random( ( nt, nlat, nlon ), dtype=np.float32 )
+    dset = xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), values ), mask=( ('lat','lon'), values[0] > 0.5 ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ), lat=np.arange( nlat ) * 0.1, lon=np.arange( nlon ) * 0.1 ) )
+    dset.chunk( dict( time=1 ) ).to_zarr( path, consolidated=True )
+    return xa.open_zarr( path, consolidated=True )
+
+@pytest.mark.parametrize( "existing", [ False, True ] )
+def test_resume_after_interruption( tmp_path, monkeypatch, existing ):
+    source = source_dataset( str( tmp_path / "source.zarr" ) )
+    target = str( tmp_path / "target" )
+    if existing: ( tmp_path / "target.zarr" ).mkdir()
+    rechunker = Rechunker( "source", source, data_dir=str( tmp_path ), cache_dir=str( tmp_path ) )
+    chunk_sizes = dict( time=20, lat=10, lon=10 )
+
+    mark_complete = RechunkManifest.mark_complete
+    def interrupt( manifest, vname, region_start ):
+        if region_start >= 20: raise KeyboardInterrupt( "killed" )
+        mark_complete( manifest, vname, region_start )
+    monkeypatch.setattr( RechunkManifest, "mark_complete", interrupt )
+    with pytest.raises( KeyboardInterrupt ):
+        rechunker.rechunk( chunk_sizes, resume=True, target_store=target )
+    monkeypatch.setattr( RechunkManifest, "mark_complete", mark_complete )
+
+    store = rechunker.rechunk( chunk_sizes, resume=True, target_store=target )
+    assert RechunkManifest.load( store ).completed == { 'Streamflow_tavg': [ 0, 20, 40 ] }
+    result = xa.open_zarr( store, consolidated=True )
+    assert result['Streamflow_tavg'].encoding['chunks'] == ( 20, 10, 10 )
+    xa.testing.assert_identical( result.load(), source.load() )
+
+def test_append_after_rechunk( tmp_path ):
+    source = source_dataset( str( tmp_path / "source.zarr" ) )
+    target = str( tmp_path / "target" )
+    chunk_sizes = dict( time=20, lat=10, lon=10 )
+    Rechunker( "head", source.isel( time=slice( 0, 30 ) ), data_dir=str( tmp_path ), cache_dir=str( tmp_path ) ).rechunk( chunk_sizes, target_store=target )
+    assert ( tmp_path / "target.zarr" / ".zmetadata" ).exists()
+
+    store = Rechunker( "source", source, data_dir=str( tmp_path ), cache_dir=str( tmp_path ) ).rechunk( chunk_sizes, append=True, target_store=target )
+    result = xa.open_zarr( store, consolidated=True )
+    assert result['Streamflow_tavg'].encoding['chunks'] == ( 20, 10, 10 )
+    xa.testing.assert_identical( result.load(), source.load() )
+
+def test_append_requires_compatible_target( tmp_path ):
+    source = source_dataset( str( tmp_path / "source.zarr" ) )
+    target = str( tmp_path / "target" )
+    rechunker = Rechunker( "source", source, data_dir=str( tmp_path ), cache_dir=str( tmp_path ) )
+    with pytest.raises( Exception, match="No existing target store" ):
+        rechunker.rechunk( dict( time=20, lat=10, lon=10 ), append=True, target_store=target )
+    assert not ( tmp_path / "target.zarr" ).exists()
+
+    Rechunker( "head", source.isel( time=slice( 0, 30 ) ), data_dir=str( tmp_path ), cache_dir=str( tmp_path ) ).rechunk( dict( time=20, lat=10, lon=10 ), target_store=target )
+    with pytest.raises( Exception, match="lat chunks 10" ):
+        rechunker.rechunk( dict( time=20, lat=5, lon=10 ), append=True, target_store=target )
+    assert xa.open_zarr( f"{target}.zarr", consolidated=True ).sizes['time'] == 30
@@ -0,0 +1,27 @@
+import numpy as np, pandas as pd
+import xarray as xa
+import pytest, zarr
+from eis.s3 import S3ChunkStore
+
+def test_chunk_writes_are_batched( s3fs_moto, monkeypatch ):
+    store = S3ChunkStore( s3fs_moto, "s3://eis-test/batched.zarr", max_concurrency=4 )
+    batches = []
+    setitems = S3ChunkStore.setitems
+    monkeypatch.setattr( S3ChunkStore, "setitems", lambda self, values: ( batches.append( len( values ) ), setitems( self, values ) ) )
+    array = zarr.open_array( store, mode='w', shape=( 100, 10 ), chunks=( 10, 10 ), dtype='f4' )
+    assert isinstance( array.chunk_store, S3ChunkStore )
+    data = np.arange( 1000, dtype='f4' ).reshape( 100, 10 )
+    array[:] = data
+    assert batches[-1] == 10
+    assert store.nbytes_written > 0
+    np.testing.assert_array_equal( zarr.open_array( store, mode='r' )[:], data )
+
+def test_dataset_roundtrip( s3fs_moto ):
+    dset = xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), np.random.default_rng(0).random( ( 12, 5, 6 ), dtype=np.float32 ) ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=12 ), lat=np.arange(5) * 0.1, lon=np.arange(6) * 0.1 ) )
+    store = S3ChunkStore( s3fs_moto, "s3://eis-test/dataset.zarr" )
+    dset.chunk( dict( time=4 ) ).to_zarr( store, mode='w', consolidated=True )
+    assert "MB/s" in store.report()
+    xa.testing.assert_identical( xa.open_zarr( store, consolidated=True ).load(), dset )
+    store.clear()
+    assert len( store ) == 0
@@ -0,0 +1,48 @@
+import asyncio, time, numpy as np, pandas as pd
+import xarray as xa
+import dask.array as da
+from tornado.httpclient import AsyncHTTPClient
+from eis.lis.data.routing import LISRoutingData
+from eis.lis.data.export import read_npz
+from eis.lis.service import LISQueryService
+
+def routing_data() -> LISRoutingData:
+    (nt, ny, nx) = ( 40, 6, 8 )
+    values = np.random.default_rng(0).random( ( nt, ny, nx ), dtype=np.float32 )
+    lon, lat = np.meshgrid( -95.0 + 0.1 * np.arange( nx ), 30.0 + 0.1 * np.arange( ny ) )
+    dset = xa.Dataset( dict( Streamflow_tavg=( ('time','north_south','east_west'), values ),
+                             lat=( ('north_south','east_west'), lat ), lon=( ('north_south','east_west'), lon ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ) ),
+                       attrs=dict( DX=0.1, DY=0.1, SOUTH_WEST_CORNER_LAT=30.0, SOUTH_WEST_CORNER_LON=-95.0 ) )
+    return LISRoutingData( dset.chunk( dict( time=10 ) ) )
+
+def slow( data: xa.DataArray, factor: float ) -> xa.DataArray:
+    def compute( block ):
+        time.sleep( 0.2 )
+        return block * factor
+    return data.copy( data=da.map_blocks( compute, data.data, dtype=data.dtype, meta=np.array( (), dtype=data.dtype ) ) )
+
+async def fetch( port: int, n: int ):
+    client = AsyncHTTPClient()
+    url = f"http://127.0.0.1:{port}/point?var=scaled&lon=-94.5&lat=30.2&format=npz"
+    responses = await asyncio.gather( *[ client.fetch( url ) for _ in range( n ) ] )
+    return [ read_npz( response.body ) for response in responses ]
+
+def test_concurrent_queries_coalesce_and_redefinitions_are_served():
+    routing = routing_data()
+    routing.add_variable( 'scaled', lambda q: slow( q, 2.0 ), [ 'Streamflow_tavg' ] )
+    expected = routing.dset['Streamflow_tavg'].isel( lon=5, lat=2 ).values
+    service = LISQueryService( routing )
+    async def run():
+        server = service.listen( 0 )
+        port = list( server._sockets.values() )[0].getsockname()[1]
+        try:
+            results = await fetch( port, 5 )
+            assert service.coalesced == 4
+            for result in results: np.testing.assert_allclose( result.values, expected * 2.0 )
+            routing.add_variable( 'scaled', lambda q: slow( q, 3.0 ), [ 'Streamflow_tavg' ] )
+            ( result, ) = await fetch( port, 1 )
+            np.testing.assert_allclose( result.values, expected * 3.0 )
+        finally:
+            server.stop()
+    asyncio.run( run() )
@@ -0,0 +1,59 @@
+import os, time
+import numpy as np
+import xarray as xa
+import dask.array as da
+import pytest
+from eis.lis.data.gage import LISGageDataset
+from eis.lis.data.combined import LISCombinedDataset
+
+VNAME = 'Streamflow_tavg'
+WINDOW = ( "2010-01-15", "2010-01-24" )          # routing time chunks are 10 days from 2010-01-01: the window spans chunks 1 and 2
+
+@pytest.fixture
+def reads( routing_data ) -> list:
+    """Records the start time index of every Streamflow chunk read from routing_data."""
+    reads = []
+    def counted( block, block_info=None ):
+        reads.append( block_info[0]['array-location'][0][0] )
+        return block
+    source = routing_data.dset[VNAME].data
+    routing_data.dset[VNAME] = routing_data.dset[VNAME].copy( data=da.map_blocks( counted, source, dtype=source.dtype, meta=np.array( (), dtype=source.dtype ) ) )
+    return reads
+
+def test_windowed_var_data_reads_only_overlapping_chunks( routing_data, reads, gage_dir ):
+    sites = LISGageDataset.from_directory( *gage_dir[:2], workers=1, cache=False ).header
+    (lon, lat) = ( sites['lon'][0], sites['lat'][0] )
+    routing_data.get_indices( lon, lat )
+    reads.clear()
+    full = routing_data.var_data( VNAME, lon, lat )
+    assert sorted( set( reads ) ) == [ 0, 10, 20, 30, 40, 50 ]
+    reads.clear()
+    windowed = routing_data.var_data( VNAME, lon, lat, ts=WINDOW )
+    assert sorted( set( reads ) ) == [ 10, 20 ]
+    assert ( windowed['time'].values[0], windowed['time'].values[-1] ) == ( np.datetime64( WINDOW[0] ), np.datetime64( WINDOW[1] ) )
+    xa.testing.assert_identical( windowed, full.sel( time=slice( *WINDOW ) ) )
+    assert routing_data.var_export( VNAME, lon, lat, ts=WINDOW ).num_rows == 10
+    sdata = routing_data.sites_data( VNAME, sites, ts=WINDOW )
+    assert sdata.sizes['time'] == 10
+    np.testing.assert_allclose( sdata.isel( site=0 ).values, windowed.values )
+
+def test_windowed_aligned_data_prefetches_full_series( routing_data, reads, gage_dir ):
+    (header, directory, observed) = gage_dir
+    files = sorted( os.path.join( directory, f ) for f in os.listdir( directory ) if f != "header.txt" )
+    combined = LISCombinedDataset( LISGageDataset( header, files, cache=False ), routing_data )
+    direct = xa.align( combined.get_routing_data( 1, VNAME ), combined.get_gage_data( 1 ) )
+    reads.clear()
+
+    windowed = combined.get_aligned_data( 1, VNAME, WINDOW )
+    for (wdata, ddata) in zip( windowed, direct ):
+        xa.testing.assert_identical( wdata, ddata.sel( time=slice( *WINDOW ) ) )
+    t0 = time.time()
+    while ( ( 1, VNAME ) not in combined._aligned_cache ) and ( time.time() - t0 < 10 ): time.sleep( 0.02 )
+    for (cdata, ddata) in zip( combined._aligned_cache[ ( 1, VNAME ) ], direct ):
+        xa.testing.assert_identical( cdata, ddata )
+    nreads = len( reads )
+    later = combined.get_aligned_data( 1, VNAME, ( "2010-02-01", "2010-02-10" ) )
+    assert len( reads ) == nreads
+    for (ldata, ddata) in zip( later, direct ):
+        xa.testing.assert_identical( ldata, ddata.sel( time=slice( "2010-02-01", "2010-02-10" ) ) )
+    np.testing.assert_allclose( later[1].values, observed[ combined.gage_data.header_id( 1 ) ].loc["2010-02-01":"2010-02-10"].values )
@@ -0,0 +1,28 @@
+import numpy as np, pandas as pd
+import xarray as xa
+from shapely.geometry import box, Point
+from eis.lis.data.zonal import ZonalStatistics
+
+def grid_dataset() -> xa.Dataset:
+    (nt, nlat, nlon) = ( 6, 10, 12 )
+    values = np.random.default_rng(0).random( ( nt, nlat, nlon ) )
+    values[0, 3, 4] = np.nan
+    return xa.Dataset( dict( Streamflow_tavg=( ('time','lat','lon'), values ) ),
+                       coords=dict( time=pd.date_range( "2010-01-01", periods=nt ), lat=40.0 + 0.1 * np.arange( nlat ), lon=-95.0 + 0.1 * np.arange( nlon ) ) ).chunk( dict( time=2 ) )
+
+def test_box_zone_matches_cos_lat_weighted_mean( tmp_path ):
+    dset = grid_dataset()
+    zone = box( -94.75, 40.15, -94.35, 40.55 )                         # cell edges: covers lon 3..6, lat 2..5 entirely
+    result = ZonalStatistics( dset, [ zone ], cache_dir=str( tmp_path ) ).compute( 'Streamflow_tavg' )
+    cells = dset['Streamflow_tavg'].isel( lat=slice( 2, 6 ), lon=slice( 3, 7 ) )
+    expected = cells.weighted( np.cos( np.deg2rad( cells.lat ) ) ).mean( [ 'lat', 'lon' ] )
+    assert result['Streamflow_tavg_mean'].dims == ( 'time', 'zone' )
+    np.testing.assert_allclose( result['Streamflow_tavg_mean'].isel( zone=0 ).values, expected.values )
+    np.testing.assert_allclose( result['Streamflow_tavg_max'].isel( zone=0 ).values, cells.max( [ 'lat', 'lon' ] ).values )
+    np.testing.assert_allclose( result['Streamflow_tavg_sum'].isel( zone=0 ).values, cells.sum( [ 'lat', 'lon' ] ).values )
+
+def test_polygon_smaller_than_a_subsample_cell( tmp_path ):
+    dset = grid_dataset()
+    zone = Point( -94.5, 40.5 ).buffer( 0.005 )                       # centre of cell (lat=5, lon=5), between its subsample points
+    result = ZonalStatistics( dset, [ zone ], cache_dir=str( tmp_path ) ).compute( 'Streamflow_tavg', stats=[ 'mean' ] )
+    np.testing.assert_allclose( result['Streamflow_tavg_mean'].isel( zone=0 ).values, dset['Streamflow_tavg'].isel( lat=5, lon=5 ).values )